@@ -3,6 +3,7 @@ import copy
 import datetime
 import io
 import json
+import mimetypes
 import os
 import shutil
 import subprocess
@@ -29,21 +30,40 @@ from py4web import (
 from py4web.core import DAL, Fixture, Reloader, Session, dumps, error_logger, safely
 from py4web.utils.factories import ActionFactory
 
-from .diff2kryten import diff2kryten
+from .diff2kryten import diff2kryten, render, render_lines
+from .dirindex import DirectoryIndex
+from .filestream import iter_file, parse_range, read_window
+from .githistory import GitHistory, git_lines
+from .hotreload import HotReloader
+from .ticketstore import TicketStore
 from .utils import *
+from .zipstream import zip_app
 
 MODE = os.environ.get("PY4WEB_DASHBOARD_MODE", "none")
 FOLDER = os.environ["PY4WEB_APPS_FOLDER"]
 APP_NAMES = os.environ.get("PY4WEB_APP_NAMES")
+PACK_EXCLUDE = os.environ.get("PY4WEB_DASHBOARD_PACK_EXCLUDE", "")
 APP_FOLDER = os.path.dirname(__file__)
 T_FOLDER = os.path.join(APP_FOLDER, "translations")
 T = Translator(T_FOLDER)
 
 session = Session()
+TICKET_RETENTION_DAYS = int(os.environ.get("PY4WEB_DASHBOARD_TICKET_RETENTION_DAYS", 7))
+TICKET_MAX = int(os.environ.get("PY4WEB_DASHBOARD_TICKET_MAX", 10000))
+TICKET_PAGE_SIZE = 50
+DIRECTORY_INDEX = DirectoryIndex()
+GIT_HISTORY = GitHistory()
+HOT_RELOADER = HotReloader(FOLDER)
+REST_POLICIES = {}  # (app name, db name) -> (app module, Policy)
+REST_MAX_LIMIT = 100
+REST_MAX_OFFSET = 500  # rows skipped at most by @offset, for orders other than id
 
 
 def make_safe(db):
     def make_safe_field(func):
+        if getattr(func, "_dashboard_safe", False):
+            return func  # already wrapped
+
         def wrapper():
             try:
                 return func()
@@ -52,6 +72,9 @@ def make_safe(db):
                 print("Warning: _dashboard trying to access a forbidden method of app")
                 return None
 
+        wrapper._dashboard_safe = True
+        return wrapper
+
     for table in db:
         for field in table:
             if callable(field.default):
@@ -60,6 +83,69 @@ def make_safe(db):
                 field.update = make_safe_field(field.update)
 
 
+def install_ticket_store():
+    """Puts a TicketStore in place of py4web's database error logger"""
+    logger = error_logger.database_logger
+    if logger is not None and not isinstance(logger, TicketStore):
+        logger = error_logger.database_logger = TicketStore(
+            logger.db, retention_days=TICKET_RETENTION_DAYS, max_tickets=TICKET_MAX
+        )
+    return logger
+
+
+# the tickets database, for dbadmin
+db = getattr(safely(install_ticket_store, log=True), "db", None)
+
+
+def rest_policy(app_name, module, dbname):
+    """The rest Policy of a db of an app (made safe), once per app load
+
+    GET leaves out blob fields (rest/<app>/<db>/<table>/<id>/<field>
+    returns one) and returns at most REST_MAX_LIMIT rows.
+    """
+    key = (app_name, dbname)
+    cached = REST_POLICIES.get(key)
+    if cached and cached[0] is module:
+        return cached[1]
+    db = getattr(module, dbname)
+    make_safe(db)
+    policy = Policy()
+    for table in db:
+        policy.set(
+            table._tablename,
+            "GET",
+            authorize=True,
+            allowed_patterns=["**"],
+            allow_lookup=True,
+            fields=[name for name in table.fields if table[name].type != "blob"],
+            limit=REST_MAX_LIMIT,
+        )
+        policy.set(table._tablename, "PUT", authorize=True, fields=table.fields)
+        policy.set(table._tablename, "POST", authorize=True, fields=table.fields)
+        policy.set(table._tablename, "DELETE", authorize=True)
+    REST_POLICIES[key] = (module, policy)
+    return policy
+
+
+def rest_blob(db, tablename, id, fieldname):
+    """The value of one blob field of one row, on demand"""
+    if request.method != "GET":
+        raise HTTP(405)
+    if tablename not in db.tables or not id.isdigit():
+        raise HTTP(404)
+    table = db[tablename]
+    if fieldname not in table.fields or table[fieldname].type != "blob":
+        raise HTTP(404)
+    row = action.uses(db)(
+        lambda: db(table._id == int(id)).select(table[fieldname]).first()
+    )()
+    if not row:
+        raise HTTP(404)
+    value = row[fieldname] or b""
+    response.headers["Content-Type"] = "application/octet-stream"
+    return value if isinstance(value, bytes) else value.encode("latin1")
+
+
 def run(command, project):
     """for runing git commands inside an app (project)"""
     return subprocess.check_output(
@@ -67,23 +153,9 @@ def run(command, project):
     ).decode(errors="ignore")
 
 
-def get_commits(project):
-    """list of git commits for the project"""
-    output = run("git log", project)
-    commits = []
-    for line in output.split("\n"):
-        if line.startswith("commit "):
-            commit = {"code": line[7:], "message": "", "author": "", "date": ""}
-            commits.append(commit)
-        elif line.startswith("Author: "):
-            commit["author"] = line[8:]
-        elif line.startswith("Date: "):
-            commit["date"] = datetime.datetime.strptime(
-                line[6:].strip(), "%a %b %d %H:%M:%S %Y %z"
-            )
-        else:
-            commit["message"] += line.strip() + "\n"
-    return commits
+def get_commits(project, page=0):
+    """one page of git commits for the project, and if there are more"""
+    return GIT_HISTORY.page(os.path.join(FOLDER, project), page)
 
 
 def get_branches(project):
@@ -243,80 +315,109 @@ if MODE in ("demo", "readonly", "full"):
     @action("walk/<path:path>")
     @session_secured
     def walk(path):
-        """Returns a nested folder structure as a tree"""
-        top = os.path.join(FOLDER, path)
-        if not os.path.exists(top) or not os.path.isdir(top):
+        """Returns a nested folder structure as a tree, ?depth=1 for one level"""
+        top = safe_join(FOLDER, path) or abort()
+        depth = request.query.get("depth")
+        if depth is not None and (not depth.isdigit() or int(depth) < 1):
+            raise HTTP(400)
+        if not os.path.isdir(top):
             return {"status": "error", "message": "folder does not exist"}
-        store = {}
-        for root, dirs, files in os.walk(top, topdown=False):
-            store[root] = {
-                "dirs": list(
-                    sorted(
-                        [
-                            {"name": dir, "content": store[os.path.join(root, dir)]}
-                            for dir in dirs
-                            if dir[0] != "." and dir[:2] != "__"
-                        ],
-                        key=lambda item: item["name"],
-                    )
-                ),
-                "files": list(
-                    sorted(
-                        [
-                            f
-                            for f in files
-                            if f[0] != "." and f[-1] != "~" and f[-4:] != ".pyc"
-                        ]
-                    )
-                ),
-            }
-        return {"payload": store[top], "status": "success"}
+        try:
+            tree = DIRECTORY_INDEX.tree(top, depth and int(depth))
+        except OSError:
+            return {"status": "error", "message": "folder does not exist"}
+        return {"payload": tree, "status": "success"}
 
     @action("load/<path:path>")
     @session_secured
     def load(path):
-        """Loads a text file"""
+        """Loads a text file, or a window of it
+
+        ?offset=<byte>&lines=<n> returns the lines from a byte offset, at
+        most WINDOW_BYTES of them. The reply tells the offset of the next
+        window and eof, so the editor pages through large files.
+        """
         path = safe_join(FOLDER, path) or abort()
-        content = open(path, "rb").read().decode("utf8", errors="ignore")
-        return {"payload": content, "status": "success"}
+        if not os.path.isfile(path):
+            abort(404)
+        try:
+            offset = int(request.query.get("offset") or 0)
+            lines = request.query.get("lines")
+            lines = int(lines) if lines else None
+        except ValueError:
+            raise HTTP(400)
+        if offset < 0 or (lines is not None and lines < 1):
+            raise HTTP(400)
+        window = read_window(path, offset, lines)
+        window["status"] = "success"
+        return window
 
     @action("load_bytes/<path:path>")
     @session_secured
     def load_bytes(path):
-        """Loads a binary file"""
+        """Streams a binary file, honoring a Range header"""
         path = safe_join(FOLDER, path) or abort()
-        return open(path, "rb").read()
+        if not os.path.isfile(path):
+            abort(404)
+        size = os.path.getsize(path)
+        start, end = 0, size
+        range_header = request.headers.get("Range")
+        if range_header:
+            first_range = parse_range(range_header, size)
+            if not first_range:
+                raise HTTP(416, headers={"Content-Range": "bytes */%s" % size})
+            start, end = first_range
+            response.status = 206
+            response.headers["Content-Range"] = "bytes %s-%s/%s" % (start, end - 1, size)
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["Content-Length"] = str(end - start)
+        response.headers["Content-Type"] = (
+            mimetypes.guess_type(path)[0] or "application/octet-stream"
+        )
+        return iter_file(path, start, end)
 
     @action("packed/<path:path>")
     @session_secured
     def packed(path):
-        """Packs an app"""
+        """Packs an app, streamed as it is zipped
+
+        ?exclude=databases,uploads leaves out these folders of the app
+        (PY4WEB_DASHBOARD_PACK_EXCLUDE sets the default).
+        """
         appname = path.split(".")[-2]
         # some security
         app_dir = os.path.join(FOLDER, appname)
         if "/" in path or appname.startswith(".") or not os.path.exists(app_dir):
             raise HTTP(400)
-        store = io.BytesIO()
-        zip = zipfile.ZipFile(store, mode="w", compression=zipfile.ZIP_DEFLATED)
-        for root, dirs, files in os.walk(app_dir, topdown=False):
-            if not root.startswith("."):
-                for name in files:
-                    if not (
-                        name.endswith("~") or name.endswith(".pyc") or name[:1] in "#."
-                    ):
-                        filename = os.path.join(root, name)
-                        short = filename[len(app_dir + os.path.sep) :]
-                        zip.write(filename, short)
-        zip.close()
-        data = store.getvalue()
+        exclude = request.query.get("exclude", PACK_EXCLUDE)
+        exclude = [name for name in exclude.split(",") if name and ".." not in name]
         response.headers["Content-Type"] = "application/zip"
-        return data
+        return zip_app(app_dir, exclude)
 
     @action("tickets")
     @session_secured
     def tickets():
-        """Returns most recent tickets grouped by path+error"""
-        tickets = safely(error_logger.database_logger.get) if MODE != "DEMO" else None
+        """Returns most recent tickets grouped by path+error
+
+        ?search= (part of the path or error), ?app= and ?page= filter and
+        page the groups, TICKET_PAGE_SIZE at a time.
+        """
+        try:
+            page = max(0, int(request.query.get("page") or 0))
+        except ValueError:
+            raise HTTP(400)
+        tickets = (
+            safely(
+                lambda: error_logger.database_logger.get(
+                    search=request.query.get("search"),
+                    app_name=request.query.get("app"),
+                    page=page,
+                    page_size=TICKET_PAGE_SIZE,
+                )
+            )
+            if MODE != "DEMO"
+            else None
+        )
         return {"payload": tickets or []}
 
     @action("clear")
@@ -360,8 +461,7 @@ if MODE in ("demo", "readonly", "full"):
         if len(args) == 1:
 
             def tables(name):
-                db = getattr(module, name)
-                make_safe(db)
+                rest_policy(app_name, module, name)
                 return [
                     {
                         "name": t._tablename,
@@ -378,23 +478,28 @@ if MODE in ("demo", "readonly", "full"):
             }
         elif len(args) > 2 and args[1] in databases:
             db = getattr(module, args[1])
-            make_safe(db)
+            policy = rest_policy(app_name, module, args[1])
+            if len(args) == 5:
+                return rest_blob(db, *args[2:])
             id = args[3] if len(args) == 4 else None
-            policy = Policy()
-            for table in db:
-                policy.set(
-                    table._tablename,
-                    "GET",
-                    authorize=True,
-                    allowed_patterns=["**"],
-                    allow_lookup=True,
-                    fields=table.fields,
-                )
-                policy.set(table._tablename, "PUT", authorize=True, fields=table.fields)
-                policy.set(
-                    table._tablename, "POST", authorize=True, fields=table.fields
-                )
-                policy.set(table._tablename, "DELETE", authorize=True)
+            vars = dict(request.query)
+            if request.method == "GET":
+                # pages in id order follow the ids (@after=<last id>), only
+                # other orders take an @offset, up to REST_MAX_OFFSET
+                vars.setdefault("@order", "id")
+                after = vars.pop("@after", None)
+                offset = vars.get("@offset") or "0"
+                if not offset.isdigit():
+                    raise HTTP(400)
+                if vars["@order"] == "id":
+                    if int(offset):
+                        raise HTTP(400, "Page with @after=<last id>")
+                    if after is not None:
+                        if not after.isdigit():
+                            raise HTTP(400)
+                        vars["id.gt"] = after
+                elif after is not None or int(offset) > REST_MAX_OFFSET:
+                    raise HTTP(400)
 
             def make_writable(tablename):
                 if tablename in db:
@@ -404,9 +509,7 @@ if MODE in ("demo", "readonly", "full"):
             # must wrap into action uses to make sure it closes transactions
             data = action.uses(db)(
                 lambda: make_writable(args[2])
-                or RestAPI(db, policy)(
-                    request.method, args[2], id, request.query, request.json
-                )
+                or RestAPI(db, policy)(request.method, args[2], id, vars, request.json)
             )()
         else:
             data = {}
@@ -416,14 +519,28 @@ if MODE in ("demo", "readonly", "full"):
 
 
 if MODE == "full":
+    # the files of the apps as they are loaded, for the next reload
+    for app_name in os.listdir(FOLDER):
+        if os.path.isdir(os.path.join(FOLDER, app_name)) and app_name[:1] not in "._":
+            safely(lambda: HOT_RELOADER.snapshot(app_name))
 
     @action("reload")
     @action("reload/<name>")
     @session_secured
     def reload(name=None):
-        """Reloads installed apps"""
-        Reloader.import_app(name) if name else Reloader.import_apps()
-        return {"status": "ok"}
+        """Reloads installed apps, an app only where it changed
+
+        The report tells the mode (none, partial or full), the changed
+        files, the reloaded modules and the time of every stage; ?full=true
+        imports the whole app again.
+        """
+        if not name:
+            Reloader.import_apps()
+            for app_name in Reloader.MODULES:
+                safely(lambda: HOT_RELOADER.snapshot(app_name))
+            return {"status": "ok"}
+        full = request.query.get("full") == "true"
+        return dict(HOT_RELOADER.reload(name, full=full), status="ok")
 
     @action("save/<path:path>", method="POST")
     @session_secured
@@ -435,7 +552,7 @@ if MODE == "full":
             body = json.load(request.body)
             myfile.write(body.encode("utf8"))
         if reload_app:
-            Reloader.import_app(app_name)
+            HOT_RELOADER.reload(app_name)
         return {"status": "success"}
 
     @action("delete/<path:path>", method="POST")
@@ -532,10 +649,19 @@ if MODE == "full":
     def gitlog(project):
         if not is_git_repo(project):
             return "Project is not a GIT repo"
+        try:
+            page = max(0, int(request.query.get("page") or 0))
+        except ValueError:
+            raise HTTP(400)
         branches = get_branches(project)
-        commits = get_commits(project)
+        commits, more = get_commits(project, page)
         return dict(
-            commits=commits, checkout=checkout, project=project, branches=branches
+            commits=commits,
+            checkout=checkout,
+            project=project,
+            branches=branches,
+            page=page,
+            more=more,
         )
 
     @authenticated.callback()
@@ -544,6 +670,7 @@ if MODE == "full":
             raise HTTP(400)
         run("git stash", project)
         run("git checkout " + commit, project)
+        GIT_HISTORY.invalidate(os.path.join(FOLDER, project))
         Reloader.import_app(project)
 
     @action("swapbranch/<project>", method="POST")
@@ -565,12 +692,32 @@ if MODE == "full":
     def gitshow(project, commit):
         if not is_git_repo(project):
             raise HTTP(400)
+        if commit.startswith("-"):
+            raise HTTP(400)
         flag = request.params.get("showfull")
-        opt = ""
-        if flag == "true":
-            opt = " -U9999"
-        patch = run("git show " + commit + opt, project)
-        return diff2kryten(patch)
+        args = ["show", commit] + (["-U9999"] if flag == "true" else [])
+        lines = git_lines(args, os.path.join(FOLDER, project))
+
+        def more_url(index, start):
+            return URL(
+                "gitshow",
+                project,
+                commit,
+                vars=dict(showfull=flag or "false", file=index, start=start),
+            )
+
+        # the diff is rendered while git writes it, large files in pages
+        if request.query.get("file") is not None:
+            try:
+                index = int(request.query.get("file"))
+                start = int(request.query.get("start") or 0)
+            except ValueError:
+                raise HTTP(400)
+            pieces = render_lines(lines, index, start, more_url)
+        else:
+            pieces = render(lines, more_url)
+        response.headers["Content-Type"] = "text/html; charset=utf-8"
+        return (piece.encode("utf8") for piece in pieces)
 
 
 # handle internationalization & pluralization files
@@ -19,11 +19,29 @@ html {background-color: white; font-family: helvetica}
 
 script = """
 hljs.initHighlightingOnLoad();
-$('.line:not(.line-new)').each(function(){$(this).text($(this).attr('data-content') + "\\n")});
-$('.line-new').hide();
-$('.hide-newline').hide();
+function showLines(root){
+  root.find('.line:not(.line-new)').each(function(){$(this).text($(this).attr('data-content') + "\\n")});
+  root.find('.line-new').hide();
+  root.find('.hide-newline').hide();
+}
+function loadMore(more){
+  var src = more.attr('data-src');
+  if(!src) return;
+  more.removeAttr('data-src').text('\\n... loading ...\\n');
+  $.get(src, function(html){
+    var part = $('<span>').html(html);
+    showLines(part);
+    more.replaceWith(part.contents());
+  });
+}
+showLines($('body'));
 $('.diff').hide();
-$('.file .filename').click(function(){$(this).closest('.file').find('.diff').slideToggle();});
+$('.file .filename').click(function(){
+  var diff = $(this).closest('.file').find('.diff');
+  diff.find('.more[data-auto]').each(function(){loadMore($(this));});
+  diff.slideToggle();
+});
+$(document).on('click', '.more', function(){loadMore($(this));});
 var block = 0;
 function draw(){
   if(block>0)
@@ -97,17 +115,26 @@ def getFileType(name):
     return ""
 
 
-def diff2kryten(data):
-    lines = data.split("\n")
-    files = {}
-    filename = ""
-    message = ""
+# a page inlines at most INLINE_LINES diff lines, later files are loaded
+# when expanded; a file shows PAGE_LINES lines at a time ("load more")
+INLINE_LINES = 5000
+PAGE_LINES = 2000
+FLUSH_LINES = 256
+
+line_old = '<span class="line line-old" data-block="%s" data-content="%s"></span>'
+line_new = '<span class="line line-new" data-block="%s" data-content="%s"></span><span class="hide-newline" data-block="%s">\n</span>'
+line_reg = '<span class="line" data-content="%s"></span>'
+line_more = '<span class="more" data-src="%s"%s>\n... load more ...\n</span>'
+
+
+def parse(lines):
+    """Yields the events of a git diff (or git show) as it is read:
+    ("message", text), ("file", filename, mode) and ("line", span)"""
+    filename_a = ""
     mode = 0
     block = 0
-    line_old = '<span class="line line-old" data-block="%s" data-content="%s"></span>'
-    line_new = '<span class="line line-new" data-block="%s" data-content="%s"></span><span class="hide-newline" data-block="%s">\n</span>'
-    line_reg = '<span class="line" data-content="%s"></span>'
     for line in lines:
+        line = line.rstrip("\n")
         if line.startswith("---"):
             filename_a = line[4:].strip()
             if filename_a.startswith("a/"):
@@ -118,41 +145,35 @@ def diff2kryten(data):
             if filename_b.startswith("b/"):
                 filename_b = filename_b[2:]
             if filename_a == "/dev/null":
-                filename = filename_b
-                files[filename] = {"mode": "create", "lines": []}
+                yield "file", filename_b, "create"
             elif filename_b == "/dev/null":
-                filename = filename_a
-                files[filename] = {"mode": "delete", "lines": []}
+                yield "file", filename_a, "delete"
             else:
-                filename = filename_a
-                files[filename] = {"mode": "edit", "lines": []}
+                yield "file", filename_a, "edit"
             mode = 2
         elif line.startswith("-"):
             mode, block = 3, block + 1
-            files[filename]["lines"].append(line_old % (block, escape(line[1:])))
+            yield "line", line_old % (block, escape(line[1:]))
         elif line.startswith("+"):
             mode, block = 3, block + 1
-            files[filename]["lines"].append(line_new % (block, escape(line[1:]), block))
+            yield "line", line_new % (block, escape(line[1:]), block)
         elif line.startswith(" ") and mode >= 2:
-            files[filename]["lines"].append(line_reg % escape(line[1:]))
+            yield "line", line_reg % escape(line[1:])
             if mode > 2:
                 mode = 2
         elif line.startswith(" ") and mode < 2:
-            message += escape(line.strip()) + "<br/>"
-        else:
-            pass
-    div = '<div class="message">%s</div>' % message
-    for filename in sorted(files):
-        mode = files[filename]["mode"]
-        if mode != "delete":
-            lines = "".join(files[filename]["lines"])
-        div += '<div class="file">'
-        div += '<div class="filename">%s (%s)</div>' % (filename, mode)
-        div += '<div class="diff"><pre><code %s>%s</code></pre></div></div>' % (
-            getFileType(filename),
-            lines,
-        )
-    return (
+            yield "message", escape(line.strip()) + "<br/>"
+    yield "end", block
+
+
+def render(lines, more_url=None, inline_lines=INLINE_LINES, page_lines=PAGE_LINES):
+    """Yields the kryten page of a diff in pieces, while lines are read
+
+    With more_url(file_index, start), the url of the lines of a file from
+    start, the page is capped: past inline_lines the files are fetched
+    when expanded and every file shows page_lines at a time.
+    """
+    yield (
         "<html><head>"
         + """<link rel="stylesheet"
           href="/_dashboard/static/css/gitlog.min.css">"""
@@ -160,14 +181,84 @@ def diff2kryten(data):
         + css
         + '</style></head><body><div style="text-align:right">'
         + "</div>"
-        + div
+    )
+    message, buffer = [], []
+    index, shown, cut, budget = -1, 0, False, inline_lines
+    capped = more_url is not None
+    for event in parse(lines):
+        kind = event[0]
+        if kind == "line":
+            if index < 0 or mode == "delete" or cut:
+                continue
+            if capped and shown >= min(page_lines, budget):
+                # the rest of the file comes from more_url, at once when
+                # the file is expanded if none of it is inlined
+                auto = ' data-auto="1"' if shown == 0 else ""
+                buffer.append(line_more % (escape(more_url(index, shown)), auto))
+                cut = True
+                continue
+            buffer.append(event[1])
+            shown += 1
+            if len(buffer) >= FLUSH_LINES:
+                yield "".join(buffer)
+                buffer = []
+        elif kind == "message":
+            message.append(event[1])
+        else:
+            if index < 0:
+                buffer.append('<div class="message">%s</div>' % "".join(message))
+            else:
+                buffer.append("</code></pre></div></div>")
+                budget -= shown
+            if kind == "end":
+                break
+            filename, mode = event[1], event[2]
+            index, shown, cut = index + 1, 0, False
+            buffer.append('<div class="file">')
+            buffer.append(
+                '<div class="filename">%s (%s)</div>' % (escape(filename), mode)
+            )
+            buffer.append('<div class="diff"><pre><code %s>' % getFileType(filename))
+            yield "".join(buffer)
+            buffer = []
+    yield (
+        "".join(buffer)
         + '<script src="/_dashboard/static/js/jquery.min.js"></script>'
         + '<script src="/_dashboard/static/js/highlight.min.js"></script>'
         + "<script>"
-        + (script % block)
+        + (script % event[1])
         + "</script></body></html>"
     )
 
 
+def render_lines(lines, file_index, start, more_url, page_lines=PAGE_LINES):
+    """Yields the spans of the file_index-th file of a diff, from its
+    start-th line, for page_lines lines then a "load more" span"""
+    index, shown, buffer = -1, 0, []
+    for event in parse(lines):
+        if event[0] == "file":
+            if index == file_index:
+                break
+            index, shown = index + 1, 0
+        elif event[0] == "line" and index == file_index:
+            if shown >= start + page_lines:
+                buffer.append(line_more % (escape(more_url(index, shown)), ""))
+                break
+            if shown >= start:
+                buffer.append(event[1])
+                if len(buffer) >= FLUSH_LINES:
+                    yield "".join(buffer)
+                    buffer = []
+            shown += 1
+        elif event[0] == "end":
+            break
+    yield "".join(buffer)
+
+
+def diff2kryten(data):
+    """The kryten page of a whole diff, as one string"""
+    return "".join(render(data.split("\n")))
+
+
 if __name__ == "__main__":
     print(diff2kryten(open(sys.argv[1], "r").read()))
@@ -0,0 +1,112 @@
+"""
+Cached directory listings for the file browser
+
+The listing of a folder only changes when an entry is added, removed or
+renamed in it, and that is exactly when the folder mtime changes. The
+index keeps the filtered listing of every folder it has seen with that
+mtime, so rebuilding a tree costs one stat per folder and only the
+folders that changed are scanned again:
+
+    index = DirectoryIndex()
+    index.tree(app_folder)           # the whole tree, as walk returned it
+    index.tree(app_folder, depth=1)  # one level, sub folders have no content
+
+With depth the folders past the last level have "content": None, so the
+editor can fetch them one level at a time when they are opened.
+
+A listing whose mtime is within RACY_SECONDS of the scan is not kept:
+a change in the same clock tick would not move the mtime.
+"""
+
+import os
+import threading
+import time
+
+MAX_DIRECTORIES = 100000
+RACY_SECONDS = 2
+
+
+def visible_directory(name):
+    return name[:1] != "." and name[:2] != "__"
+
+
+def visible_file(name):
+    return name[:1] != "." and name[-1:] != "~" and name[-4:] != ".pyc"
+
+
+class DirectoryIndex:
+    """mtime validated listings of folders, (dirs, files) sorted and filtered"""
+
+    def __init__(self, max_directories=MAX_DIRECTORIES):
+        self.max_directories = max_directories
+        self.entries = {}  # path -> (mtime_ns, dirs, files)
+        self.lock = threading.Lock()
+
+    def listing(self, path, stat=None):
+        """(dirs, files) of path, scanned again only if its mtime changed"""
+        stat = stat or os.stat(path)
+        entry = self.entries.get(path)
+        if entry and entry[0] == stat.st_mtime_ns:
+            return entry[1], entry[2]
+        dirs, files = [], []
+        with os.scandir(path) as entries:
+            for item in entries:
+                try:
+                    is_dir = item.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    if visible_directory(item.name):
+                        dirs.append(item.name)
+                elif visible_file(item.name):
+                    files.append(item.name)
+        dirs.sort()
+        files.sort()
+        with self.lock:
+            if entry:
+                # forget the sub folders that are gone
+                for name in set(entry[1]).difference(dirs):
+                    self._forget(os.path.join(path, name))
+            if time.time_ns() - stat.st_mtime_ns > RACY_SECONDS * 10**9:
+                self.entries[path] = (stat.st_mtime_ns, dirs, files)
+            else:
+                # no mtime matches, but the sub folders can still be forgotten
+                self.entries[path] = (None, dirs, files)
+            while len(self.entries) > self.max_directories:
+                del self.entries[next(iter(self.entries))]
+        return dirs, files
+
+    def tree(self, path, depth=None):
+        """{"dirs": [{"name", "content"}], "files": [...]} of path
+
+        With a depth, the sub folders past that many levels get
+        "content": None. Raises OSError if path is not a folder.
+        """
+        return self._tree(path, depth, set())
+
+    def _tree(self, path, depth, ancestors, stat=None):
+        stat = stat or os.stat(path)
+        dirs, files = self.listing(path, stat)
+        node = {"dirs": [], "files": list(files)}
+        # a symlink back to a parent would never end
+        ancestors = ancestors | {(stat.st_dev, stat.st_ino)}
+        for name in dirs:
+            content = None
+            if depth is None or depth > 1:
+                subpath = os.path.join(path, name)
+                try:
+                    substat = os.stat(subpath)
+                    if (substat.st_dev, substat.st_ino) in ancestors:
+                        continue
+                    content = self._tree(
+                        subpath, None if depth is None else depth - 1, ancestors, substat
+                    )
+                except OSError:
+                    continue  # removed since the listing
+            node["dirs"].append({"name": name, "content": content})
+        return node
+
+    def _forget(self, path):
+        prefix = path + os.sep
+        for key in [k for k in self.entries if k == path or k.startswith(prefix)]:
+            del self.entries[key]
@@ -0,0 +1,94 @@
+"""
+Chunked reads of the files opened in the editor
+
+iter_file yields a byte range of a file (parse_range reads it from a
+HTTP Range header) in CHUNK_SIZE pieces, through a read only mmap when
+the range is at least MMAP_MIN_SIZE, so a response never holds more than
+a chunk of the file. read_window returns a window of lines starting at a
+byte offset, at most max_bytes long, with the offset of the next window:
+the editor pages through a large file with
+
+    window = read_window(path, offset=previous["next"])
+"""
+
+import mmap
+import os
+
+CHUNK_SIZE = 1 << 20
+MMAP_MIN_SIZE = 16 << 20
+WINDOW_BYTES = 1 << 20
+
+
+def iter_file(path, start=0, end=None, chunk_size=CHUNK_SIZE):
+    """Yields the bytes of path from start to end (excluded) in chunks"""
+    with open(path, "rb") as fp:
+        size = os.fstat(fp.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if end - start >= MMAP_MIN_SIZE:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                for position in range(start, end, chunk_size):
+                    yield mapped[position : min(position + chunk_size, end)]
+            return
+        fp.seek(start)
+        while start < end:
+            data = fp.read(min(chunk_size, end - start))
+            if not data:
+                break  # truncated meanwhile
+            start += len(data)
+            yield data
+
+
+def parse_range(header, size):
+    """(start, end excluded) of the first range of a Range header, None if
+    it is unsatisfiable or not a bytes range"""
+    units, _, ranges = header.partition("=")
+    if units.strip() != "bytes":
+        return None
+    first, _, last = ranges.split(",")[0].strip().partition("-")
+    try:
+        if not first:  # the last bytes
+            start, end = max(0, size - int(last)), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    return (start, end) if 0 <= start < end else None
+
+
+def read_window(path, offset=0, lines=None, max_bytes=WINDOW_BYTES):
+    """Up to lines lines (and max_bytes bytes) of path from byte offset
+
+    Returns dict(payload, offset, next, size, eof); payload is decoded as
+    utf8, next is the offset of the following window. A line longer than
+    max_bytes is cut and continues in the next window.
+    """
+    with open(path, "rb") as fp:
+        size = os.fstat(fp.fileno()).st_size
+        offset = min(offset, size)
+        fp.seek(offset)
+        if lines is None:
+            data = fp.read(max_bytes)
+            if len(data) == max_bytes and offset + len(data) < size:
+                # end on a line boundary, unless the window is a single line
+                cut = data.rfind(b"\n") + 1
+                data = data[:cut] or data
+        else:
+            pieces, used = [], 0
+            while len(pieces) < lines and used < max_bytes:
+                line = fp.readline(max_bytes - used)
+                if not line:
+                    break
+                pieces.append(line)
+                used += len(line)
+            data = b"".join(pieces)
+    following = offset + len(data)
+    return dict(
+        payload=data.decode("utf8", errors="ignore"),
+        offset=offset,
+        next=following,
+        size=size,
+        eof=following >= size,
+    )
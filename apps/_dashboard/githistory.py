@@ -0,0 +1,137 @@
+"""
+Pages of git history, cached on HEAD
+
+GitHistory.page(folder, page) runs one git log for page_size commits
+(--skip/-n, in a machine readable format) and keeps the parsed page
+keyed on the commit HEAD points to, so viewing a page again costs
+reading .git/HEAD and no subprocess at all:
+
+    history = GitHistory(page_size=50)
+    commits, more = history.page(app_folder, 0)
+
+A checkout moves HEAD and so misses the cache by itself; invalidate(folder)
+also drops the pages of the old HEAD right away.
+"""
+
+import collections
+import datetime
+import os
+import subprocess
+import threading
+
+# fields and records separators of the log format
+FIELD, RECORD = "\x1f", "\x1e"
+LOG_FORMAT = FIELD.join(["%H", "%an <%ae>", "%aI", "%B"]) + RECORD
+
+
+def read_head(folder):
+    """sha of the commit HEAD points to, from the files under .git"""
+    git = os.path.join(folder, ".git")
+    try:
+        with open(os.path.join(git, "HEAD")) as fp:
+            head = fp.read().strip()
+        if not head.startswith("ref: "):
+            return head  # detached
+        ref = head[5:]
+        try:
+            with open(os.path.join(git, ref)) as fp:
+                return fp.read().strip()
+        except FileNotFoundError:
+            pass
+        with open(os.path.join(git, "packed-refs")) as fp:
+            for line in fp:
+                sha, _, name = line.strip().partition(" ")
+                if name == ref:
+                    return sha
+    except OSError:
+        pass
+    # worktrees, a branch without commits...: ask git
+    try:
+        return git_output(["rev-parse", "HEAD"], folder).strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def git_output(args, folder):
+    return subprocess.check_output(
+        ["git"] + args, cwd=folder, stderr=subprocess.DEVNULL
+    ).decode(errors="ignore")
+
+
+def git_lines(args, folder):
+    """Yields the output lines of a git command while it runs"""
+    process = subprocess.Popen(
+        ["git"] + args, cwd=folder, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    try:
+        for line in process.stdout:
+            yield line.decode(errors="ignore")
+    finally:
+        # also when the reader stops early
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+def parse_log(output):
+    commits = []
+    for record in output.split(RECORD):
+        record = record.strip("\n")
+        if not record:
+            continue
+        code, author, date, message = record.split(FIELD, 3)
+        commits.append(
+            {
+                "code": code,
+                "author": author,
+                "date": datetime.datetime.fromisoformat(date),
+                "message": message.strip() + "\n",
+            }
+        )
+    return commits
+
+
+class GitHistory:
+    """LRU of parsed git log pages, keyed on (folder, HEAD, page)"""
+
+    def __init__(self, page_size=50, cache_size=64):
+        self.page_size = page_size
+        self.cache_size = cache_size
+        self.pages = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def page(self, folder, page=0):
+        """(commits, more) of the page-th page of the history of HEAD"""
+        head = read_head(folder)
+        if head is None:
+            return [], False
+        key = (folder, head, page)
+        with self.lock:
+            if key in self.pages:
+                self.pages.move_to_end(key)
+                return self.pages[key]
+        output = git_output(
+            [
+                "log",
+                "--format=" + LOG_FORMAT,
+                "--skip=%i" % (page * self.page_size),
+                # one more tells if there is a next page
+                "-n",
+                str(self.page_size + 1),
+                head,
+            ],
+            folder,
+        )
+        commits = parse_log(output)
+        value = (commits[: self.page_size], len(commits) > self.page_size)
+        with self.lock:
+            self.pages[key] = value
+            while len(self.pages) > self.cache_size:
+                self.pages.popitem(last=False)
+        return value
+
+    def invalidate(self, folder):
+        with self.lock:
+            for key in [key for key in self.pages if key[0] == folder]:
+                del self.pages[key]
@@ -0,0 +1,266 @@
+"""
+Change aware reload of an app
+
+py4web's Reloader.import_app forgets every module of an app and imports
+it again, so a one line change in a controller also runs the models
+(table definitions, migrations, seeding) and common.py (auth, sessions)
+again. HotReloader keeps a fingerprint (mtime, size and sha1) of the
+python files and templates of every app and, on reload, imports again
+only the modules that changed and those that import them, directly or
+not, plus the app package itself:
+
+    reloader = HotReloader(apps_folder)
+    reloader.snapshot("myapp")   # what is loaded now
+    ...
+    reloader.reload("myapp")     # {"mode": "partial", "reloaded": [...], "timings": {...}}
+
+The modes are "none" (nothing changed, or only templates, which are read
+from disk at every render), "partial", and "full" (the first time, when
+python files were added or removed, or if the partial import fails).
+The routes of the modules kept are kept; the others are registered again.
+"""
+
+import ast
+import hashlib
+import os
+import sys
+import threading
+import time
+import traceback
+
+import py4web.core
+from py4web import action
+from py4web.core import Reloader, load_module, module2filename
+
+SKIPPED_FOLDERS = {"__pycache__", "databases", "uploads", "static", "translations"}
+
+
+def fingerprint(folder, previous=None):
+    """{relative path: (mtime_ns, size, sha1)} of the .py and template files;
+    files with the mtime and size of previous are not read again"""
+    previous = previous or {}
+    prints = {}
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [name for name in dirs if name[:1] != "." and name not in SKIPPED_FOLDERS]
+        in_templates = os.path.relpath(root, folder).split(os.sep)[0] == "templates"
+        for name in files:
+            if not (name.endswith(".py") or in_templates) or name[:1] == ".":
+                continue
+            path = os.path.join(root, name)
+            relative = os.path.relpath(path, folder)
+            try:
+                stat = os.stat(path)
+                old = previous.get(relative)
+                if old and old[:2] == (stat.st_mtime_ns, stat.st_size):
+                    prints[relative] = old
+                    continue
+                with open(path, "rb") as fp:
+                    digest = hashlib.sha1(fp.read()).hexdigest()
+            except OSError:
+                continue
+            prints[relative] = (stat.st_mtime_ns, stat.st_size, digest)
+    return prints
+
+
+def module_name(package, relative):
+    parts = relative[:-3].split(os.sep)
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join([package] + parts)
+
+
+def module_imports(body):
+    """The import statements run when a module is imported: the ones in
+    functions and classes only run when called and find the new modules"""
+    for node in body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            yield node
+        elif not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            for field in ("body", "orelse", "finalbody", "handlers"):
+                yield from module_imports(getattr(node, field, None) or [])
+
+
+def importers(folder, package, relatives, cache=None):
+    """{module: modules of the app it imports}, read from the sources;
+    cache maps relatives to (key, imports) and is used when key matches"""
+    graph = {}
+    for relative, key in relatives.items():
+        name = module_name(package, relative)
+        if cache is not None and relative in cache and cache[relative][0] == key:
+            graph[name] = cache[relative][1]
+            continue
+        is_package = relative.endswith("__init__.py")
+        base = name.split(".") if is_package else name.split(".")[:-1]
+        imported = set()
+        try:
+            with open(os.path.join(folder, relative), "rb") as fp:
+                tree = ast.parse(fp.read())
+        except (OSError, SyntaxError):
+            graph[name] = imported
+            continue  # not cached, the error is reported by the import
+        for node in module_imports(tree.body):
+            if isinstance(node, ast.Import):
+                imported.update(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                if node.level:
+                    if node.level - 1 > len(base):
+                        continue
+                    parent = base[: len(base) - node.level + 1]
+                    target = ".".join(parent + ([node.module] if node.module else []))
+                else:
+                    target = node.module or ""
+                if node.module:
+                    imported.add(target)
+                # from . import controllers imports a module, not the package
+                # (which is always imported again)
+                imported.update(target + "." + alias.name for alias in node.names)
+        graph[name] = {
+            module for module in imported if (module + ".").startswith(package + ".")
+        }
+        if cache is not None:
+            cache[relative] = (key, graph[name])
+    return graph
+
+
+class HotReloader:
+    """Reloads the modules of an app that changed since the last (re)load"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.fingerprints = {}  # app name -> fingerprint
+        self.graphs = {}  # app name -> {relative: (sha1, imports)}
+        self.lock = threading.Lock()
+
+    def snapshot(self, app_name):
+        """Remembers the files of app_name as the ones loaded"""
+        self.fingerprints[app_name] = fingerprint(os.path.join(self.folder, app_name))
+
+    def reload(self, app_name, full=False):
+        """Reloads app_name, only what changed unless full; returns a report
+        with the mode, the changed files, the reloaded modules and the
+        milliseconds spent in every stage"""
+        with self.lock:
+            timings = {}
+            started = clock = time.perf_counter()
+
+            def stage(name):
+                nonlocal clock
+                now = time.perf_counter()
+                timings[name] = round((now - clock) * 1000, 1)
+                clock = now
+
+            app_folder = os.path.join(self.folder, app_name)
+            old = self.fingerprints.get(app_name)
+            new = fingerprint(app_folder, old)
+            stage("scan")
+            changed = sorted(
+                relative
+                for relative in set(old or ()) | set(new)
+                if (old or {}).get(relative, (None,) * 3)[2]
+                != new.get(relative, (None,) * 3)[2]
+            )
+            sources = [relative for relative in changed if relative.endswith(".py")]
+            reloaded = []
+            loaded = Reloader.MODULES.get(app_name) and not Reloader.ERRORS.get(app_name)
+            if not full and loaded and old is not None and not sources:
+                mode = "none"
+            elif (
+                full
+                or not loaded
+                or old is None
+                or any(relative not in old or relative not in new for relative in sources)
+            ):
+                mode = "full"
+                Reloader.import_app(app_name)
+                stage("import")
+            else:
+                mode = "partial"
+                package = "apps." + app_name
+                graph = importers(
+                    app_folder,
+                    package,
+                    {r: p[2] for r, p in new.items() if r.endswith(".py")},
+                    self.graphs.setdefault(app_name, {}),
+                )
+                reloaded = self.dependents(graph, {module_name(package, r) for r in sources})
+                reloaded.add(package)
+                stage("graph")
+                try:
+                    self.import_modules(app_name, reloaded, stage)
+                except Exception:  # pylint: disable=broad-exception-caught
+                    # the app is half imported, start over
+                    mode = "full"
+                    Reloader.import_app(app_name)
+                    stage("import")
+            if not Reloader.ERRORS.get(app_name):
+                self.fingerprints[app_name] = new
+            timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+            return dict(
+                mode=mode,
+                changed=changed,
+                reloaded=sorted(reloaded),
+                error=Reloader.ERRORS.get(app_name),
+                timings=timings,
+            )
+
+    @staticmethod
+    def dependents(graph, modules):
+        """modules and the ones importing them, directly or not"""
+        result = set(modules)
+        while True:
+            more = {
+                name
+                for name, imported in graph.items()
+                if name not in result and imported & result
+            }
+            if not more:
+                return result
+            result |= more
+
+    @staticmethod
+    def import_modules(app_name, names, stage):
+        """Imports names (modules of app_name) again, keeping the others"""
+        package = "apps." + app_name
+        filenames = {module2filename(name) for name in names}
+        routes = Reloader.ROUTES.get(app_name, [])
+        remove_route = py4web.core.bottle.default_app().router.remove
+        for rule in {route["rule"] for route in routes if route["filename"] in filenames}:
+            remove_route(rule)
+        kept = [route for route in routes if route["filename"] not in filenames]
+        Reloader.ROUTES[app_name] = kept
+        for name in names:
+            sys.modules.pop(name, None)
+        stage("unload")
+
+        register_route = Reloader.register_route
+        original = Reloader.__dict__["register_route"]
+
+        def register_again(app, rule, kwargs, func):
+            # a route of a kept module registered again by a reloaded one
+            # (auth.enable() in common.py): the new one wins
+            methods = kwargs.get("method", ["GET", "POST"])
+            methods = [methods] if isinstance(methods, str) else methods
+            if any(r["rule"] == rule and r["method"] in methods for r in kept):
+                remove_route(rule)
+                kept[:] = [r for r in kept if r["rule"] != rule]
+                Reloader.ROUTES[app] = [r for r in Reloader.ROUTES[app] if r["rule"] != rule]
+            return register_route(app, rule, kwargs, func)
+
+        action.app_name = app_name
+        Reloader.register_route = staticmethod(register_again)
+        try:
+            module = load_module(package, os.path.join(
+                os.environ["PY4WEB_APPS_FOLDER"], app_name, "__init__.py"
+            ))
+        except Exception:
+            Reloader.ERRORS[app_name] = traceback.format_exc()
+            raise
+        finally:
+            Reloader.register_route = original
+        Reloader.MODULES[app_name] = module
+        Reloader.ERRORS[app_name] = None
+        # as import_app does, so that actions can change Field attributes
+        py4web.core.ICECUBE.update(
+            py4web.core.threadsafevariable.ThreadSafeVariable.freeze()
+        )
+        stage("import")
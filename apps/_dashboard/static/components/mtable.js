@@ -25,7 +25,10 @@
         let self = this;
         let length = this.table.items.length;
         let url = this.url + '?@limit=20';
-        if (length) url+='&@offset='+length; else url+='&@model=true';
+        /* unordered tables page by id (keyset), the server limits offsets */
+        if (!length) url+='&@model=true';
+        else if (!this.order) url+='&@after='+this.table.items[length-1].id;
+        else url+='&@offset='+length;
         let filters = self.filter.split(' and ').filter((f)=>{return f.trim() != ''});
         filters = filters.filter((f)=>{return f.trim();}).map((f)=>{                
                 let parts = (f
@@ -1,15 +1,22 @@
 Vue.component('treefiles', {
         props: ['f','p'],
-        template: '<div><ul class="files"><li v-for="name in f.files" v-on:click="select_file(p,name)"><a><tt>{{name}}</tt></a></li></ul><ul class="dirs"><li v-for="dir in f.dirs"><div class="accordion"><input type="checkbox" v-bind:id="combineb64(p,dir.name)"><label v-bind:for="combineb64(p,dir.name)" v-on:click="select_folder(p,dir.name)"><a><tt>{{dir.name}}</tt></a></label><div class="subfolder"><treefiles :f="dir.content" :p="combine(p,dir.name)"></treefiles></div></div></div>',
+        template: '<div><ul class="files"><li v-for="name in f.files" v-on:click="select_file(p,name)"><a><tt>{{name}}</tt></a></li></ul><ul class="dirs"><li v-for="dir in f.dirs"><div class="accordion"><input type="checkbox" v-bind:id="combineb64(p,dir.name)"><label v-bind:for="combineb64(p,dir.name)" v-on:click="select_folder(p,dir)"><a><tt>{{dir.name}}</tt></a></label><div class="subfolder"><treefiles v-if="dir.content" :f="dir.content" :p="combine(p,dir.name)"></treefiles></div></div></div>',
         methods: {
             select_file: (path, name) => { app.select_filename(path+'/'+name); },
-            select_folder: (path, name) => { return true; },
+            select_folder: (path, dir) => {
+                /* folders are listed one level at a time, fetch this one when first opened */
+                if (dir.content === null) {
+                    Q.get('../walk/'+path+'/'+dir.name+'?depth=1').then(r=>{dir.content=r.json().payload;});
+                }
+                return true;
+            },
             combine: (path, name) => { return path+'/'+name; },
             combineb64: (path, name) => { return btoa(path+'/'+name); },
         }
     });
 
 let app = {}; 
+const TICKETS_PAGE_SIZE = 50;
 let init = (app) => {
     app.data = {
         password: '',
@@ -27,8 +34,11 @@ let init = (app) => {
         selected_filename: null,
         selected_type: 'text',
         selected_file_link: null,
+        selected_window: null,
         files: {},
         tickets:[],
+        tickets_search: '',
+        tickets_more: false,
         modal: null
     };
     app.select_app = (appobj) => {
@@ -42,8 +52,9 @@ let init = (app) => {
         app.editor.session.setMode(mode);
     }
     app.select_filename = (path, force) => {                
-        if(app.vue.selected_filename)
+        if(app.vue.selected_filename && !app.vue.selected_window)
             app.vue.files[app.vue.selected_filename] = app.editor.getValue();
+        app.vue.selected_window = null;
 
         var lpath = path.toLowerCase();
         if(lpath.endsWith('.mp4','.mov','.mpg','.mpeg')) app.vue.selected_type = 'video';
@@ -63,18 +74,39 @@ let init = (app) => {
             app.editor = ace.edit("editor");
             app.editor.setTheme("ace/theme/pastel_on_dark");
             app.editor.$blockScrolling = Infinity;
+            app.editor.setReadOnly(false);
             if(!force && path in app.vue.files) {
                 app.activate_editor(path, app.vue.files[path]);
-            } else {            
-                var url = '../load/'+path;
-                if(app.vue.selected_type != 'text') url = '../load_bytes/'+path;
-                Q.get(url).then(r=>{
-                        app.activate_editor(path, r.json().payload);
-                    });
+            } else if(app.vue.selected_type == 'text') {
+                app.load_window(path, 0, []);
             }
         }
         app.vue.selected_filename = path;
     };
+    app.load_window = (path, offset, previous) => {
+        /* large files come in windows, shown read only with previous/next buttons */
+        Q.get('../load/'+path+'?offset='+offset).then(r=>{
+                var data = r.json();
+                if(data.offset == 0 && data.eof) {
+                    app.activate_editor(path, data.payload);
+                    return;
+                }
+                delete app.vue.files[path];
+                app.vue.selected_window = {path: path, offset: data.offset, next: data.next,
+                                           size: data.size, eof: data.eof, previous: previous};
+                app.editor.session.setValue(data.payload);
+                app.editor.session.setMode(app.modelist.getModeForPath(path).mode);
+                app.editor.setReadOnly(true);
+            });
+    };
+    app.next_window = () => {
+        var w = app.vue.selected_window;
+        if(w && !w.eof) app.load_window(w.path, w.next, w.previous.concat([w.offset]));
+    };
+    app.previous_window = () => {
+        var w = app.vue.selected_window;
+        if(w && w.previous.length) app.load_window(w.path, w.previous[w.previous.length-1], w.previous.slice(0, -1));
+    };
     app.modal_dismiss = () => {
         app.vue.modal = null;
     };
@@ -98,6 +130,10 @@ let init = (app) => {
 	    alert("Unable to save this file, it is not of type text");
 	    return;
 	}
+	if(app.vue.selected_window) {
+	    alert("Unable to save this file, it is too large to be edited");
+	    return;
+	}
         var path = app.vue.selected_filename;
         app.vue.files[path] = app.editor.getValue();
         Q.post('../save/'+path, app.vue.files[path]).then(r=>app.file_saved());
@@ -131,7 +167,7 @@ let init = (app) => {
         /*reload entire page needed to see the new file listed*/
         Q.post('../new_file/'+app_name+'/'+form.filename).then(r=>{
                 app.vue.walk = [];
-                Q.get('../walk/'+app_name).then(r=>{app.vue.walk=r.json().payload;});
+                Q.get('../walk/'+app_name+'?depth=1').then(r=>{app.vue.walk=r.json().payload;});
                 app.modal_dismiss();
             });
     }; 
@@ -193,17 +229,21 @@ let init = (app) => {
                 app.vue.routes=r.json().payload || [];
             });
     };
-    app.reload_tickets = () => {
-        app.vue.tickets = [];
-        Q.get('../tickets').then(r=>{
-                app.vue.tickets = r.json().payload || [];
+    app.reload_tickets = (more) => {
+        /* groups of tickets, TICKETS_PAGE_SIZE at a time */
+        var page = more ? Math.ceil(app.vue.tickets.length / TICKETS_PAGE_SIZE) : 0;
+        if (!more) app.vue.tickets = [];
+        Q.get('../tickets?page='+page+'&search='+encodeURIComponent(app.vue.tickets_search)).then(r=>{
+                var tickets = r.json().payload || [];
+                app.vue.tickets = app.vue.tickets.concat(tickets);
+                app.vue.tickets_more = tickets.length == TICKETS_PAGE_SIZE;
             });
     };
     app.reload_files = () => {
         if (!app.vue.selected_app) return;
         app.vue.walk = [];
         var name = app.vue.selected_app.name;
-        Q.get('../walk/'+name).then(r=>{app.vue.walk=r.json().payload;});
+        Q.get('../walk/'+name+'?depth=1').then(r=>{app.vue.walk=r.json().payload;});
         Q.get('../rest/'+name).then(r=>{app.vue.databases=r.json().databases;});
         app.vue.selected_filename = null;
     }
@@ -231,6 +271,8 @@ let init = (app) => {
         select_filename: app.select_filename,
         save_file: app.save_file,
         load_file: app.load_file,
+        next_window: app.next_window,
+        previous_window: app.previous_window,
         reload: app.reload,
         gitlog: app.gitlog,
         delete_selected_app: app.delete_selected_app,
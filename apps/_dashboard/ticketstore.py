@@ -0,0 +1,267 @@
+"""
+Error tickets with groups, indexes and retention
+
+TicketStore stands in for py4web's DatabaseErrorLogger (same py4web_error
+table, same log/get/clear) in error_logger.database_logger:
+
+- py4web_error_group keeps one row per (app_name, path, error) with its
+  count, first and last occurrence, updated when a ticket is logged, so
+  listing the groups is an indexed, paginated select and not a GROUP BY
+  over every ticket.
+- A group stores at most max_per_group snapshots per storm_window
+  seconds; later occurrences just count (and point to the last stored
+  ticket), so an error storm does not grow the table.
+- Every sweep_interval seconds a log also deletes up to sweep_batch
+  tickets older than retention_days (or past max_tickets, oldest first)
+  and the groups not seen since, never more per request.
+"""
+
+import datetime
+import logging
+import threading
+import time
+import uuid
+
+from py4web import request
+from pydal import Field
+from pydal.utils import utcnow
+
+INDEXES = [
+    ("py4web_error", "uuid"),
+    ("py4web_error", "timestamp"),
+    ("py4web_error", "path"),
+    ("py4web_error", "error"),
+    ("py4web_error_group", "app_name, path, error"),
+    ("py4web_error_group", "last_seen"),
+]
+
+
+class TicketStore:
+    """Error logger storing grouped tickets in the py4web service database"""
+
+    def __init__(
+        self,
+        db,
+        retention_days=7,
+        max_tickets=10000,
+        max_per_group=100,
+        storm_window=3600,
+        sweep_interval=60,
+        sweep_batch=500,
+    ):
+        self.db = db
+        self.retention_days = retention_days
+        self.max_tickets = max_tickets
+        self.max_per_group = max_per_group
+        self.storm_window = datetime.timedelta(seconds=storm_window)
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.swept_at = 0
+        self.lock = threading.Lock()
+        if "py4web_error" not in db.tables:
+            db.define_table(
+                "py4web_error",
+                Field("uuid"),
+                Field("app_name"),
+                Field("method"),
+                Field("path", "string"),
+                Field("timestamp", "datetime"),
+                Field("client_ip", "string"),
+                Field("error", "string"),
+                Field("snapshot", "json"),
+            )
+        if "py4web_error_group" not in db.tables:
+            db.define_table(
+                "py4web_error_group",
+                Field("app_name"),
+                Field("method"),
+                Field("path", "string"),
+                Field("error", "string"),
+                Field("client_ip", "string"),
+                Field("count", "integer", default=0),
+                Field("stored", "integer", default=0),
+                Field("stored_since", "datetime"),
+                Field("first_seen", "datetime"),
+                Field("last_seen", "datetime"),
+                Field("last_uuid"),
+            )
+        for tablename, columns in INDEXES:
+            name = "%s__%s" % (tablename, columns.replace(", ", "_"))
+            db.executesql(
+                "CREATE INDEX IF NOT EXISTS %s ON %s (%s);" % (name, tablename, columns)
+            )
+        # tickets logged before the groups existed
+        if db(db.py4web_error_group).isempty() and not db(db.py4web_error).isempty():
+            self.regroup()
+        db.commit()
+
+    def log(self, app_name, error_snapshot):
+        """Store error snapshot (ticket) in the database, returns its uuid"""
+        db = self.db
+        error = error_snapshot["exception_value"]
+        now = utcnow()
+        try:
+            group = db(
+                (db.py4web_error_group.app_name == app_name)
+                & (db.py4web_error_group.path == request.path)
+                & (db.py4web_error_group.error == error)
+            ).select(limitby=(0, 1)).first()
+            ticket_uuid = group.last_uuid if group else None
+            stored, stored_since = (group.stored, group.stored_since) if group else (0, now)
+            if not stored_since or now - stored_since > self.storm_window:
+                stored, stored_since = 0, now
+            if stored < self.max_per_group:
+                ticket_uuid = str(uuid.uuid4())
+                stored += 1
+                db.py4web_error.insert(
+                    uuid=ticket_uuid,
+                    app_name=app_name,
+                    method=request.method,
+                    path=request.path,
+                    timestamp=now,
+                    client_ip=request.environ.get("REMOTE_ADDR"),
+                    error=error,
+                    snapshot=error_snapshot,
+                )
+            values = dict(
+                method=request.method,
+                client_ip=request.environ.get("REMOTE_ADDR"),
+                last_seen=now,
+                last_uuid=ticket_uuid,
+                stored=stored,
+                stored_since=stored_since,
+            )
+            if group:
+                db(db.py4web_error_group.id == group.id).update(
+                    count=db.py4web_error_group.count + 1, **values
+                )
+            else:
+                db.py4web_error_group.insert(
+                    app_name=app_name,
+                    path=request.path,
+                    error=error,
+                    count=1,
+                    first_seen=now,
+                    **values
+                )
+            db.commit()
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            logging.error(str(err))
+            db.rollback()
+            return None
+        self.sweep()
+        return ticket_uuid
+
+    def get(self, ticket_uuid=None, search=None, app_name=None, page=0, page_size=50):
+        """A ticket by uuid, or a page of the groups (most recent first)
+
+        A group looks like a ticket (its last one) with a count; search
+        matches a part of the path or of the error.
+        """
+        db = self.db
+        if ticket_uuid:
+            rows = db(db.py4web_error.uuid == ticket_uuid).select(limitby=(0, 1))
+            return rows.as_list()[0] if rows else None
+        table = db.py4web_error_group
+        query = table.last_seen > utcnow() - datetime.timedelta(days=self.retention_days)
+        if app_name:
+            query &= table.app_name == app_name
+        if search:
+            query &= table.path.contains(search) | table.error.contains(search)
+        rows = db(query).select(
+            orderby=~table.last_seen,
+            limitby=(page * page_size, (page + 1) * page_size),
+        )
+        return [
+            dict(
+                uuid=row.last_uuid,
+                app_name=row.app_name,
+                method=row.method,
+                path=row.path,
+                timestamp=row.last_seen,
+                first_seen=row.first_seen,
+                client_ip=row.client_ip,
+                error=row.error,
+                count=row.count,
+            )
+            for row in rows
+        ]
+
+    def clear(self):
+        """Erase all tickets from database"""
+        db = self.db
+        db(db.py4web_error).delete()
+        db(db.py4web_error_group).delete()
+        db.commit()
+
+    def sweep(self, force=False):
+        """Delete a batch of expired tickets, at most once per interval"""
+        with self.lock:
+            if not force and time.monotonic() - self.swept_at < self.sweep_interval:
+                return 0
+            self.swept_at = time.monotonic()
+        db = self.db
+        cutoff = utcnow() - datetime.timedelta(days=self.retention_days)
+        try:
+            query = db.py4web_error.timestamp < cutoff
+            excess = db(db.py4web_error).count() - self.max_tickets
+            if excess > 0:
+                # the oldest ones, whatever their age
+                rows = db(db.py4web_error).select(
+                    db.py4web_error.id,
+                    orderby=db.py4web_error.id,
+                    limitby=(excess - 1, excess),
+                )
+                if rows:
+                    query |= db.py4web_error.id <= rows.first().id
+            ids = [
+                row.id
+                for row in db(query).select(
+                    db.py4web_error.id, limitby=(0, self.sweep_batch)
+                )
+            ]
+            if ids:
+                db(db.py4web_error.id.belongs(ids)).delete()
+            deleted = len(ids)
+            ids = [
+                row.id
+                for row in db(db.py4web_error_group.last_seen < cutoff).select(
+                    db.py4web_error_group.id, limitby=(0, self.sweep_batch)
+                )
+            ]
+            if ids:
+                db(db.py4web_error_group.id.belongs(ids)).delete()
+            db.commit()
+        except Exception as err:  # pylint: disable=broad-exception-caught
+            logging.error(str(err))
+            db.rollback()
+            return 0
+        return deleted + len(ids)
+
+    def regroup(self):
+        """Rebuild the groups from the stored tickets"""
+        db = self.db
+        table = db.py4web_error
+        count, first, last = table.id.count(), table.timestamp.min(), table.timestamp.max()
+        for row in db(table).select(
+            table.app_name, table.path, table.error, count, first, last,
+            groupby=table.app_name | table.path | table.error,
+        ):
+            ticket = db(
+                (table.app_name == row.py4web_error.app_name)
+                & (table.path == row.py4web_error.path)
+                & (table.error == row.py4web_error.error)
+            ).select(orderby=~table.timestamp, limitby=(0, 1)).first()
+            db.py4web_error_group.insert(
+                app_name=ticket.app_name,
+                method=ticket.method,
+                path=ticket.path,
+                error=ticket.error,
+                client_ip=ticket.client_ip,
+                count=row[count],
+                stored=row[count],
+                stored_since=row[last],
+                first_seen=row[first],
+                last_seen=row[last],
+                last_uuid=ticket.uuid,
+            )
@@ -9,13 +9,20 @@ File operations
 ---------------
 """
 
+import collections
+import concurrent.futures
 import glob
 import gzip
 import logging
 import os
 import re
 import shutil
+import struct
 import tarfile
+import time
+import zlib
+
+from .zipstream import CHUNK_SIZE, THREADS, WINDOW, _deflate_piece
 
 __all__ = (
     "safe_join",
@@ -44,12 +51,16 @@ def list_dir(
     sort=True,
     maxnum=None,
     exclude=None,
+    exclude_expression=None,
 ):
     """
     Like `os.listdir()` but you can specify a regex pattern to filter files.
     If `add_dirs` is True, the returned items will have the full path.
+    Files directly in the folders of `exclude` are skipped, files and
+    folders whose path (relative to `path`) match `exclude_expression`
+    are skipped, folders are not entered.
     """
-    exclude = exclude or []
+    exclude = set(exclude or [])
     if path[-1:] != os.path.sep:
         path = path + os.path.sep
     if drop_prefix:
@@ -57,19 +68,40 @@ def list_dir(
     else:
         n = 0
     regex = re.compile(expression)
+    skip = re.compile(exclude_expression).search if exclude_expression else None
     items = []
-    for root, dirs, files in os.walk(path, topdown=True):
-        for dir in dirs[:]:
-            if dir.startswith("."):
-                dirs.remove(dir)
+    stack = [path]
+    while stack:
+        root = stack.pop()
         if add_dirs:
             items.append(root[n:])
-        for file in sorted(files):
-            if regex.match(file) and not file.startswith("."):
-                if root not in exclude:
-                    items.append(os.path.join(root, file)[n:])
-            if maxnum and len(items) >= maxnum:
-                break
+        try:
+            entries = list(os.scandir(root))
+        except OSError:
+            continue
+        # reversed so that the stack pops the folders in order
+        entries.sort(key=lambda entry: entry.name, reverse=True)
+        files = []
+        for entry in entries:
+            name = entry.name
+            if name.startswith("."):
+                continue
+            if skip and skip(entry.path[len(path):]):
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if is_dir:
+                # like os.walk, symlinked folders are listed but not entered
+                if not entry.is_symlink():
+                    stack.append(entry.path)
+            elif regex.match(name) and root not in exclude:
+                files.append(entry.path[n:])
+        items.extend(reversed(files))
+        if maxnum and len(items) >= maxnum:
+            del items[maxnum:]
+            break
     if sort:
         return sorted(items)
     else:
@@ -86,15 +118,68 @@ def recursive_unlink(path):
         os.unlink(path)
 
 
+class ParallelGzipFile:
+    """Write only gzip file object, deflating blocks in a thread pool
+
+    Every CHUNK_SIZE block is primed with the end of the previous one and
+    ended with a sync flush, so the blocks join into one deflate stream
+    (the pigz way, zlib releases the GIL). At most two blocks per thread
+    are held in memory.
+    """
+
+    def __init__(self, fileobj, level=6, threads=THREADS, chunk_size=CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.level = level
+        self.threads = threads
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.history = b""
+        self.pending = collections.deque()
+        self.crc = self.size = 0
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        # magic, deflate, no flags, mtime, no extra flags, unknown os
+        fileobj.write(struct.pack("<BBBBIBB", 0x1F, 0x8B, 8, 0, int(time.time()), 0, 255))
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self._submit(bytes(self.buffer[: self.chunk_size]), False)
+            del self.buffer[: self.chunk_size]
+        return len(data)
+
+    def _submit(self, data, last):
+        self.pending.append(
+            self.executor.submit(_deflate_piece, data, self.history, self.level, last)
+        )
+        self.history = data[-WINDOW:]
+        while self.pending and (last or len(self.pending) > 2 * self.threads):
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.executor is None:
+            return
+        self._submit(bytes(self.buffer), True)
+        self.buffer = bytearray()
+        self.fileobj.write(struct.pack("<II", self.crc, self.size & 0xFFFFFFFF))
+        self.executor.shutdown()
+        self.executor = None
+
+
 def _extractall(filename, path=".", members=None):
-    tar = tarfile.TarFile(filename, "r")
+    tar = tarfile.open(filename, "r|*")
     tar.extractall(path, members)
     tar.close()
 
 
 def tar(file, dir, expression="^.+$", filenames=None, exclude=None):
-    """Tars dir into file, only tars file that match expression"""
-    tar = tarfile.TarFile(file, "w")
+    """Tars dir into file (a path or a file object written in one pass),
+    only tars file that match expression"""
+    if hasattr(file, "write"):
+        tar = tarfile.open(fileobj=file, mode="w|")
+    else:
+        tar = tarfile.TarFile(file, "w")
     try:
         if filenames is None:
             filenames = list_dir(dir, expression, add_dirs=True, exclude=exclude)
@@ -109,34 +194,35 @@ def untar(file, dir):
     _extractall(file, dir)
 
 
-def pack(filename, path, filenames=None, exclude=None):
+def pack(filename, path, filenames=None, exclude=None, threads=THREADS):
     """Packs a py4web application.
 
+    The tar is gzipped while it is written, with threads deflating in
+    parallel when threads > 1.
+
     Args:
         filename(str): path to the resulting archive
         path(str): path to the application
         filenames(list): adds filenames to the archive
     """
     exclude = exclude or []
-    tarname = filename + ".tar"
-    tar(tarname, path, r"^[\w.-]+$", filenames=filenames, exclude=exclude)
-    with open(tarname, "rb") as tarfp, gzip.open(filename, "wb") as gzfp:
-        shutil.copyfileobj(tarfp, gzfp, 4194304)  # 4 MB buffer
-    os.unlink(tarname)
+    with open(filename, "wb") as fp:
+        if threads > 1:
+            gzfp = ParallelGzipFile(fp, threads=threads)
+        else:
+            gzfp = gzip.GzipFile(fileobj=fp, mode="wb")
+        try:
+            tar(gzfp, path, r"^[\w.-]+$", filenames=filenames, exclude=exclude)
+        finally:
+            gzfp.close()
 
 
 def unpack(filename, path, delete_tar=True):
-    tarname = None
-    if filename.endswith(".w3p"):
-        tarname = filename[:-4] + ".tar"
-    if tarname is not None:
-        with gzip.open(filename, "rb") as gzfp, open(tarname, "wb") as tarfp:
-            shutil.copyfileobj(gzfp, tarfp, 4194304)  # 4 MB buffer
-    else:
-        tarname = filename
-    untar(tarname, path)
-    if delete_tar:
-        os.unlink(tarname)
+    """Unpacks a .w3p (gzipped tar) or a tar into path, in one pass.
+    With delete_tar, a plain tar is deleted after the extraction."""
+    untar(filename, path)
+    if delete_tar and not filename.endswith(".w3p"):
+        os.unlink(filename)
 
 
 def create_app(path, model="scaffold.w3p"):
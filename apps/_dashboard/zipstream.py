@@ -0,0 +1,221 @@
+"""
+Zip archives written as a stream of chunks
+
+zipfile needs the whole archive in a seekable file (or in memory) to go
+back and fill in sizes and CRCs. ZipStream writes each entry with a data
+descriptor after its data instead, so the archive can be sent while the
+files are read, holding at most a few chunks in memory:
+
+    for chunk in zip_app(app_dir, exclude=["databases", "uploads"]):
+        send(chunk)
+
+Files larger than PARALLEL_MIN_SIZE are deflated in CHUNK_SIZE pieces by
+a thread pool (zlib releases the GIL), the pigz way: every piece is primed
+with the last 32 KiB of the previous one and ended with a sync flush, so
+the pieces join into one ordinary deflate stream. Already compressed
+files (images, archives) are stored at deflate level 0. Zip64 records are
+written when sizes or offsets need them.
+"""
+
+import collections
+import concurrent.futures
+import os
+import struct
+import time
+import zlib
+
+CHUNK_SIZE = 1 << 20
+PARALLEL_MIN_SIZE = 8 << 20
+OUTPUT_SIZE = 1 << 16
+THREADS = min(4, os.cpu_count() or 1)
+WINDOW = 1 << 15  # deflate history, primes the next chunk
+
+# already compressed, deflating them again only costs time
+COMPRESSED_EXTENSIONS = {
+    ".7z", ".bz2", ".gif", ".gz", ".jpeg", ".jpg", ".mp3", ".mp4", ".png",
+    ".w3p", ".webm", ".webp", ".woff", ".woff2", ".xz", ".zip",
+}
+
+# never packed: editor backups, bytecode and caches
+SKIPPED_DIRECTORIES = {"__pycache__"}
+
+ZIP64_LIMIT = (1 << 31) - 1
+MAX_32 = 0xFFFFFFFF
+FLAGS = 0x08 | 0x800  # sizes in a data descriptor, utf-8 names
+DEFLATED = 8
+
+
+def _deflate_piece(data, history, level, last):
+    if history:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=history)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _dos_time(timestamp):
+    t = time.localtime(max(timestamp, 315532800))  # zip dates start in 1980
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+class ZipStream:
+    """Builds a zip archive, each method yields the bytes it adds"""
+
+    def __init__(self, level=6, threads=THREADS, chunk_size=CHUNK_SIZE,
+                 parallel_min_size=PARALLEL_MIN_SIZE):
+        self.level = level
+        self.threads = threads
+        self.chunk_size = chunk_size
+        self.parallel_min_size = parallel_min_size
+        self.entries = []  # (name, crc, compressed, size, offset, time, date, mode, zip64)
+        self.offset = 0
+        self.executor = None
+
+    def add_file(self, fp, arcname):
+        """Adds the open binary file fp, read from its current position"""
+        stat = os.fstat(fp.fileno())
+        name = arcname.replace(os.sep, "/").encode("utf8")
+        level = (
+            0 if os.path.splitext(arcname)[1].lower() in COMPRESSED_EXTENSIONS else self.level
+        )
+        zip64 = stat.st_size * 1.05 > ZIP64_LIMIT
+        dos_time, dos_date = _dos_time(stat.st_mtime)
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0) if zip64 else b""
+        header = struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, 45 if zip64 else 20, FLAGS, DEFLATED,
+            dos_time, dos_date, 0, MAX_32 if zip64 else 0, MAX_32 if zip64 else 0,
+            len(name), len(extra),
+        ) + name + extra
+        offset = self.offset
+        yield self._out(header)
+
+        crc = size = compressed = 0
+        pieces = (
+            self._deflate_parallel(fp, level)
+            if self.threads > 1 and stat.st_size >= self.parallel_min_size
+            else self._deflate(fp, level)
+        )
+        for data, deflated in pieces:
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            compressed += len(deflated)
+            yield self._out(deflated)
+
+        if zip64:
+            descriptor = struct.pack("<IIQQ", 0x08074B50, crc, compressed, size)
+        else:
+            descriptor = struct.pack("<IIII", 0x08074B50, crc, compressed, size)
+        yield self._out(descriptor)
+        self.entries.append(
+            (name, crc, compressed, size, offset, dos_time, dos_date, stat.st_mode, zip64)
+        )
+
+    def _deflate(self, fp, level):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        while True:
+            data = fp.read(self.chunk_size)
+            if not data:
+                break
+            yield data, compressor.compress(data)
+        yield b"", compressor.flush()
+
+    def _deflate_parallel(self, fp, level):
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.threads)
+        pending = collections.deque()
+        history = b""
+        data = fp.read(self.chunk_size)
+        while data:
+            following = fp.read(self.chunk_size)
+            pending.append((data, self.executor.submit(
+                _deflate_piece, data, history, level, not following
+            )))
+            history = data[-WINDOW:]
+            data = following
+            # bounded read ahead: at most two pieces per thread in memory
+            while len(pending) > 2 * self.threads or (pending and not data):
+                piece, future = pending.popleft()
+                yield piece, future.result()
+        if not history:  # empty file
+            yield b"", _deflate_piece(b"", b"", level, True)
+
+    def close(self):
+        """Yields the central directory, ends the archive"""
+        start = self.offset
+        for name, crc, compressed, size, offset, dos_time, dos_date, mode, zip64 in self.entries:
+            # zip64 fields for the values that overflowed, in this order
+            values = [v for v in (size, compressed, offset) if v >= MAX_32]
+            extra = b""
+            if values:
+                extra = struct.pack("<HH", 1, 8 * len(values)) + struct.pack(
+                    "<%dQ" % len(values), *values
+                )
+            yield self._out(struct.pack(
+                "<IHHHHHHIIIHHHHHII", 0x02014B50, (3 << 8) | 45, 45 if (zip64 or extra) else 20,
+                FLAGS, DEFLATED, dos_time, dos_date, crc, min(compressed, MAX_32),
+                min(size, MAX_32), len(name), len(extra), 0, 0, 0, (mode & 0xFFFF) << 16,
+                min(offset, MAX_32),
+            ) + name + extra)
+        end = self.offset
+        count, directory_size = len(self.entries), end - start
+        if count >= 0xFFFF or directory_size >= MAX_32 or start >= MAX_32:
+            yield self._out(struct.pack(
+                "<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, directory_size, start,
+            ) + struct.pack("<IIQI", 0x07064B50, 0, end, 1))
+        yield self._out(struct.pack(
+            "<IHHHHIIH", 0x06054B50, 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+            min(directory_size, MAX_32), min(start, MAX_32), 0,
+        ))
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def _out(self, data):
+        self.offset += len(data)
+        return data
+
+
+def walk(folder, exclude=()):
+    """(path, name in the archive) of the files to pack, sorted
+
+    Skips hidden files and folders, editor backups, bytecode and caches,
+    and the folders of exclude (paths relative to folder).
+    """
+    exclude = set(path.strip("/") for path in exclude)
+    for root, dirs, files in os.walk(folder):
+        relative = os.path.relpath(root, folder)
+        relative = "" if relative == "." else relative + "/"
+        dirs[:] = sorted(
+            name for name in dirs
+            if name[:1] != "." and name not in SKIPPED_DIRECTORIES
+            and (relative + name) not in exclude
+        )
+        for name in sorted(files):
+            if not (name.endswith("~") or name.endswith(".pyc") or name[:1] in "#."):
+                yield os.path.join(root, name), relative + name
+
+
+def zip_app(folder, exclude=(), **options):
+    """Yields a zip of the files of folder in chunks of about OUTPUT_SIZE"""
+    archive = ZipStream(**options)
+    buffer, buffered = [], 0
+    try:
+        for path, arcname in walk(folder, exclude):
+            try:
+                fp = open(path, "rb")
+            except OSError:
+                continue  # deleted (or unreadable) since the walk listed it
+            with fp:
+                for data in archive.add_file(fp, arcname):
+                    buffer.append(data)
+                    buffered += len(data)
+                    if buffered >= OUTPUT_SIZE:
+                        yield b"".join(buffer)
+                        buffer, buffered = [], 0
+        buffer.extend(archive.close())
+        yield b"".join(buffer)
+    finally:
+        if archive.executor is not None:
+            archive.executor.shutdown(cancel_futures=True)
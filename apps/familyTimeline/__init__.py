@@ -9,6 +9,9 @@ from . import controllers
 # by importing db you expose it to the _dashboard/dbadmin
 from .models import db
 
+# apply pending schema and seed steps (see settings.AUTO_MIGRATE)
+from . import migrations
+
 # import the scheduler
 from .tasks import scheduler
 
@@ -9,24 +9,30 @@ import sys
 from pydal.tools.scheduler import Scheduler
 from pydal.tools.tags import Tags
 
-from py4web import DAL, Cache, Field, Flash, Session, Translator, action
+from py4web import Cache, Field, Flash, Session, Translator, action
 from py4web.server_adapters.logging_utils import make_logger
 from py4web.utils.auth import Auth
 from py4web.utils.downloader import downloader
 from py4web.utils.factories import ActionFactory
 from py4web.utils.mailer import Mailer
 
-from . import settings
+from . import kvstore, settings
+from .compute import ComputePool
+from .logs import setup_logging
+from .metrics import MeteredDAL, registry, route_latency_collector
+from .profiler import MonitoringAccess, RequestProfiler
+from .sessions import CachedStore, DBSessionStore, RedisSessionStore
+from .viewcache import ViewCache
 
 # #######################################################
 # implement custom loggers form settings.LOGGERS
 # #######################################################
-logger = make_logger("py4web:" + settings.APP_NAME, settings.LOGGERS)
+logger = setup_logging(make_logger("py4web:" + settings.APP_NAME, settings.LOGGERS))
 
 # #######################################################
 # connect to db
 # #######################################################
-db = DAL(
+db = MeteredDAL(
     settings.DB_URI,
     folder=settings.DB_FOLDER,
     pool_size=settings.DB_POOL_SIZE,
@@ -40,9 +46,61 @@ db = DAL(
 cache = Cache(size=1000)
 T = Translator(settings.T_FOLDER)
 
+# per-action wall/db timing, list it first in @action.uses(...)
+profiler = RequestProfiler(db, enabled=settings.PROFILER_ENABLED)
+monitoring = MonitoringAccess(
+    settings.MONITORING_TOKEN, allow_local=settings.MODE == "development"
+)
+registry.collector(route_latency_collector(profiler))
+
+# compiled templates, use views.fixture("page.html") in @action.uses(...)
+views = ViewCache(
+    settings.TEMPLATES_FOLDER,
+    check_mtime=settings.TEMPLATES_CHECK_MTIME,
+    on_render=profiler.record_render,
+)
+views.precompile()
+
+# process pool for CPU-bound work, the workers start on first use
+compute_pool = ComputePool(
+    settings.COMPUTE_WORKERS,
+    max_pending=settings.COMPUTE_MAX_PENDING,
+    timeout=settings.COMPUTE_TIMEOUT,
+    start_method=settings.COMPUTE_START_METHOD,
+)
+registry.gauge(
+    "compute_pool_pending", "Computations submitted and not finished", lambda: compute_pool.pending
+)
+registry.gauge(
+    "db_pool_connections",
+    "Idle pooled connections and the configured pool size",
+    lambda: {(key,): value for key, value in db.pool_stats().items()},
+    ["state"],
+)
+
+# shared key-value store of the processes of this machine (see kvstore.py):
+# "local" sessions, the tree cache and cache invalidation messages
+kv = broadcast = None
+if settings.KV_URL:
+    kv = kvstore.connect(settings.KV_URL, settings.APP_FOLDER, settings.KV_AUTOSTART)
+    broadcast = kvstore.Broadcast(kv, settings.APP_NAME + ":invalidate")
+
 # #######################################################
 # pick the session type that suits you best
 # #######################################################
+def cached_sessions(storage):
+    """storage behind the per process session cache (see sessions.py)"""
+    # without a broadcast a logout in another process is only seen on reading the store
+    ttl = settings.SESSION_CACHE_TTL if broadcast else settings.SESSION_CACHE_TTL_UNSHARED
+    return CachedStore(
+        storage,
+        settings.SESSION_CACHE_SIZE,
+        ttl,
+        broadcast=broadcast,
+        write_interval=settings.SESSION_WRITE_INTERVAL,
+    )
+
+
 if settings.SESSION_TYPE == "cookies":
     session = Session(secret=settings.SESSION_SECRET_KEY)
 
@@ -52,12 +110,20 @@ elif settings.SESSION_TYPE == "redis":
     host, port = settings.REDIS_SERVER.split(":")
     # for more options: https://github.com/andymccurdy/redis-py/blob/master/redis/client.py
     conn = redis.Redis(host=host, port=int(port))
-    conn.set = (
-        lambda k, v, e, cs=conn.set, ct=conn.ttl: cs(k, v, ct(k))
-        if ct(k) >= 0
-        else cs(k, v, e)
+    session = Session(
+        secret=settings.SESSION_SECRET_KEY,
+        storage=cached_sessions(RedisSessionStore(conn)),
+    )
+
+elif settings.SESSION_TYPE == "local":
+    # the redis stand-in of KV_URL, cached sessions are dropped in the other
+    # processes as soon as they change
+    if kv is None:
+        raise RuntimeError('SESSION_TYPE "local" needs settings.KV_URL')
+    session = Session(
+        secret=settings.SESSION_SECRET_KEY,
+        storage=cached_sessions(RedisSessionStore(kv)),
     )
-    session = Session(secret=settings.SESSION_SECRET_KEY, storage=conn)
 
 elif settings.SESSION_TYPE == "memcache":
     import time
@@ -65,17 +131,26 @@ elif settings.SESSION_TYPE == "memcache":
     import memcache
 
     conn = memcache.Client(settings.MEMCACHE_CLIENTS, debug=0)
-    session = Session(secret=settings.SESSION_SECRET_KEY, storage=conn)
+    session = Session(
+        secret=settings.SESSION_SECRET_KEY,
+        storage=cached_sessions(conn),
+    )
 
 elif settings.SESSION_TYPE == "database":
-    from py4web.utils.dbstore import DBStore
-
-    session = Session(secret=settings.SESSION_SECRET_KEY, storage=DBStore(db))
+    session_store = DBSessionStore(
+        db,
+        sweep_interval=settings.SESSION_SWEEP_INTERVAL,
+        sweep_batch=settings.SESSION_SWEEP_BATCH,
+    )
+    session = Session(
+        secret=settings.SESSION_SECRET_KEY,
+        storage=cached_sessions(session_store),
+    )
 
 # #######################################################
 # Instantiate the object and actions that handle auth
 # #######################################################
-auth = Auth(session, db, define_tables=True)  # CHANGED: define_tables=True
+auth = Auth(session, db, define_tables=False)  # tables are defined once below, after the params are set
 auth.use_username = False  # CHANGED: Use email instead of username
 auth.param.registration_requires_confirmation = False  # CHANGED: Skip email verification for now
 auth.param.registration_requires_approval = False
@@ -148,6 +223,17 @@ if settings.USE_SCHEDULER:
         db, logger=logger, max_concurrent_runs=settings.SCHEDULER_MAX_CONCURRENT_RUNS
     )
     scheduler.start()
+
+    def _queue_depth():
+        count = db.task_run.id.count()
+        rows = db(
+            db.task_run.status.belongs(("queued", "assigned", "running"))
+        ).select(db.task_run.status, count, groupby=db.task_run.status)
+        return {(row.task_run.status,): row[count] for row in rows}
+
+    registry.gauge(
+        "background_queue_depth", "Scheduler runs waiting or running", _queue_depth, ["status"]
+    )
 else:
     scheduler = None
 
@@ -0,0 +1,162 @@
+"""
+Background compaction of soft deleted people, stories and relationships
+and of old family invitations
+
+models.delete_people() only marks rows as deleted. compact() removes them
+for good once settings.SOFT_DELETE_RETENTION_DAYS have passed (until then
+they can be restored) and gives the space of their photo blobs back:
+
+- purge_deleted() hard deletes the tombstones in batches of
+  settings.GC_BATCH_SIZE rows, committing after each batch so the SQLite
+  write lock is only held briefly, and stops after GC_MAX_BATCHES.
+- vacuum() runs during settings.GC_OFF_PEAK_HOURS only. The first time it
+  switches the database to auto_vacuum=INCREMENTAL with a full VACUUM,
+  later runs release free pages with PRAGMA incremental_vacuum.
+
+sweep_invitations() likewise deletes the family invitations that expired
+or were used more than settings.INVITATION_RETENTION_DAYS ago, so the
+table only grows with the pending ones.
+
+compact() and sweep() are periodic scheduler tasks (see tasks.py); they can
+also be run by hand with
+
+    py4web call apps familyTimeline.compaction.compact
+    py4web call apps familyTimeline.compaction.sweep
+"""
+
+from datetime import datetime, timedelta
+
+from .common import db, settings
+from .logs import get_logger
+
+log = get_logger("compaction")
+
+# children first, so deleting people has nothing left to cascade to
+PURGE_ORDER = ("stories", "relationships", "people")
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def purge_table(table, cutoff, batch_size, max_batches):
+    """Hard delete the rows of table soft deleted before cutoff"""
+    query = (table.deleted_at != None) & (table.deleted_at < cutoff)
+    return purge_rows(table, query, batch_size, max_batches)
+
+
+def purge_rows(table, query, batch_size, max_batches):
+    """Delete the rows of table matching query, batch_size rows per commit"""
+    purged = 0
+    for _ in range(max_batches):
+        ids = [
+            row.id
+            for row in db(query, ignore_common_filters=True).select(
+                table.id, limitby=(0, batch_size)
+            )
+        ]
+        if not ids:
+            break
+        db(table.id.belongs(ids), ignore_common_filters=True).delete()
+        db.commit()
+        purged += len(ids)
+    return purged
+
+
+def purge_deleted(retention_days=None, batch_size=None, max_batches=None):
+    """Purge expired tombstones, returns the number of rows per table"""
+    retention_days = (
+        settings.SOFT_DELETE_RETENTION_DAYS if retention_days is None else retention_days
+    )
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    return {
+        name: purge_table(
+            db[name],
+            cutoff,
+            batch_size or settings.GC_BATCH_SIZE,
+            max_batches or settings.GC_MAX_BATCHES,
+        )
+        for name in PURGE_ORDER
+    }
+
+
+def sweep_invitations(retention_days=None, batch_size=None, max_batches=None):
+    """Delete invitations expired or used before the retention period
+
+    Returns the number of rows deleted by cause. Each cause is its own
+    query so it can use the index on expires_at or used_at.
+    """
+    retention_days = (
+        settings.INVITATION_RETENTION_DAYS if retention_days is None else retention_days
+    )
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    table = db.family_invitations
+    queries = dict(
+        expired=table.expires_at < cutoff,
+        used=(table.used_at != None) & (table.used_at < cutoff),
+    )
+    return {
+        cause: purge_rows(
+            table,
+            query,
+            batch_size or settings.GC_BATCH_SIZE,
+            max_batches or settings.GC_MAX_BATCHES,
+        )
+        for cause, query in queries.items()
+    }
+
+
+def is_off_peak(now=None):
+    start, end = settings.GC_OFF_PEAK_HOURS
+    hour = (now or datetime.now()).hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def vacuum(pages=None):
+    """Return free pages to the file system (SQLite only)
+
+    Returns "incremental", "full" or None when there was nothing to do.
+    """
+    if db._adapter.dbengine != "sqlite":
+        return None
+    db.commit()  # neither pragma runs inside a transaction
+    free_pages = db.executesql("PRAGMA freelist_count")[0][0]
+    if not free_pages:
+        return None
+    if db.executesql("PRAGMA auto_vacuum")[0][0] == AUTO_VACUUM_INCREMENTAL:
+        # executesql would only step the pragma once (freeing one page)
+        db._adapter.cursor.executescript(
+            "PRAGMA incremental_vacuum(%d);" % (pages or settings.GC_VACUUM_PAGES)
+        )
+        return "incremental"
+    # changing auto_vacuum only takes effect with a full VACUUM, done once
+    db.executesql("PRAGMA auto_vacuum = INCREMENTAL")
+    db.executesql("VACUUM")
+    return "full"
+
+
+def compact(**inputs):
+    """Scheduler task: purge expired tombstones, then vacuum off-peak"""
+    try:
+        purged = purge_deleted(
+            inputs.get("retention_days"), inputs.get("batch_size"), inputs.get("max_batches")
+        )
+        vacuumed = vacuum() if inputs.get("force_vacuum") or is_off_peak() else None
+    except Exception:
+        db.rollback()
+        log.exception("compaction failed")
+        raise
+    log.info("compaction purged %s, vacuum: %s", purged, vacuumed)
+    return dict(purged=purged, vacuum=vacuumed)
+
+
+def sweep(**inputs):
+    """Scheduler task: delete old expired and used invitations"""
+    try:
+        swept = sweep_invitations(
+            inputs.get("retention_days"), inputs.get("batch_size"), inputs.get("max_batches")
+        )
+    except Exception:
+        db.rollback()
+        log.exception("invitation sweep failed")
+        raise
+    log.info("invitation sweep deleted %s", swept)
+    return swept
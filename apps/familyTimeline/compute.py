@@ -0,0 +1,152 @@
+"""
+Shared process pool for the CPU-bound functions of kernels.py
+
+common.py creates one ComputePool from the COMPUTE_* settings; the worker
+processes are only started by the first submit. Then
+
+    levels = compute_pool.run("generation_levels", person_ids, parent_edges, spouse_edges)
+
+runs kernels.generation_levels in a worker and waits for it, so the
+py4web worker thread releases the GIL meanwhile. Pass ids and edges, not
+Rows: arguments and results are pickled to and from the workers.
+
+- Back-pressure: at most max_pending calls are submitted and unfinished
+  at a time; beyond that run() and submit() raise ComputeBusy at once.
+- Timeouts: run() raises ComputeTimeout after timeout seconds. The worker
+  still finishes that call, its slot is only released then.
+- Workers are started with the "spawn" method (no fork of a threaded web
+  server) and load kernels.py by path, without importing the app.
+- With workers=0, or inline=True, the kernel runs in the calling thread.
+
+This module only depends on the standard library so benchmarks can
+import it by path too.
+"""
+
+import concurrent.futures
+import concurrent.futures.process
+import importlib.util
+import multiprocessing
+import os
+import sys
+import threading
+
+KERNELS_MODULE = "familytimeline_kernels"
+KERNELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kernels.py")
+
+
+class ComputeBusy(Exception):
+    """Too many computations pending, try again later"""
+
+
+class ComputeTimeout(Exception):
+    """The computation did not finish in time"""
+
+
+# run by the workers on start, as source: they cannot import this module
+# (which, in the app, would import the whole app package with it)
+WORKER_BOOTSTRAP = """
+import importlib.util, sys
+spec = importlib.util.spec_from_file_location(%r, %r)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+sys.modules[spec.name] = module
+"""
+
+
+def load_kernels(path=KERNELS_PATH, reload=False):
+    """Import kernels.py as a top level module (also in the workers)"""
+    module = sys.modules.get(KERNELS_MODULE)
+    if module is None or reload:
+        spec = importlib.util.spec_from_file_location(KERNELS_MODULE, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[KERNELS_MODULE] = module
+    return module
+
+
+class ComputePool:
+    def __init__(self, workers=None, max_pending=None, timeout=30, start_method="spawn"):
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending or 4 * max(1, self.workers)
+        self.timeout = timeout
+        self.start_method = start_method
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = None
+        # on app reload load the new kernels and stop the previous pool,
+        # its running calls finish and its queued ones are cancelled
+        previous = getattr(sys.modules.get(KERNELS_MODULE), "pool", None)
+        if previous is not None:
+            previous.shutdown(wait=False)
+        self.kernels = load_kernels(reload=True)
+        self.kernels.pool = self
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=exec,
+                    initargs=(WORKER_BOOTSTRAP % (KERNELS_MODULE, self.kernels.__file__), {}),
+                )
+            return self.executor
+
+    def _release(self, future):
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+
+    def submit(self, name, *args):
+        """Start a kernel in a worker, returns a Future (raises ComputeBusy)"""
+        if name not in self.kernels.KERNELS:
+            raise ValueError("Unknown kernel %s" % name)
+        if not self.slots.acquire(blocking=False):
+            raise ComputeBusy("%d computations pending" % self.max_pending)
+        with self.lock:
+            self.pending += 1
+        try:
+            future = self._get_executor().submit(self.kernels.run_kernel, name, args)
+        except Exception as error:
+            self._release(None)
+            self._reset_if_broken(error)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, name, *args, timeout=None, inline=False):
+        """Run a kernel and return its result
+
+        Raises ComputeBusy, ComputeTimeout or the kernel's own exception.
+        """
+        if inline or not self.workers:
+            return self.kernels.KERNELS[name](*args)
+        future = self.submit(name, *args)
+        try:
+            return future.result(timeout or self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()  # only helps if it has not started yet
+            raise ComputeTimeout("%s did not finish in %ss" % (name, timeout or self.timeout))
+        except Exception as error:
+            self._reset_if_broken(error)
+            raise
+
+    def _reset_if_broken(self, error):
+        # a worker died (killed, out of memory): start a new pool next time
+        if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+            self.shutdown(wait=False)
+
+    def stats(self):
+        return dict(
+            workers=self.workers,
+            started=self.executor is not None,
+            pending=self.pending,
+            max_pending=self.max_pending,
+        )
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=not wait)
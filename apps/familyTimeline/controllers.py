@@ -4,26 +4,42 @@ Family Tree Controllers - Complete with Authentication Support
 import os
 import json
 import base64
+import logging
+import time
 from datetime import datetime
 from types import SimpleNamespace
 from py4web import action, request, abort, redirect, URL, HTTP, response
 from py4web.utils.form import Form, FormStyleBulma
+from pydal.validators import IS_EMAIL
 
 # Import from common and models
-from .common import db, session, T, cache, auth, flash, authenticated, unauthenticated
+from .common import db, session, T, cache, auth, flash, authenticated, unauthenticated, settings, profiler, monitoring, compute_pool, views
+from .compute import ComputeBusy, ComputeTimeout
 from .models import (
     create_family_tree_with_owner, get_user_family_trees, check_user_permission,
     get_family_tree_data, get_person_stories, save_person_story,
     add_person, add_relationship, calculate_tree_positions,
-    update_generation_levels, get_user_display_name
+    update_generation_levels, get_user_display_name,
+    get_family_timeline, TIMELINE_ZOOM_LEVELS, get_permitted_family_ids,
+    serialize_person, get_people_details, get_people_stories,
+    get_people_story_counts, get_people_relationships, get_theme_catalogue,
+    get_delete_preview, delete_people, get_branch_ids,
+    get_deletion_family_id, restore_deletion, get_kinship,
+    create_family_invitations, get_pending_invitation_emails,
+    process_family_invitation, ROLE_PERMISSIONS
 )
+from .logs import get_logger, log_event
+from .metrics import registry, PHOTO_BYTES
+from .jobs import job_queue
+
+log = get_logger("controllers")
 
 # ==========================================
 # MAIN PAGES
 # ==========================================
 
 @action('index')
-@action.uses('index.html', db, session, auth)
+@action.uses(profiler, views.fixture('index.html'), db, session, auth)
 def index():
     """Main landing page - redirect to dashboard if logged in"""
     if auth.user:
@@ -32,7 +48,7 @@ def index():
         return dict(authenticated=False)
 
 @action('dashboard')
-@action.uses('dashboard.html', db, session, auth.user, flash)
+@action.uses(profiler, views.fixture('dashboard.html'), db, session, auth.user, flash)
 def dashboard():
     """User dashboard showing all family trees they have access to"""
     user_id = auth.user_id
@@ -48,34 +64,29 @@ def dashboard():
     )
 
 @action('createTree')
-@action.uses('createTree.html', db, session, auth.user, flash)
+@action.uses(profiler, views.fixture('createTree.html'), db, session, auth.user, flash)
 def create_tree_page():
     """Create new family tree page (requires authentication)"""
     try:
         user_record = db.auth_user[auth.user_id]
         return dict(user=user_record)
     except Exception as e:
-        print(f"Error in createTree: {e}")
+        log.exception("createTree failed")
         redirect(URL('dashboard'))
 
 @action('tree/<family_id:int>')
-@action.uses('tree.html', db, session, auth.user)
+@action.uses(profiler, views.fixture('tree.html'), db, session, auth.user)
 def view_tree(family_id):
     """View a specific family tree (requires authentication)"""
-    print(f"DEBUG: Accessing tree with family_id: {family_id}")
-    
     # Check if user has access to this family tree
     if not check_user_permission(auth.user_id, family_id, 'view'):
-        print(f"DEBUG: Permission denied for user {auth.user_id} on family {family_id}")
+        log_event(log, logging.INFO, "tree.forbidden", user_id=auth.user_id, family_id=family_id)
         abort(403, "You don't have permission to access this family tree")
     
     family = db.families[family_id]
     if not family:
-        print(f"DEBUG: Family {family_id} not found")
         abort(404, "Family tree not found")
     
-    print(f"DEBUG: Found family: {family.family_name}")
-    
     # Get additional family info
     family_member_count = db(db.family_members.family_id == family_id).count()
     user_role = db(
@@ -89,6 +100,7 @@ def view_tree(family_id):
     return dict(
         family=family,
         family_code=family.id,
+        theme_catalogue_url=URL('api/theme-catalogue', get_theme_catalogue()['version']),
         family_member_count=family_member_count,
         user_role=user_role.role if user_role else 'viewer',
         auth=auth,
@@ -100,7 +112,7 @@ def view_tree(family_id):
 # ==========================================
 
 @action('login')
-@action.uses('auth.html', db, session, flash)
+@action.uses(profiler, views.fixture('auth.html'), db, session, flash)
 def login():
     """Custom login page"""
     if auth.user:
@@ -116,7 +128,7 @@ def login():
     return dict(form=form, title="Sign In")
 
 @action('register')
-@action.uses('auth.html', db, session, flash)
+@action.uses(profiler, views.fixture('auth.html'), db, session, flash)
 def register():
     """Custom register page"""
     if auth.user:
@@ -130,7 +142,7 @@ def register():
             redirect(URL('dashboard'))
             
     except Exception as e:
-        print(f"Registration error: {e}")
+        log.exception("registration failed")
         if auth.user:
             redirect(URL('dashboard'))
         flash.set("Registration completed. Please sign in.", "info")
@@ -139,7 +151,7 @@ def register():
     return dict(form=form, title="Create Account")
 
 @action('logout')
-@action.uses(db, session, flash)
+@action.uses(profiler, db, session, flash)
 def logout():
     """Logout and redirect"""
     try:
@@ -150,7 +162,7 @@ def logout():
     redirect(URL('index'))
 
 @action('profile')
-@action.uses('auth.html', db, session, auth.user, flash)
+@action.uses(profiler, views.fixture('auth.html'), db, session, auth.user, flash)
 def profile():
     """User profile management"""
     form = auth.form('profile')
@@ -160,7 +172,7 @@ def profile():
     return dict(form=form, title="Profile Settings")
 
 @action('changePassword')
-@action.uses('auth.html', db, session, auth.user, flash)
+@action.uses(profiler, views.fixture('auth.html'), db, session, auth.user, flash)
 def change_password():
     """Change password page"""
     form = auth.form('change_password')
@@ -170,7 +182,7 @@ def change_password():
     return dict(form=form, title="Change Password")
 
 @action('forgotPassword')
-@action.uses('auth.html', db, session, flash)
+@action.uses(profiler, views.fixture('auth.html'), db, session, flash)
 def forgot_password():
     """Password reset request page"""
     form = auth.form('request_reset_password')
@@ -184,7 +196,7 @@ def forgot_password():
 # ==========================================
 
 @action('api/createFamily', method='POST')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def create_family_endpoint():
     """Create a new family tree (requires authentication)"""
     try:
@@ -196,8 +208,7 @@ def create_family_endpoint():
         user_id = auth.user_id
         family_id = create_family_tree_with_owner(data['family_name'], user_id)
         
-        print(f"DEBUG: Created family with ID: {family_id}")
-        print(f"DEBUG: Redirect URL will be: {URL('tree', family_id)}")
+        log_event(log, logging.DEBUG, "family.created", family_id=family_id, user_id=user_id)
         
         return dict(
             success=True,
@@ -207,13 +218,11 @@ def create_family_endpoint():
         )
         
     except Exception as e:
-        print(f"Error creating family: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("createFamily failed")
         return dict(success=False, message=str(e))
 
 @action('api/tree/<family_id>')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def get_tree_data(family_id):
     """Get complete tree data for a family (requires authentication)"""
     try:
@@ -250,13 +259,123 @@ def get_tree_data(family_id):
         settings=settings_data
     )
 
+@action('api/family/<family_id>/timeline')
+@action.uses(profiler, db, session, auth.user)
+def get_family_timeline_endpoint(family_id):
+    """Get stories and life events for a family bucketed by decade or year"""
+    try:
+        family_id_int = int(family_id)
+    except ValueError:
+        raise HTTP(400, "Invalid family ID")
+    
+    # Check if user has access to this family tree
+    if not check_user_permission(auth.user_id, family_id_int, 'view'):
+        raise HTTP(403, "You don't have permission to access this family tree")
+    
+    family = db.families[family_id_int]
+    if not family:
+        raise HTTP(404, "Family not found")
+    
+    zoom = request.query.get('zoom', 'decade')
+    if zoom not in TIMELINE_ZOOM_LEVELS:
+        raise HTTP(400, "Invalid zoom level")
+    
+    try:
+        start_year = int(request.query['start']) if request.query.get('start') else None
+        end_year = int(request.query['end']) if request.query.get('end') else None
+    except ValueError:
+        raise HTTP(400, "Invalid year range")
+    
+    timeline = get_family_timeline(family_id_int, zoom, start_year, end_year)
+    return dict(family_id=family_id_int, **timeline)
+
+def compute_error(error):
+    """HTTP error for a computation the pool could not run"""
+    if isinstance(error, ComputeBusy):
+        return HTTP(503, "Server busy, try again", {'Retry-After': '5'})
+    return HTTP(504, "The computation took too long")
+
+def resize_photo(data, content_type):
+    """Scale a photo down for ?max_size=<pixels> (needs Pillow, else unchanged)"""
+    try:
+        max_size = int(request.query.get('max_size') or 0)
+    except ValueError:
+        raise HTTP(400, "Invalid max_size")
+    if not max_size or compute_pool.kernels.Image is None:
+        return data, content_type
+    try:
+        return compute_pool.run('resize_image', data, max(16, min(max_size, 2048))), 'image/jpeg'
+    except (ComputeBusy, ComputeTimeout) as error:
+        raise compute_error(error)
+
+@action('api/family/<family_id>/kinship')
+@action.uses(profiler, db, session, auth.user)
+def get_kinship_endpoint(family_id):
+    """How person2 is related to person1 (?person1=<id>&person2=<id>)"""
+    try:
+        family_id_int = int(family_id)
+        person1_id = int(request.query.get('person1'))
+        person2_id = int(request.query.get('person2'))
+    except (TypeError, ValueError):
+        raise HTTP(400, "Invalid family or person ID")
+    
+    if not check_user_permission(auth.user_id, family_id_int, 'view'):
+        raise HTTP(403, "You don't have permission to access this family tree")
+    
+    people = db(
+        (db.people.family_id == family_id_int) &
+        db.people.id.belongs((person1_id, person2_id))
+    ).count()
+    if people != len({person1_id, person2_id}):
+        raise HTTP(404, "One or both people not found in this family")
+    
+    try:
+        kinship = get_kinship(family_id_int, person1_id, person2_id)
+    except (ComputeBusy, ComputeTimeout) as error:
+        raise compute_error(error)
+    
+    return dict(
+        person1_id=person1_id,
+        person2_id=person2_id,
+        related=kinship is not None,
+        **(kinship or dict(relationship=None))
+    )
+
+@action('api/family/<family_id>/layout', method='POST')
+@action.uses(profiler, db, session, auth.user)
+def layout_family_endpoint(family_id):
+    """Recompute generation levels and tree positions in the background
+
+    Returns a 202 with the job id, poll api/jobs/<job_id> for the outcome.
+    """
+    try:
+        family_id_int = int(family_id)
+    except ValueError:
+        raise HTTP(400, "Invalid family ID")
+    
+    if not check_user_permission(auth.user_id, family_id_int, 'edit'):
+        raise HTTP(403, "You don't have permission to edit this family tree")
+    
+    job_id = submit_layout_job(family_id_int)
+    response.status = 202
+    return dict(success=True, job_id=job_id, status_url=URL('api/jobs', job_id))
+
+def submit_layout_job(family_id):
+    """Queue a tree_layout job from the family's root person, returns its id"""
+    tree_settings = db(db.tree_settings.family_id == family_id).select(
+        db.tree_settings.root_person_id
+    ).first()
+    inputs = {}
+    if tree_settings and tree_settings.root_person_id:
+        inputs['root_person_id'] = tree_settings.root_person_id
+    return job_queue.submit('tree_layout', family_id, auth.user_id, **inputs)
+
 @action('api/person', method='POST')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def add_person_endpoint():
     """Add a new person to the family tree (requires authentication)"""
     try:
         data = request.json
-        print(f"DEBUG: Received person data: {data}")
         
         # Validate required fields
         if not data:
@@ -306,9 +425,9 @@ def add_person_endpoint():
                 person_data['profile_photo'] = base64.b64decode(photo_data_str)
                 person_data['profile_photo_filename'] = data.get('photo_filename', f"profile_{data['first_name']}.jpg")
             except Exception as e:
-                print(f"Error processing photo: {e}")
+                log.warning("could not decode photo: %s", e)
         
-        print(f"DEBUG: Creating person with data: {person_data}")
+        log_event(log, logging.DEBUG, "person.create", family_id=family_id, user_id=auth.user_id, data=person_data)
         
         person_id = add_person(
             family_id, 
@@ -316,8 +435,6 @@ def add_person_endpoint():
             **person_data
         )
         
-        print(f"DEBUG: Created person with ID: {person_id}")
-        
         return dict(
             success=True,
             person_id=person_id,
@@ -325,16 +442,14 @@ def add_person_endpoint():
         )
         
     except Exception as e:
-        print(f"ERROR in add_person_endpoint: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("add_person_endpoint failed")
         return dict(
             success=False,
             message=str(e)
         )
 
 @action('api/person/<person_id>')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def get_person_endpoint(person_id):
     """Get details for a specific person"""
     try:
@@ -350,28 +465,67 @@ def get_person_endpoint(person_id):
     if not check_user_permission(auth.user_id, person.family_id, 'view'):
         raise HTTP(403, "You don't have permission to view this person")
     
-    person_data = {
-        'id': person.id,
-        'first_name': person.first_name,
-        'last_name': person.last_name or '',
-        'maiden_name': person.maiden_name or '',
-        'nickname': person.nickname or '',
-        'birth_date': person.birth_date.isoformat() if person.birth_date else None,
-        'death_date': person.death_date.isoformat() if person.death_date else None,
-        'birth_place': person.birth_place or '',
-        'is_living': person.is_living,
-        'gender': person.gender or '',
-        'bio_summary': person.bio_summary or '',
-        'has_photo': bool(person.profile_photo),
-        'generation_level': person.generation_level,
-        'node_color': person.node_color or 'green',
-        'node_shape': person.node_shape or 'circle'
-    }
+    person_data = serialize_person(person, bool(person.profile_photo))
     
     return dict(person=person_data)
 
+# Optional data the batch endpoint can attach to each person
+PEOPLE_BATCH_INCLUDES = ('stories', 'story_counts', 'relationships', 'photo')
+
+@action('api/people/batch')
+@action.uses(profiler, db, session, auth.user)
+def get_people_batch_endpoint():
+    """Get details for many people in one request
+
+    Query parameters: ids=1,2,3 and an optional include=stories,relationships,...
+    Runs one permission check for all families involved and one belongs()
+    query per include instead of one request per person.
+    """
+    try:
+        person_ids = [int(pid) for pid in request.query.get('ids', '').split(',') if pid.strip()]
+    except ValueError:
+        raise HTTP(400, "Invalid person ID")
+    
+    if not person_ids:
+        raise HTTP(400, "Missing person ids")
+    
+    if len(person_ids) > settings.FAMILY_TREE_SETTINGS['MAX_FAMILY_MEMBERS']:
+        raise HTTP(400, "Too many person ids")
+    
+    include = set(name for name in request.query.get('include', '').split(',') if name)
+    if not include <= set(PEOPLE_BATCH_INCLUDES):
+        raise HTTP(400, "Invalid include")
+    
+    people = get_people_details(person_ids, include_photo='photo' in include)
+    
+    # Check if user has access to every family tree involved
+    family_ids = set(person['family_id'] for person in people.values())
+    if family_ids - get_permitted_family_ids(auth.user_id, family_ids, 'view'):
+        raise HTTP(403, "You don't have permission to view these people")
+    
+    found_ids = list(people)
+    if 'stories' in include:
+        stories = get_people_stories(found_ids)
+        for person_id, person in people.items():
+            person['stories'] = stories.get(person_id, [])
+            person['story_count'] = len(person['stories'])
+    elif 'story_counts' in include:
+        story_counts = get_people_story_counts(found_ids)
+        for person_id, person in people.items():
+            person['story_count'] = story_counts.get(person_id, 0)
+    
+    if 'relationships' in include:
+        relationships = get_people_relationships(found_ids)
+        for person_id, person in people.items():
+            person['relationships'] = relationships.get(person_id, [])
+    
+    return dict(
+        people=[people[pid] for pid in person_ids if pid in people],
+        missing=[pid for pid in person_ids if pid not in people]
+    )
+
 @action('api/person/<person_id>', method='PUT')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def update_person_endpoint(person_id):
     """Update an existing person (requires authentication)"""
     try:
@@ -419,7 +573,7 @@ def update_person_endpoint(person_id):
             update_data['profile_photo'] = base64.b64decode(photo_data_str)
             update_data['profile_photo_filename'] = data.get('photo_filename', f"profile_{data['first_name']}.jpg")
         except Exception as e:
-            print(f"Error processing photo: {e}")
+            log.warning("could not decode photo: %s", e)
     
     # Update the person
     db(db.people.id == person_id_int).update(**update_data)
@@ -430,105 +584,136 @@ def update_person_endpoint(person_id):
         message="Person updated successfully"
     )
 
-@action('api/person/<person_id>', method='DELETE')
-@action.uses(db, session, auth.user)
-def delete_person_endpoint(person_id):
-    """Delete a person and all associated data"""
+def get_person_for_delete(person_id, permission):
+    """Load the name and family of a person, checking the user's permission"""
     try:
         person_id_int = int(person_id)
     except ValueError:
         raise HTTP(400, "Invalid person ID")
     
-    person = db.people[person_id_int]
+    person = db(db.people.id == person_id_int).select(
+        db.people.id, db.people.family_id, db.people.first_name, db.people.last_name
+    ).first()
     if not person:
         raise HTTP(404, "Person not found")
     
-    # Check if user has permission to delete from this family tree
-    if not check_user_permission(auth.user_id, person.family_id, 'manage'):
+    if not check_user_permission(auth.user_id, person.family_id, permission):
+        if permission == 'view':
+            raise HTTP(403, "You don't have permission to view this person")
         raise HTTP(403, "You don't have permission to delete people from this family tree")
+    return person
+
+def delete_preview_response(people, preview):
+    """Shape a get_delete_preview() result for the delete confirmation dialogs"""
+    return dict(
+        person_name=f"{people[0].first_name} {people[0].last_name or ''}".strip(),
+        people=[
+            {'id': p.id, 'name': f"{p.first_name} {p.last_name or ''}".strip()}
+            for p in people
+        ],
+        stories=preview['stories'],
+        relationships=preview['relationships'],
+        story_count=len(preview['stories']),
+        relationship_count=len(preview['relationships'])
+    )
+
+def get_branch(person):
+    """The person and their descendants (see get_branch_ids), as rows"""
+    include_spouses = request.query.get('include_spouses') in ('1', 'true', 'yes')
+    branch_ids = get_branch_ids(person.family_id, person.id, include_spouses)
+    rows = db(db.people.id.belongs(branch_ids)).select(
+        db.people.id, db.people.first_name, db.people.last_name
+    )
+    by_id = {row.id: row for row in rows}
+    return [by_id[person_id] for person_id in branch_ids if person_id in by_id]
+
+@action('api/person/<person_id>', method='DELETE')
+@action.uses(profiler, db, session, auth.user)
+def delete_person_endpoint(person_id):
+    """Delete a person and all associated data"""
+    person = get_person_for_delete(person_id, 'manage')
     
     try:
-        # Get counts for confirmation response
-        story_count = db(db.stories.person_id == person_id_int).count()
-        relationship_count = db(
-            (db.relationships.person1_id == person_id_int) | 
-            (db.relationships.person2_id == person_id_int)
-        ).count()
-        
-        # Delete all stories for this person
-        db(db.stories.person_id == person_id_int).delete()
-        
-        # Delete all relationships involving this person
-        db(
-            (db.relationships.person1_id == person_id_int) | 
-            (db.relationships.person2_id == person_id_int)
-        ).delete()
-        
-        # Delete the person
-        db(db.people.id == person_id_int).delete()
-        
-        db.commit()
-        
-        return dict(
-            success=True,
-            message=f"Person deleted successfully",
-            deleted_stories=story_count,
-            deleted_relationships=relationship_count
-        )
-        
-    except Exception as e:
-        db.rollback()
-        print(f"Error deleting person: {e}")
+        deleted = delete_people([person.id])
+    except Exception:
+        log.exception("deleting person %s failed", person.id)
         raise HTTP(500, "Error deleting person")
+    
+    return dict(
+        success=True,
+        message="Person deleted successfully",
+        deleted_stories=deleted['deleted_stories'],
+        deleted_relationships=deleted['deleted_relationships'],
+        deletion_id=deleted['deletion_id']
+    )
 
 @action('api/person/<person_id>/delete-preview')
-@action.uses(db, session, auth.user)
-def get_delete_preview(person_id):
+@action.uses(profiler, db, session, auth.user)
+def get_delete_preview_endpoint(person_id):
     """Get information about what will be deleted with this person"""
+    person = get_person_for_delete(person_id, 'view')
+    return delete_preview_response([person], get_delete_preview([person.id]))
+
+@action('api/person/<person_id>/branch', method='DELETE')
+@action.uses(profiler, db, session, auth.user)
+def delete_branch_endpoint(person_id):
+    """Delete a person with all their descendants (?include_spouses=1 for their spouses)
+
+    With ?background=1 the delete runs as a job and the response is a 202
+    with the job id, poll api/jobs/<job_id> for the outcome.
+    """
+    person = get_person_for_delete(person_id, 'manage')
+    branch = get_branch(person)
+    
+    if request.query.get('background') in ('1', 'true', 'yes'):
+        job_id = job_queue.submit(
+            'delete_people', person.family_id, auth.user_id,
+            person_ids=[p.id for p in branch]
+        )
+        response.status = 202
+        return dict(success=True, job_id=job_id, status_url=URL('api/jobs', job_id))
+    
     try:
-        person_id_int = int(person_id)
-    except ValueError:
-        raise HTTP(400, "Invalid person ID")
+        deleted = delete_people([p.id for p in branch])
+    except Exception:
+        log.exception("deleting the branch of person %s failed", person.id)
+        raise HTTP(500, "Error deleting branch")
     
-    person = db.people[person_id_int]
-    if not person:
-        raise HTTP(404, "Person not found")
+    return dict(
+        success=True,
+        message=f"Deleted {deleted['deleted_people']} people",
+        **deleted
+    )
+
+@action('api/deletions/<deletion_id>/restore', method='POST')
+@action.uses(profiler, db, session, auth.user)
+def restore_deletion_endpoint(deletion_id):
+    """Undo a person or branch delete within the retention period"""
+    family_id = get_deletion_family_id(deletion_id)
+    if not family_id:
+        raise HTTP(404, "Nothing to restore, the deletion has expired")
     
-    # Check if user has permission
-    if not check_user_permission(auth.user_id, person.family_id, 'view'):
-        raise HTTP(403, "You don't have permission to view this person")
+    if not check_user_permission(auth.user_id, family_id, 'manage'):
+        raise HTTP(403, "You don't have permission to restore people in this family tree")
     
-    # Get stories
-    stories = db(db.stories.person_id == person_id_int).select()
-    story_data = [{'id': s.id, 'title': s.title, 'theme': s.theme} for s in stories]
-    
-    # Get relationships
-    relationships = db(
-        (db.relationships.person1_id == person_id_int) | 
-        (db.relationships.person2_id == person_id_int)
-    ).select()
-    
-    relationship_data = []
-    for rel in relationships:
-        other_person_id = rel.person2_id if rel.person1_id == person_id_int else rel.person1_id
-        other_person = db.people[other_person_id]
-        if other_person:
-            relationship_data.append({
-                'id': rel.id,
-                'relationship_type': rel.relationship_type,
-                'other_person': f"{other_person.first_name} {other_person.last_name or ''}".strip()
-            })
+    try:
+        restored = restore_deletion(deletion_id)
+    except Exception:
+        log.exception("restoring deletion %s failed", deletion_id)
+        raise HTTP(500, "Error restoring")
     
-    return dict(
-        person_name=f"{person.first_name} {person.last_name or ''}".strip(),
-        stories=story_data,
-        relationships=relationship_data,
-        story_count=len(story_data),
-        relationship_count=len(relationship_data)
-    )
+    return dict(success=True, message=f"Restored {restored['restored_people']} people", **restored)
+
+@action('api/person/<person_id>/branch/delete-preview')
+@action.uses(profiler, db, session, auth.user)
+def get_branch_delete_preview(person_id):
+    """Get what deleting a person's branch removes (?include_spouses=1 as for the delete)"""
+    person = get_person_for_delete(person_id, 'view')
+    branch = get_branch(person)
+    return delete_preview_response(branch, get_delete_preview([p.id for p in branch]))
 
 @action('api/relationship', method='POST')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def add_relationship_endpoint():
     """Create a relationship between two people"""
     data = request.json
@@ -565,17 +750,86 @@ def add_relationship_endpoint():
         divorce_date=data.get('divorce_date')
     )
     
-    # Update generation levels if needed
-    update_generation_levels(family_id)
+    # Update generation levels if needed; the relationship is committed,
+    # a family too large to do it in time gets a layout job instead
+    job_id = None
+    try:
+        update_generation_levels(family_id)
+    except ComputeTimeout:
+        log.warning("generation levels of family %s timed out, queueing a layout", family_id)
+        job_id = submit_layout_job(family_id)
     
     return dict(
         success=True,
         relationship_id=relationship_id,
+        layout_job_id=job_id,
         message="Relationship created successfully"
     )
 
+@action('api/family/<family_id>/invitations', method='POST')
+@action.uses(profiler, db, session, auth.user)
+def bulk_invite_endpoint(family_id):
+    """Invite many people at once
+
+    Takes {"invitations": [{"email": ..., "role": ...}, ...]} (role
+    defaults to "viewer") and creates them all in one transaction. Emails
+    with a pending invitation to this family are skipped.
+    """
+    try:
+        family_id_int = int(family_id)
+    except ValueError:
+        raise HTTP(400, "Invalid family ID")
+    
+    if not check_user_permission(auth.user_id, family_id_int, 'invite'):
+        raise HTTP(403, "You don't have permission to invite people to this family tree")
+    
+    entries = (request.json or {}).get('invitations')
+    if not isinstance(entries, list) or not entries:
+        raise HTTP(400, "Missing invitations")
+    if len(entries) > settings.INVITATION_MAX_BULK:
+        raise HTTP(400, f"At most {settings.INVITATION_MAX_BULK} invitations per request")
+    
+    invitations, errors, seen = [], [], set()
+    for index, entry in enumerate(entries):
+        email = str((entry or {}).get('email') or '').strip().lower()
+        role = (entry or {}).get('role') or 'viewer'
+        if IS_EMAIL()(email)[1]:
+            errors.append(dict(index=index, email=email, error="Invalid email"))
+        elif role not in ROLE_PERMISSIONS or role == 'owner':
+            errors.append(dict(index=index, email=email, error="Invalid role"))
+        elif email not in seen:
+            seen.add(email)
+            invitations.append((email, role))
+    if errors:
+        response.status = 400
+        return dict(success=False, message="Invalid invitations", errors=errors)
+    
+    pending = get_pending_invitation_emails(family_id_int, [email for email, _ in invitations])
+    invitations = [(email, role) for email, role in invitations if email not in pending]
+    tokens = create_family_invitations(family_id_int, invitations, auth.user_id) if invitations else []
+    
+    log_event(log, logging.INFO, "invitations.created", family_id=family_id_int,
+              user_id=auth.user_id, count=len(tokens))
+    return dict(
+        success=True,
+        invited=[
+            dict(email=email, role=role, token=token)
+            for (email, role), token in zip(invitations, tokens)
+        ],
+        already_invited=sorted(pending)
+    )
+
+@action('api/invitations/<token>/accept', method='POST')
+@action.uses(profiler, db, session, auth.user)
+def accept_invitation_endpoint(token):
+    """Join a family tree with an invitation token"""
+    joined, message = process_family_invitation(token, auth.user_id)
+    if not joined:
+        response.status = 400
+    return dict(success=joined, message=message)
+
 @action('api/person/<person_id>/stories')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def get_person_stories_endpoint(person_id):
     """Get all stories for a specific person"""
     try:
@@ -595,7 +849,7 @@ def get_person_stories_endpoint(person_id):
     return dict(stories=stories)
 
 @action('api/story', method='POST')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def add_story_endpoint():
     """Add a new story for a person (requires authentication)"""
     data = request.json
@@ -636,7 +890,7 @@ def add_story_endpoint():
             photo_data = base64.b64decode(photo_data_str)
             photo_filename = data.get('photo_filename', f"story_{data['title']}.jpg")
         except Exception as e:
-            print(f"Error processing photo: {e}")
+            log.warning("could not decode photo: %s", e)
     
     # Get author name from authenticated user
     author_name = get_user_display_name(auth.user_id)
@@ -669,57 +923,52 @@ def add_story_endpoint():
     )
 
 @action('api/themes')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def get_all_themes():
     """Get all available themes"""
-    themes = db().select(
-        db.theme_questions.theme,
-        distinct=True,
-        orderby=db.theme_questions.theme
-    )
-    
-    theme_names = {
-        'childhood': 'Childhood',
-        'personality': 'Personality', 
-        'family_life': 'Family Life',
-        'career': 'Career & Work',
-        'adventures': 'Adventures & Travel',
-        'relationships': 'Relationships',
-        'wisdom': 'Wisdom & Lessons',
-        'memories': 'Personal Memories',
-        'general': 'General'
-    }
-    
-    result = []
-    for theme in themes:
-        result.append({
-            'key': theme.theme,
-            'name': theme_names.get(theme.theme, theme.theme.title())
-        })
-    
+    catalogue = get_theme_catalogue()['catalogue']
+    result = [{'key': theme['key'], 'name': theme['name']} for theme in catalogue['themes']]
     return dict(themes=result)
 
 @action('api/themes/<theme>/questions')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def get_theme_questions(theme):
     """Get all questions for a specific theme"""
-    questions = db(
-        (db.theme_questions.theme == theme) & 
-        (db.theme_questions.is_active == True)
-    ).select(orderby=db.theme_questions.order_index)
-    
-    result = []
-    for q in questions:
-        result.append({
-            'id': q.id,
-            'text': q.question_text,
-            'order': q.order_index
-        })
+    catalogue = get_theme_catalogue()['catalogue']
+    for item in catalogue['themes']:
+        if item['key'] == theme:
+            return dict(questions=item['questions'])
+    return dict(questions=[])
+
+@action('api/theme-catalogue')
+@action('api/theme-catalogue/<version>')
+@action.uses(profiler, db)
+def get_theme_catalogue_bundle(version=None):
+    """Serve all themes and questions as one JSON bundle
+
+    The versioned URL is immutable and cached by browsers for a year, the
+    unversioned one must be revalidated (ETag) on every use.
+    """
+    catalogue = get_theme_catalogue()
+    if version and version != catalogue['version']:
+        # Stale link from an old page, point it at the current bundle
+        redirect(URL('api/theme-catalogue', catalogue['version']))
+    
+    etag = '"%s"' % catalogue['version']
+    response.headers['ETag'] = etag
+    if version:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    if request.headers.get('If-None-Match') == etag:
+        response.status = 304
+        return ''
     
-    return dict(questions=result)
+    response.headers['Content-Type'] = 'application/json'
+    return catalogue['data']
 
 @action('api/story-photo/<story_id>')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def get_story_photo(story_id):
     """Get photo for a story"""
     try:
@@ -745,12 +994,15 @@ def get_story_photo(story_id):
         elif story.photo_filename.lower().endswith('.webp'):
             content_type = 'image/webp'
     
+    photo, content_type = resize_photo(story.photo_data, content_type)
     response.headers['Content-Type'] = content_type
     response.headers['Cache-Control'] = 'public, max-age=3600'
-    return story.photo_data
+    profiler.record_blob(len(photo))
+    PHOTO_BYTES.inc(len(photo), kind='story')
+    return photo
 
 @action('api/person-photo/<person_id>')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def get_person_photo(person_id):
     """Get profile photo for a person"""
     try:
@@ -776,16 +1028,19 @@ def get_person_photo(person_id):
         elif person.profile_photo_filename.lower().endswith('.webp'):
             content_type = 'image/webp'
     
+    photo, content_type = resize_photo(person.profile_photo, content_type)
     response.headers['Content-Type'] = content_type
     response.headers['Cache-Control'] = 'public, max-age=3600'
-    return person.profile_photo
+    profiler.record_blob(len(photo))
+    PHOTO_BYTES.inc(len(photo), kind='profile')
+    return photo
 
 # ==========================================
 # DEBUG ENDPOINTS
 # ==========================================
 
 @action('debug/test-tree')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def debug_tree_route():
     """Debug tree routing"""
     
@@ -811,7 +1066,7 @@ def debug_tree_route():
     return debug_html
 
 @action('api/debug/user-info')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def debug_user_info():
     """Debug endpoint to see user info (development only)"""
     user_trees = get_user_family_trees(auth.user_id)
@@ -830,25 +1085,105 @@ def debug_user_info():
     
     return debug_info
 
+@action('api/debug/profile')
+@action.uses(monitoring)
+def debug_profile():
+    """Slowest routes with their latency histogram and top queries"""
+    try:
+        limit = int(request.query.get('limit', 10))
+    except ValueError:
+        raise HTTP(400, "Invalid limit")
+    
+    routes = profiler.report(limit)
+    if request.query.get('reset'):
+        profiler.reset()
+    
+    return dict(enabled=profiler.enabled, routes=routes)
+
+@action('api/jobs/<job_id>')
+@action.uses(profiler, db, session, auth.user)
+def get_job(job_id):
+    """Status, progress and outcome of a background job"""
+    try:
+        job_id_int = int(job_id)
+    except ValueError:
+        raise HTTP(400, "Invalid job ID")
+    
+    job = job_queue.get(job_id_int)
+    if not job:
+        raise HTTP(404, "Job not found")
+    
+    if job.user_id != auth.user_id and not (
+        job.family_id and check_user_permission(auth.user_id, job.family_id, 'view')
+    ):
+        raise HTTP(403, "You don't have permission to view this job")
+    
+    return dict(
+        id=job.id,
+        name=job.name,
+        family_id=job.family_id,
+        status=job.status,
+        progress=job.progress,
+        message=job.message,
+        attempts=job.attempts,
+        max_attempts=job.max_attempts,
+        result=job.result if job.status == 'completed' else None,
+        # the last line of the traceback, the rest is in the logs
+        error=job.error.strip().splitlines()[-1] if job.error else None,
+        created_at=job.created_at.isoformat() if job.created_at else None,
+        started_at=job.started_at.isoformat() if job.started_at else None,
+        completed_at=job.completed_at.isoformat() if job.completed_at else None
+    )
+
 # ==========================================
 # UTILITY ENDPOINTS
 # ==========================================
 
+@action('api/health/live')
+def liveness_check():
+    """Liveness probe: the worker is up and answering, touches nothing else"""
+    return dict(status="alive", timestamp=datetime.utcnow().isoformat())
+
 @action('api/health')
+@action.uses(profiler, db)
 def health_check():
-    """Simple health check endpoint"""
+    """Readiness probe: the database answers a trivial query
+
+    Returns 503 when it does not, so load balancers stop routing here.
+    """
+    t0 = time.perf_counter()
+    try:
+        db.executesql("SELECT 1")
+        database = dict(ok=True)
+    except Exception as e:
+        log.warning("health check: database unavailable: %s", e)
+        database = dict(ok=False, error=str(e))
+    database['ms'] = round((time.perf_counter() - t0) * 1000, 3)
+    
+    if not database['ok']:
+        response.status = 503
     return dict(
-        status="healthy",
+        status="healthy" if database['ok'] else "unavailable",
         timestamp=datetime.utcnow().isoformat(),
-        authenticated=bool(auth.user) if hasattr(auth, 'user') else False,
+        checks=dict(database=database),
         app_version="2.0.0-auth"
     )
 
+@action('metrics')
+@action.uses(monitoring, db)
+def metrics():
+    """Prometheus text exposition of the app metrics"""
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return registry.exposition()
+
 @action('api/status')
-@action.uses(db, session, auth.user)
+@action.uses(profiler, db, session, auth.user)
 def api_status():
     """API status for authenticated users"""
-    user_family_count = len(get_user_family_trees(auth.user_id))
+    user_family_count = db(
+        (db.family_members.user_id == auth.user_id) &
+        (db.family_members.is_active == True)
+    ).count()
     
     return dict(
         status="ok",
@@ -862,11 +1197,11 @@ def api_status():
 # Clear Database
 
 @action('api/clear_database', method=['GET', 'POST'])
-@action.uses(db, session)   # or drop auth entirely if it’s just you
+@action.uses(profiler, db, session)   # or drop auth entirely if it’s just you
 def clear_database():
     # delete everything except the auth tables
     for t in db.tables:
         if t not in ('auth_user','auth_group','auth_membership'):
-            db(db[t]).delete()
+            db(db[t], ignore_common_filters=True).delete()
     db.commit()
     return dict(success=True, message="✅ All non-auth tables wiped.")
\ No newline at end of file
@@ -0,0 +1,410 @@
+"""
+Background jobs on top of the built-in scheduler
+
+Register a task with the input types it takes:
+
+    from .jobs import job_queue
+
+    @job_queue.task("delete_branch", inputs=dict(person_ids=list), retries=2)
+    def delete_branch(job, person_ids):
+        job.progress(0.5, "deleting")
+        return dict(deleted=len(person_ids))
+
+and submit it from an action, which returns at once with the job id:
+
+    job_id = job_queue.submit("delete_branch", family_id, auth.user_id, person_ids=[1, 2])
+
+Every job is a row of db.jobs with its status (queued, running, retrying,
+completed, failed), progress, message, result and error, served by
+api/jobs/<id>. Inputs are checked against the declared types on submit.
+
+- With settings.USE_SCHEDULER each job is a run of the scheduler task
+  "job" (a forked process, killed after the task timeout); lower
+  priority values run first. Without the scheduler a small thread pool
+  of the web process runs them, in submission order and without timeout.
+- A failed job is retried after settings.JOBS_RETRY_DELAY seconds,
+  doubled after each attempt, until the task's retries are used up.
+- At most settings.JOBS_MAX_PER_FAMILY jobs of one family run at once
+  (checked in the update claiming the job), the others wait one to two
+  times settings.JOBS_BUSY_DELAY seconds and try again.
+- The thread pool dies with its process. A running job records its owner
+  (host:pid:boot token, the token surviving app reloads) and a heartbeat
+  refreshed every settings.JOBS_HEARTBEAT seconds. A job whose owner
+  process is gone, or whose heartbeat is older than
+  settings.JOBS_HEARTBEAT_TIMEOUT, gets another attempt (or fails): on
+  startup, when it blocks its family and when it is polled. On startup
+  recover() also submits the pending jobs again, at their scheduled_for.
+"""
+
+import concurrent.futures
+import inspect
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from .common import db, scheduler, settings
+from .logs import get_logger
+
+log = get_logger("jobs")
+
+PENDING = ("queued", "retrying")
+SCHEDULER_TASK = "job"
+
+# the process running a job, BOOT is kept in the environment so that an
+# app reload does not disown the jobs still running in its old executor
+HOST = socket.gethostname()
+BOOT = os.environ.setdefault("PY4WEB_JOBS_BOOT", uuid.uuid4().hex[:12])
+
+
+def get_owner():
+    return "%s:%s:%s" % (HOST, os.getpid(), BOOT)
+
+
+def owner_gone(owner):
+    """True if the process that owned a job is known to have ended"""
+    try:
+        host, pid, boot = owner.rsplit(":", 2)
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False
+    if host != HOST or os.name != "posix":
+        return False  # only the heartbeat tells
+    if pid == os.getpid():
+        return boot != BOOT  # a previous process had our pid
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def retry_delay(attempts):
+    return settings.JOBS_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+class JobTask:
+    """A registered job function with its input types and run options"""
+
+    def __init__(self, name, func, inputs, priority, retries, timeout):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.priority = priority
+        self.max_attempts = retries + 1
+        self.timeout = timeout
+        parameters = list(inspect.signature(func).parameters.values())[1:]
+        self.required = set(
+            p.name for p in parameters if p.default is inspect.Parameter.empty
+        )
+
+    def check_inputs(self, inputs):
+        """Raise ValueError unless inputs match the declared names and types"""
+        unknown = set(inputs) - set(self.inputs)
+        if unknown:
+            raise ValueError("Unknown inputs for %s: %s" % (self.name, ", ".join(sorted(unknown))))
+        missing = self.required - set(inputs)
+        if missing:
+            raise ValueError("Missing inputs for %s: %s" % (self.name, ", ".join(sorted(missing))))
+        for key, value in inputs.items():
+            expected = self.inputs[key]
+            # bool is an int subclass, do not let True pass as a number
+            if not isinstance(value, expected) or (
+                isinstance(value, bool) and expected is not bool
+            ):
+                raise ValueError(
+                    "Input %s of %s must be %s" % (key, self.name, expected.__name__)
+                )
+
+
+class JobContext:
+    """Passed to the job function as its first argument"""
+
+    def __init__(self, job_id, family_id=None, user_id=None):
+        self.id = job_id
+        self.family_id = family_id
+        self.user_id = user_id
+
+    def progress(self, fraction, message=None):
+        """Report progress (0 to 1); this commits the job's work so far"""
+        fields = dict(progress=max(0.0, min(1.0, fraction)))
+        if message is not None:
+            fields['message'] = message[:255]
+        db(db.jobs.id == self.id).update(**fields)
+        db.commit()
+
+
+class JobQueue:
+    def __init__(self, scheduler=None):
+        self.scheduler = scheduler
+        self.tasks = {}
+        self.executor = None
+        self.active = set()  # ids of the jobs this thread pool runs
+        self.heartbeat = None
+        self.lock = threading.Lock()
+        if scheduler:
+            scheduler.register_task(SCHEDULER_TASK, self.run_scheduled)
+
+    def task(self, name, inputs=None, priority=0, retries=0, timeout=3600):
+        """Decorator registering func(job, **inputs) as the job named name"""
+
+        def register(func):
+            self.tasks[name] = JobTask(name, func, inputs or {}, priority, retries, timeout)
+            return func
+
+        return register
+
+    def submit(self, name, family_id=None, user_id=None, priority=None, **inputs):
+        """Queue a job and return its id, raises ValueError for bad inputs"""
+        task = self.tasks.get(name)
+        if task is None:
+            raise ValueError("Unknown job %s" % name)
+        task.check_inputs(inputs)
+        job_id = db.jobs.insert(
+            name=name,
+            family_id=family_id,
+            user_id=user_id,
+            inputs=inputs,
+            priority=task.priority if priority is None else priority,
+            max_attempts=task.max_attempts,
+        )
+        db.commit()  # the worker must see the job
+        self.dispatch(job_id, task)
+        return job_id
+
+    def dispatch(self, job_id, task, delay=0):
+        """Hand the job to the scheduler or to the thread pool"""
+        if delay:
+            scheduled_for = datetime.utcnow() + timedelta(seconds=delay)
+            db(db.jobs.id == job_id).update(scheduled_for=scheduled_for)
+            db.commit()
+        if self.scheduler:
+            job = db.jobs[job_id]
+            run_id = self.scheduler.enqueue_run(
+                SCHEDULER_TASK,
+                description=task.name,
+                inputs=dict(job_id=job_id),
+                timeout=task.timeout,
+                priority=job.priority,
+                scheduled_for=datetime.utcnow() + timedelta(seconds=delay),
+            )
+            db(db.jobs.id == job_id).update(task_run_id=run_id)
+            db.commit()
+            return
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                settings.JOBS_THREADS, thread_name_prefix="jobs"
+            )
+        if delay:
+            timer = threading.Timer(delay, self.executor.submit, (self.run_in_thread, job_id))
+            timer.daemon = True
+            timer.start()
+        else:
+            self.executor.submit(self.run_in_thread, job_id)
+
+    def recover(self):
+        """Requeue the stale jobs and submit the pending ones again, on
+        startup of a process running jobs in its thread pool; returns the
+        ids of the jobs submitted"""
+        if self.scheduler:
+            return []  # the scheduler keeps its runs, see get()
+        stale = self.requeue_stale(db.jobs.id > 0, dispatch=False)
+        jobs = db(db.jobs.status.belongs(PENDING)).select(
+            db.jobs.id, db.jobs.name, db.jobs.scheduled_for,
+            orderby=db.jobs.priority | db.jobs.id,
+        )
+        job_ids = [job.id for job in jobs if self.redispatch(job)]
+        if stale or job_ids:
+            log.info("recovered %d stale jobs, %d requeued", len(stale), len(job_ids))
+        return job_ids
+
+    def requeue_stale(self, query, dispatch=True):
+        """Give the running jobs of query whose owner is gone another
+        attempt (or fail them), returns their ids"""
+        if self.scheduler:
+            return []
+        now = datetime.utcnow()
+        expired = now - timedelta(seconds=settings.JOBS_HEARTBEAT_TIMEOUT)
+        rows = db(query & (db.jobs.status == "running")).select(
+            db.jobs.id, db.jobs.name, db.jobs.attempts, db.jobs.max_attempts,
+            db.jobs.owner, db.jobs.heartbeat_at, db.jobs.started_at,
+        )
+        error = "Interrupted, its process is gone"
+        stale = []
+        for job in rows:
+            if not (owner_gone(job.owner) or (job.heartbeat_at or job.started_at) < expired):
+                continue
+            # the job may have finished meanwhile
+            still_running = (db.jobs.id == job.id) & (db.jobs.status == "running")
+            if job.attempts < job.max_attempts:
+                job.scheduled_for = now + timedelta(seconds=retry_delay(job.attempts))
+                updated = db(still_running).update(
+                    status="retrying", error=error, scheduled_for=job.scheduled_for
+                )
+            else:
+                updated = db(still_running).update(
+                    status="failed", error=error, completed_at=now
+                )
+            db.commit()
+            if updated:
+                log.warning("job %s (%s) of %s is stale", job.id, job.name, job.owner)
+                stale.append(job.id)
+                if dispatch and job.attempts < job.max_attempts:
+                    self.redispatch(job)
+        return stale
+
+    def redispatch(self, job):
+        """Dispatch a pending job row again at its scheduled_for"""
+        task = self.tasks.get(job.name)
+        if task is None:
+            self.finish(job.id, "failed", error="Unknown job %s" % job.name)
+            return False
+        delay = 0
+        if job.scheduled_for:
+            delay = max(0, (job.scheduled_for - datetime.utcnow()).total_seconds())
+        self.dispatch(job.id, task, delay)
+        return True
+
+    def run_scheduled(self, job_id):
+        """Scheduler task "job", runs in the scheduler's child process"""
+        return dict(job_id=job_id, status=self.run(job_id))
+
+    def run_in_thread(self, job_id):
+        db.get_connection_from_pool_or_new()
+        self.beat_for(job_id, True)
+        try:
+            self.run(job_id)
+        except Exception:
+            log.exception("job %s crashed", job_id)
+        finally:
+            self.beat_for(job_id, False)
+            db.recycle_connection_in_pool_or_close("commit")
+
+    def beat_for(self, job_id, active):
+        """Add or remove a job of the heartbeat, started when needed"""
+        with self.lock:
+            if not active:
+                self.active.discard(job_id)
+                return
+            self.active.add(job_id)
+            if self.heartbeat is None:
+                self.heartbeat = threading.Thread(
+                    target=self.beat, name="jobs-heartbeat", daemon=True
+                )
+                self.heartbeat.start()
+
+    def beat(self):
+        """Refresh heartbeat_at of the running jobs of this pool until none is left"""
+        db.get_connection_from_pool_or_new()
+        try:
+            while True:
+                time.sleep(settings.JOBS_HEARTBEAT)
+                with self.lock:
+                    job_ids = list(self.active)
+                    if not job_ids:
+                        self.heartbeat = None
+                        return
+                db(
+                    db.jobs.id.belongs(job_ids) & (db.jobs.status == "running")
+                ).update(heartbeat_at=datetime.utcnow())
+                db.commit()
+        except Exception:
+            with self.lock:
+                self.heartbeat = None
+            log.exception("jobs heartbeat stopped")
+        finally:
+            db.recycle_connection_in_pool_or_close("commit")
+
+    def run(self, job_id):
+        """Run one attempt of a pending job, returns its new status"""
+        job = db.jobs[job_id]
+        if job is None or job.status not in PENDING:
+            return job and job.status
+        task = self.tasks.get(job.name)
+        if task is None:
+            return self.finish(job_id, "failed", error="Unknown job %s" % job.name)
+
+        if not self.claim(job):
+            if db((db.jobs.id == job_id) & db.jobs.status.belongs(PENDING)).isempty():
+                return None  # another worker has it
+            # its family is at the limit, unless a running job is stale;
+            # the jitter keeps the waiting jobs apart
+            self.requeue_stale(db.jobs.family_id == job.family_id)
+            delay = settings.JOBS_BUSY_DELAY * random.uniform(1, 2)
+            self.dispatch(job_id, task, delay)
+            return job.status
+
+        try:
+            result = task.func(JobContext(job_id, job.family_id, job.user_id), **(job.inputs or {}))
+            db.commit()
+        except Exception:
+            db.rollback()
+            error = traceback.format_exc()
+            attempts = job.attempts + 1
+            if attempts < job.max_attempts:
+                delay = retry_delay(attempts)
+                log.warning("job %s (%s) failed, retry in %ss", job_id, job.name, delay)
+                db(db.jobs.id == job_id).update(status="retrying", error=error)
+                db.commit()
+                self.dispatch(job_id, task, delay)
+                return "retrying"
+            log.error("job %s (%s) failed:\n%s", job_id, job.name, error)
+            return self.finish(job_id, "failed", error=error)
+        return self.finish(job_id, "completed", result=result, progress=1.0)
+
+    def claim(self, job):
+        """Move a pending job to running, only one worker can, and only
+        while fewer than JOBS_MAX_PER_FAMILY jobs of its family run"""
+        jobs = db.jobs
+        query = (jobs.id == job.id) & jobs.status.belongs(PENDING)
+        if job.family_id:
+            if db._adapter.dbengine != "sqlite":
+                # SQLite serializes writes, elsewhere concurrent claims
+                # would not see each other: lock the family row
+                db(db.families.id == job.family_id).select(db.families.id, for_update=True)
+            full = db((jobs.family_id == job.family_id) & (jobs.status == "running"))._select(
+                jobs.family_id,
+                groupby=jobs.family_id,
+                having=jobs.id.count() >= settings.JOBS_MAX_PER_FAMILY,
+            )
+            query &= ~jobs.family_id.belongs(full)
+        now = datetime.utcnow()
+        claimed = db(query).update(
+            status="running",
+            attempts=job.attempts + 1,
+            started_at=now,
+            heartbeat_at=now,
+            owner=get_owner(),
+        )
+        db.commit()
+        return claimed
+
+    def finish(self, job_id, status, **fields):
+        db(db.jobs.id == job_id).update(status=status, completed_at=datetime.utcnow(), **fields)
+        db.commit()
+        return status
+
+    def running_for_family(self, family_id):
+        return db((db.jobs.family_id == family_id) & (db.jobs.status == "running")).count()
+
+    def get(self, job_id):
+        """The job row, marking it failed if the scheduler killed its run
+        (or requeued if the thread pool running it is gone)"""
+        job = db.jobs[job_id]
+        if job and job.status == "running" and job.task_run_id and self.scheduler:
+            run = db.task_run[job.task_run_id]
+            if run and run.status in ("timeout", "dead"):
+                self.finish(job_id, "failed", error="Run %s: %s" % (run.id, run.status))
+                job = db.jobs[job_id]
+        elif job and job.status == "running" and self.requeue_stale(db.jobs.id == job_id):
+            job = db.jobs[job_id]
+        return job
+
+
+job_queue = JobQueue(scheduler)
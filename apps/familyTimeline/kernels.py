@@ -0,0 +1,222 @@
+"""
+CPU-bound family graph and image functions run by the compute pool
+
+This module must stay importable on its own: compute.py loads it by path
+in every worker process, so it only imports the standard library (and
+Pillow, optionally). Inputs and outputs are plain lists of ids and
+(id, id) edges, never Rows, so they pickle small:
+
+    person_ids    [1, 2, 3, ...]
+    parent_edges  [(parent_id, child_id), ...]
+    spouse_edges  [(person_id, spouse_id), ...]  (either direction)
+
+Results are lists aligned with person_ids.
+"""
+
+import io
+from collections import deque
+
+try:
+    from PIL import Image
+except ImportError:  # resize_image is unavailable without Pillow
+    Image = None
+
+
+def _children_of(person_ids, parent_edges):
+    known = set(person_ids)
+    children = {person_id: [] for person_id in person_ids}
+    for parent_id, child_id in parent_edges:
+        if parent_id in known and child_id in known:
+            children[parent_id].append(child_id)
+    return children
+
+
+def _levels(person_ids, parent_edges, spouse_edges):
+    children = _children_of(person_ids, parent_edges)
+    indegree = dict.fromkeys(person_ids, 0)
+    for kids in children.values():
+        for child_id in kids:
+            indegree[child_id] += 1
+
+    # longest path from a root, in topological order (cycles keep 0)
+    level = dict.fromkeys(person_ids, 0)
+    queue = deque(person_id for person_id in person_ids if not indegree[person_id])
+    while queue:
+        person_id = queue.popleft()
+        for child_id in children[person_id]:
+            level[child_id] = max(level[child_id], level[person_id] + 1)
+            indegree[child_id] -= 1
+            if not indegree[child_id]:
+                queue.append(child_id)
+
+    # people who married in have no parents here, put them next to their spouse
+    has_parents = set(child_id for _, child_id in parent_edges)
+    for a, b in spouse_edges:
+        if a in level and b in level:
+            if a not in has_parents:
+                level[a] = max(level[a], level[b])
+            if b not in has_parents:
+                level[b] = max(level[b], level[a])
+    return level
+
+
+def generation_levels(person_ids, parent_edges, spouse_edges):
+    """Generation of each person: 0 for the oldest, children one below parents"""
+    level = _levels(person_ids, parent_edges, spouse_edges)
+    return [level[person_id] for person_id in person_ids]
+
+
+def tree_layout(person_ids, parent_edges, spouse_edges, root_id=None, x_spacing=200, y_spacing=150):
+    """(x, y) of each person: couples side by side, centred over their children
+
+    Every person is placed once. Subtrees are laid out left to right from
+    the root (or the oldest people first) and a couple takes the width of
+    its children or of itself, whichever is larger.
+    """
+    level = _levels(person_ids, parent_edges, spouse_edges)
+    children = _children_of(person_ids, parent_edges)
+    spouses = {person_id: [] for person_id in person_ids}
+    for a, b in spouse_edges:
+        if a in spouses and b in spouses and b not in spouses[a]:
+            spouses[a].append(b)
+            spouses[b].append(a)
+    has_parents = set(child_id for _, child_id in parent_edges if child_id in level)
+
+    placed = {}
+    cursor = [0.0]  # next free x, in slots
+
+    def place(person_id):
+        # the unit is the person and the spouses that married in
+        unit = [person_id] + [
+            spouse_id
+            for spouse_id in spouses[person_id]
+            if spouse_id not in placed and spouse_id not in has_parents
+        ]
+        for member in unit:
+            placed[member] = None
+        kids = []
+        for member in unit:
+            for child_id in children[member]:
+                if child_id not in placed and child_id not in kids:
+                    kids.append(child_id)
+        start = cursor[0]
+        for child_id in kids:
+            if child_id not in placed:
+                place(child_id)
+        span = cursor[0] - start
+        # centre the unit over its children, or take room of its own
+        left = start + max(0.0, (span - len(unit)) / 2)
+        for i, member in enumerate(unit):
+            placed[member] = (left + i, level[member])
+        cursor[0] = max(cursor[0], left + len(unit))
+
+    order = sorted(person_ids, key=lambda person_id: (level[person_id], person_id))
+    if root_id in level:
+        order.insert(0, root_id)
+    for person_id in order:
+        if person_id not in placed and (
+            person_id == root_id or person_id not in has_parents
+        ):
+            place(person_id)
+    for person_id in order:  # anything left (parent cycles)
+        if person_id not in placed:
+            place(person_id)
+    return [
+        (placed[person_id][0] * x_spacing, placed[person_id][1] * y_spacing)
+        for person_id in person_ids
+    ]
+
+
+def _ancestors(person_id, parents):
+    """{ancestor_id: generations up}, the person itself at 0"""
+    distance = {person_id: 0}
+    queue = deque([person_id])
+    while queue:
+        current = queue.popleft()
+        for parent_id in parents.get(current, ()):
+            if parent_id not in distance:
+                distance[parent_id] = distance[current] + 1
+                queue.append(parent_id)
+    return distance
+
+
+def _ordinal(n):
+    return {1: "first", 2: "second", 3: "third", 4: "fourth", 5: "fifth"}.get(n, "%dth" % n)
+
+
+def _greats(n, name):
+    return "great-" * n + name
+
+
+def kinship_name(up, down):
+    """What someone is to you, being up generations to the common ancestor
+    from you and down generations from it to them"""
+    if up == 0 and down == 0:
+        return "self"
+    if up == 0:
+        return "child" if down == 1 else _greats(down - 2, "grandchild")
+    if down == 0:
+        return "parent" if up == 1 else _greats(up - 2, "grandparent")
+    if up == 1 and down == 1:
+        return "sibling"
+    if up == 1:
+        return "niece/nephew" if down == 2 else _greats(down - 3, "grandniece/grandnephew")
+    if down == 1:
+        return "aunt/uncle" if up == 2 else _greats(up - 3, "great-aunt/great-uncle")
+    degree, removed = min(up, down) - 1, abs(up - down)
+    name = "%s cousin" % _ordinal(degree)
+    if removed:
+        name += {1: " once removed", 2: " twice removed"}.get(
+            removed, " %d times removed" % removed
+        )
+    return name
+
+
+def kinship(parent_edges, spouse_edges, person1_id, person2_id):
+    """How person2 is related to person1 by blood (or as a spouse)
+
+    Returns dict(relationship, up, down, common_ancestors) or None.
+    """
+    parents = {}
+    for parent_id, child_id in parent_edges:
+        parents.setdefault(child_id, []).append(parent_id)
+    from_1 = _ancestors(person1_id, parents)
+    from_2 = _ancestors(person2_id, parents)
+    common = set(from_1) & set(from_2)
+    if not common:
+        for a, b in spouse_edges:
+            if (a, b) in ((person1_id, person2_id), (person2_id, person1_id)):
+                return dict(relationship="spouse", up=0, down=0, common_ancestors=[])
+        return None
+    best = min(from_1[a] + from_2[a] for a in common)
+    nearest = sorted(a for a in common if from_1[a] + from_2[a] == best)
+    up, down = from_1[nearest[0]], from_2[nearest[0]]
+    return dict(
+        relationship=kinship_name(up, down), up=up, down=down, common_ancestors=nearest
+    )
+
+
+def resize_image(data, max_size, quality=85):
+    """JPEG bytes of the image scaled to fit max_size x max_size (Pillow)"""
+    if Image is None:
+        raise RuntimeError("resize_image needs Pillow")
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail((max_size, max_size))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+KERNELS = {
+    "generation_levels": generation_levels,
+    "tree_layout": tree_layout,
+    "kinship": kinship,
+    "resize_image": resize_image,
+}
+
+
+def run_kernel(name, args):
+    """Entry point of the pool workers"""
+    return KERNELS[name](*args)
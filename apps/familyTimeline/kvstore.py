@@ -0,0 +1,536 @@
+"""
+Local key-value server speaking the subset of the redis protocol we use
+
+The redis and memcache configurations need a running service. This module
+is a stand-in shared by all the py4web processes of one machine, so the
+multi-process setup can be run and benchmarked anywhere:
+
+    KV_URL = "unix://databases/kv.sock"   # in settings.py
+
+starts the server on first use (one per socket, shared by every process
+and surviving them), or start it by hand with
+
+    python apps/familyTimeline/kvstore.py unix://apps/familyTimeline/databases/kv.sock
+
+KVClient speaks RESP, so KV_URL = "redis://host:6379" points the same
+code at a real redis. Commands: PING GET SET (EX PX NX XX KEEPTTL) DEL
+EXISTS EXPIRE TTL INCR DBSIZE FLUSHDB PUBLISH SUBSCRIBE UNSUBSCRIBE.
+Keys live in memory only and expire lazily (and in a sweep every second).
+
+Only the standard library is used: the server runs as a script, without
+py4web or the app.
+"""
+
+import fcntl
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+__all__ = ["Broadcast", "KVClient", "KVError", "KVServer", "connect"]
+
+
+class KVError(Exception):
+    """An error reply of the server"""
+
+
+def parse_url(url, folder=None):
+    """("unix", path) or ("tcp", (host, port)) for unix://path, tcp:// or redis://"""
+    scheme, _, rest = url.partition("://")
+    if scheme == "unix":
+        return "unix", os.path.join(folder or os.getcwd(), rest)
+    if scheme in ("tcp", "redis"):
+        host, _, port = rest.rstrip("/").partition(":")
+        return "tcp", (host or "127.0.0.1", int(port or 6379))
+    raise ValueError("Unsupported KV url %s" % url)
+
+
+# #######################################################
+# protocol
+# #######################################################
+
+
+def encode_command(args):
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode("utf8")
+        elif isinstance(arg, int):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def encode_reply(value):
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, KVError):
+        return b"-ERR %s\r\n" % str(value).encode()
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, Status):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(encode_reply(item) for item in value)
+    if isinstance(value, str):
+        value = value.encode("utf8")
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def read_reply(stream):
+    """Read one RESP value; error replies are returned as KVError"""
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("KV connection closed")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return KVError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        size = int(rest)
+        if size < 0:
+            return None
+        data = stream.read(size + 2)
+        return data[:-2]
+    if kind == b"*":
+        size = int(rest)
+        return None if size < 0 else [read_reply(stream) for _ in range(size)]
+    # inline command (telnet, redis-cli --no-raw)
+    return line.split()
+
+
+class Status(str):
+    """A simple string reply (+OK)"""
+
+
+OK = Status("OK")
+
+
+# #######################################################
+# server
+# #######################################################
+
+
+class Store:
+    """The keys, their expiry times and the pub/sub subscriptions"""
+
+    def __init__(self):
+        self.data = {}  # key -> value
+        self.expires = {}  # key -> time.monotonic() deadline
+        self.channels = {}  # channel -> set of handlers
+        self.lock = threading.Lock()
+
+    def _alive(self, key, now):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= now:
+            del self.data[key], self.expires[key]
+        return key in self.data
+
+    def sweep(self):
+        now = time.monotonic()
+        with self.lock:
+            for key in [key for key, deadline in self.expires.items() if deadline <= now]:
+                del self.data[key], self.expires[key]
+
+    def execute(self, name, args):
+        handler = getattr(self, "cmd_" + name, None)
+        if handler is None:
+            return KVError("unknown command '%s'" % name)
+        try:
+            with self.lock:
+                return handler(time.monotonic(), *args)
+        except (TypeError, ValueError, IndexError):
+            return KVError("wrong arguments for '%s'" % name)
+
+    def cmd_ping(self, now, message=None):
+        return Status("PONG") if message is None else message
+
+    def cmd_get(self, now, key):
+        return self.data[key] if self._alive(key, now) else None
+
+    def cmd_set(self, now, key, value, *options):
+        options = [option.upper() for option in options]
+        ttl = None
+        for unit, scale in ((b"EX", 1.0), (b"PX", 0.001)):
+            if unit in options:
+                ttl = int(options[options.index(unit) + 1]) * scale
+        exists = self._alive(key, now)
+        if (b"NX" in options and exists) or (b"XX" in options and not exists):
+            return None
+        self.data[key] = value
+        if ttl is not None:
+            self.expires[key] = now + ttl
+        elif b"KEEPTTL" not in options:
+            self.expires.pop(key, None)
+        return OK
+
+    def cmd_del(self, now, *keys):
+        deleted = 0
+        for key in keys:
+            if self._alive(key, now):
+                del self.data[key]
+                self.expires.pop(key, None)
+                deleted += 1
+        return deleted
+
+    def cmd_exists(self, now, *keys):
+        return sum(1 for key in keys if self._alive(key, now))
+
+    def cmd_expire(self, now, key, seconds):
+        if not self._alive(key, now):
+            return 0
+        self.expires[key] = now + int(seconds)
+        return 1
+
+    def cmd_ttl(self, now, key):
+        if not self._alive(key, now):
+            return -2
+        deadline = self.expires.get(key)
+        return -1 if deadline is None else max(0, round(deadline - now))
+
+    def cmd_incr(self, now, key):
+        value = int(self.data[key]) + 1 if self._alive(key, now) else 1
+        self.data[key] = str(value).encode()
+        return value
+
+    def cmd_dbsize(self, now):
+        return sum(1 for key in list(self.data) if self._alive(key, now))
+
+    def cmd_flushdb(self, now):
+        self.data.clear()
+        self.expires.clear()
+        return OK
+
+    def subscribers(self, channel):
+        with self.lock:
+            return list(self.channels.get(channel, ()))
+
+
+class KVHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.write_lock = threading.Lock()
+        self.subscribed = set()
+
+    def push(self, value):
+        try:
+            with self.write_lock:
+                self.wfile.write(encode_reply(value))
+                self.wfile.flush()
+        except OSError:
+            pass  # the subscriber is gone, finish() unsubscribes it
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            try:
+                command = read_reply(self.rfile)
+            except (ConnectionError, OSError, ValueError):
+                return
+            if not isinstance(command, list) or not command:
+                continue
+            name = command[0].decode().lower()
+            if name in ("subscribe", "unsubscribe"):
+                self.subscription(name, command[1:])
+            elif name == "publish" and len(command) == 3:
+                # pushed outside the store lock, a slow subscriber only delays this client
+                handlers = store.subscribers(command[1])
+                for handler in handlers:
+                    handler.push([b"message", command[1], command[2]])
+                self.push(len(handlers))
+            elif name == "quit":
+                self.push(OK)
+                return
+            else:
+                self.push(store.execute(name, command[1:]))
+
+    def subscription(self, name, channels):
+        store = self.server.store
+        replies = []
+        with store.lock:
+            for channel in channels or list(self.subscribed):
+                handlers = store.channels.setdefault(channel, set())
+                if name == "subscribe":
+                    handlers.add(self)
+                    self.subscribed.add(channel)
+                else:
+                    handlers.discard(self)
+                    self.subscribed.discard(channel)
+                replies.append([name.encode(), channel, len(self.subscribed)])
+        for reply in replies:
+            self.push(reply)
+
+    def finish(self):
+        self.subscription("unsubscribe", [])
+        super().finish()
+
+
+class KVServer:
+    """Threaded server on a unix socket or a TCP port"""
+
+    def __init__(self, url, folder=None):
+        self.kind, self.address = parse_url(url, folder)
+        if self.kind == "unix":
+            # held while serving: of servers started at once only one binds
+            self.lock_file = open(self.address + ".lock", "w")
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.path.exists(self.address):
+                os.unlink(self.address)  # left over by a server that died
+            server_class = socketserver.ThreadingUnixStreamServer
+        else:
+            server_class = socketserver.ThreadingTCPServer
+            server_class.allow_reuse_address = True
+        server_class.daemon_threads = True
+        self.server = server_class(self.address, KVHandler)
+        self.server.store = Store()
+
+    def serve_forever(self):
+        def sweep():
+            while True:
+                time.sleep(1)
+                self.server.store.sweep()
+
+        threading.Thread(target=sweep, daemon=True).start()
+        try:
+            self.server.serve_forever()
+        finally:
+            if self.kind == "unix" and os.path.exists(self.address):
+                os.unlink(self.address)
+
+
+# #######################################################
+# client
+# #######################################################
+
+
+class Commands:
+    """The commands, on top of execute_command(*args, convert=None)"""
+
+    def ping(self):
+        return self.execute_command("PING")
+
+    def get(self, key):
+        return self.execute_command("GET", key)
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False, keepttl=False):
+        args = ["SET", key, value]
+        if ex is not None:
+            args += ["EX", int(ex)]
+        if px is not None:
+            args += ["PX", int(px)]
+        args += [flag for flag, on in (("NX", nx), ("XX", xx), ("KEEPTTL", keepttl)) if on]
+        return self.execute_command(*args, convert=lambda reply: reply == "OK")
+
+    def delete(self, *keys):
+        return self.execute_command("DEL", *keys)
+
+    def exists(self, *keys):
+        return self.execute_command("EXISTS", *keys)
+
+    def expire(self, key, seconds):
+        return self.execute_command("EXPIRE", key, int(seconds), convert=bool)
+
+    def ttl(self, key):
+        return self.execute_command("TTL", key)
+
+    def incr(self, key):
+        return self.execute_command("INCR", key)
+
+    def dbsize(self):
+        return self.execute_command("DBSIZE")
+
+    def flushdb(self):
+        return self.execute_command("FLUSHDB")
+
+    def publish(self, channel, message):
+        return self.execute_command("PUBLISH", channel, message)
+
+
+class Pipeline(Commands):
+    """Commands buffered and sent in one round trip by execute()"""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def execute_command(self, *args, convert=None):
+        self.commands.append((args, convert))
+        return self
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        replies = self.client.send([args for args, _ in commands])
+        return [
+            reply if convert is None or isinstance(reply, KVError) else convert(reply)
+            for reply, (_, convert) in zip(replies, commands)
+        ]
+
+
+class KVClient(Commands):
+    """Thread safe client, one connection per thread
+
+    Implements the part of the redis-py API the app uses, so it can be
+    passed where a redis.Redis connection is expected.
+    """
+
+    def __init__(self, url, folder=None, timeout=5):
+        self.kind, self.address = parse_url(url, folder)
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def _connect(self):
+        family = socket.AF_UNIX if self.kind == "unix" else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.address)
+        except OSError:
+            sock.close()
+            raise
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock, sock.makefile("rb")
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = self._connect()
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        self.local.connection = None
+        if connection:
+            connection[1].close()
+            connection[0].close()
+
+    def send(self, commands):
+        """Send commands in one write and return their replies"""
+        data = b"".join(encode_command(args) for args in commands)
+        for attempt in (1, 2):
+            sock, stream = self._connection()
+            try:
+                sock.sendall(data)
+                return [read_reply(stream) for _ in commands]
+            except (ConnectionError, OSError):
+                # the server restarted or dropped an idle connection
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def execute_command(self, *args, convert=None):
+        reply = self.send([args])[0]
+        if isinstance(reply, KVError):
+            raise reply
+        return reply if convert is None else convert(reply)
+
+    def pipeline(self, transaction=False):
+        return Pipeline(self)
+
+    def subscribe(self, channels, callback):
+        """Call callback(channel, message) for every message, in a thread
+
+        Reconnects (and subscribes again) when the connection drops.
+        """
+        channels = [channels] if isinstance(channels, (str, bytes)) else list(channels)
+
+        def listen():
+            while True:
+                try:
+                    sock, stream = self._connect()
+                    sock.settimeout(None)
+                    sock.sendall(encode_command(["SUBSCRIBE"] + channels))
+                    while True:
+                        reply = read_reply(stream)
+                        if isinstance(reply, list) and reply[0] == b"message":
+                            try:
+                                callback(reply[1].decode("utf8"), reply[2])
+                            except Exception:
+                                pass  # a bad message must not stop the listener
+                except (ConnectionError, OSError):
+                    time.sleep(1)
+
+        thread = threading.Thread(target=listen, name="kv-subscriber", daemon=True)
+        thread.start()
+        return thread
+
+
+class Broadcast:
+    """Tell the other processes to drop an entry of their in-memory caches
+
+        broadcast.on("session", store.discard)   # in every process
+        broadcast.send("session", key)           # after changing it
+
+    Messages from this process are not delivered back to it.
+    """
+
+    def __init__(self, client, channel):
+        self.client = client
+        self.channel = channel
+        self.origin = "%s-%d" % (socket.gethostname(), os.getpid())
+        self.handlers = {}
+        self.listener = None
+
+    def on(self, kind, handler):
+        self.handlers[kind] = handler
+        if self.listener is None:
+            self.listener = self.client.subscribe(self.channel, self._receive)
+
+    def send(self, kind, key=""):
+        try:
+            self.client.publish(self.channel, "%s %s %s" % (self.origin, kind, key))
+        except OSError:
+            pass  # the other processes fall back on their cache TTL
+
+    def _receive(self, channel, message):
+        origin, kind, key = message.decode("utf8").split(" ", 2)
+        handler = self.handlers.get(kind)
+        if handler and origin != self.origin:
+            handler(key)
+
+
+def connect(url, folder=None, autostart=True, timeout=5):
+    """A KVClient for url, starting a local server for unix:// urls if none runs"""
+    client = KVClient(url, folder, timeout)
+    try:
+        client.ping()
+    except OSError:
+        if not autostart or client.kind != "unix":
+            raise
+        # detached, so it outlives the process that happened to start it;
+        # if several processes race, one binds and the others connect to it
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), url, folder or os.getcwd()],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                client.ping()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+    return client
+
+
+if __name__ == "__main__":
+    url = sys.argv[1] if len(sys.argv) > 1 else "tcp://127.0.0.1:6390"
+    folder = sys.argv[2] if len(sys.argv) > 2 else None
+    try:
+        server = KVServer(url, folder)
+    except BlockingIOError:
+        sys.exit("a server is already running for %s" % url)
+    server.serve_forever()
@@ -0,0 +1,137 @@
+"""
+Structured, sampled logging on top of common.logger
+
+Usage in a module:
+
+    from .logs import get_logger, log_event
+    log = get_logger("controllers")
+    log_event(log, logging.DEBUG, "person.create", family_id=1, payload=data)
+
+- Every module gets a child of the app logger whose level comes from
+  settings.LOG_LEVELS, so a disabled level costs one isEnabledFor() call.
+- Field values are truncated to settings.LOG_PAYLOAD_LIMIT characters, and
+  only when the record is actually formatted (base64 photos never are).
+- Below WARNING only settings.LOG_SAMPLE_RATE of the requests are logged,
+  the decision is taken once per request so its records stay together.
+- With settings.LOG_ASYNC the handlers run in a background thread behind a
+  queue, so request threads never block on stdout or log files.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+
+from py4web import request
+
+from . import settings
+
+APP_LOGGER_NAME = "py4web:" + settings.APP_NAME
+SAMPLED_KEY = "familyTimeline.log_sampled"
+
+
+def truncate(value, limit=None):
+    """Return a short printable version of value for logging"""
+    limit = limit or settings.LOG_PAYLOAD_LIMIT
+    if isinstance(value, dict):
+        return "{%s}" % ", ".join(
+            "%s: %s" % (key, truncate(item, limit)) for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return "[%s]" % ", ".join(truncate(item, limit) for item in value[:10]) + (
+            " ...+%d" % (len(value) - 10) if len(value) > 10 else ""
+        )
+    if isinstance(value, (bytes, bytearray)):
+        return "<%d bytes>" % len(value)
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) > limit:
+        return "%s...<%d chars>" % (text[:limit], len(text))
+    return text
+
+
+class Fields:
+    """key=value rendering of event fields, computed only when formatted"""
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        return " ".join(
+            "%s=%s" % (key, truncate(value)) for key, value in self.fields.items()
+        )
+
+
+def log_event(log, level, event, **fields):
+    """Log an event name with key=value fields if the level is enabled"""
+    if log.isEnabledFor(level):
+        log.log(
+            level, "%s %s", event, Fields(fields), extra={"fields": fields}, stacklevel=2
+        )
+
+
+def get_logger(module):
+    """Get the app logger for a module, honouring settings.LOG_LEVELS"""
+    app_logger = logging.getLogger(APP_LOGGER_NAME)
+    log = logging.getLogger("%s.%s" % (APP_LOGGER_NAME, module))
+    level = settings.LOG_LEVELS.get(module)
+    if level:
+        # never below what the app handlers accept, or records would be
+        # built just to be dropped
+        log.setLevel(max(logging.getLevelName(level.upper()), app_logger.level))
+    return log
+
+
+class RequestSampler(logging.Filter):
+    """Keep records below WARNING for a sample of the requests only"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        try:
+            environ = request.environ
+        except (AttributeError, RuntimeError):
+            return True  # not in a request (startup, scheduler, CLI)
+        if environ is None:
+            return True
+        if SAMPLED_KEY not in environ:
+            environ[SAMPLED_KEY] = random.random() < self.rate
+        return environ[SAMPLED_KEY]
+
+
+def setup_logging(app_logger):
+    """Add request sampling and (optionally) a queue in front of the handlers
+
+    Safe to call again on app reload: make_logger has already replaced the
+    handlers and the previous queue listener is stopped (and dropped from
+    atexit) here.
+    """
+    listener = getattr(app_logger, "queue_listener", None)
+    if listener:
+        atexit.unregister(listener.stop)
+        listener.stop()
+        app_logger.queue_listener = None
+
+    sampler = RequestSampler(settings.LOG_SAMPLE_RATE)
+    handlers = list(app_logger.handlers)
+    if settings.LOG_ASYNC and handlers:
+        log_queue = queue.SimpleQueue()
+        for handler in handlers:
+            app_logger.removeHandler(handler)
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(sampler)
+        app_logger.addHandler(queue_handler)
+        listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        listener.start()
+        atexit.register(listener.stop)
+        app_logger.queue_listener = listener
+    else:
+        for handler in handlers:
+            handler.addFilter(sampler)
+    return app_logger
@@ -0,0 +1,284 @@
+"""
+Low-overhead Prometheus-style metrics for the familyTimeline app
+
+    from .metrics import registry
+    PHOTOS = registry.counter("photo_bytes_served_total", "Photo bytes sent", ["kind"])
+    PHOTOS.inc(len(data), kind="story")
+
+Counters and histograms are plain dicts behind a lock, updated in O(1)
+per call. Gauges are callbacks evaluated only when /metrics is scraped,
+and collectors (functions yielding complete metric families) let other
+modules, such as the request profiler, expose what they already track.
+registry.exposition() renders the text format version 0.0.4.
+"""
+
+import bisect
+import threading
+import time
+
+from pydal.connection import ConnectionPool
+
+from py4web.core import DAL
+
+from .profiler import LATENCY_BUCKETS_MS
+
+PREFIX = "familytimeline_"
+
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def header(self):
+        return [
+            "# HELP %s %s" % (self.name, self.documentation),
+            "# TYPE %s %s" % (self.name, self.kind),
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.key(labels), 0)
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + [
+            "%s%s %s" % (self.name, format_labels(self.labels, key), value)
+            for key, value in items
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=None):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets or (b / 1000 for b in LATENCY_BUCKETS_MS))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            data = self.values.get(key)
+            if data is None:
+                data = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            data[0][index] += 1
+            data[1] += value
+
+    def render(self):
+        with self.lock:
+            items = sorted((key, (list(c), s)) for key, (c, s) in self.values.items())
+        lines = self.header()
+        for key, (counts, total) in items:
+            lines.extend(
+                render_histogram(self.name, self.labels, key, self.buckets, counts, total)
+            )
+        return lines
+
+
+def render_histogram(name, label_names, label_values, buckets, counts, total):
+    """Sample lines of one histogram series from non-cumulative bucket counts"""
+    lines, cumulative = [], 0
+    for bound, count in zip(list(buckets) + ["+Inf"], counts):
+        cumulative += count
+        labels = format_labels(label_names, label_values, {"le": bound})
+        lines.append("%s_bucket%s %s" % (name, labels, cumulative))
+    labels = format_labels(label_names, label_values)
+    lines.append("%s_sum%s %s" % (name, labels, total))
+    lines.append("%s_count%s %s" % (name, labels, cumulative))
+    return lines
+
+
+class Gauge(Metric):
+    """A gauge read from a callback at scrape time
+
+    The callback returns a number, or a dict {label values tuple: number}.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback, labels=()):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def render(self):
+        value = self.callback()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return self.header() + [
+            "%s%s %s" % (self.name, format_labels(self.labels, key), number)
+            for key, number in sorted(value.items())
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+
+    def _add(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=None):
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, callback, labels=()):
+        return self._add(Gauge(name, documentation, callback, labels))
+
+    def collector(self, func):
+        """Register func() -> list of exposition lines, used as a decorator"""
+        self.collectors.append(func)
+        return func
+
+    def exposition(self):
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as error:
+                lines.append("# %s failed: %s" % (metric.name, error))
+        for collector in self.collectors:
+            try:
+                lines.extend(collector())
+            except Exception as error:
+                lines.append("# collector %s failed: %s" % (collector.__name__, error))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CACHE_REQUESTS = registry.counter(
+    "cache_requests_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+PHOTO_BYTES = registry.counter(
+    "photo_bytes_served_total", "Photo bytes sent to clients", ["kind"]
+)
+DB_CONNECT_SECONDS = registry.histogram(
+    "db_connection_acquire_seconds", "Time to get a connection from the pool"
+)
+DB_COMMIT_SECONDS = registry.histogram(
+    "db_commit_seconds", "Time to commit and recycle a connection (includes lock waits)"
+)
+DB_LOCKED = registry.counter(
+    "db_locked_errors_total", "Requests failed with a 'database is locked' error"
+)
+
+
+def route_latency_collector(profiler):
+    """Expose the profiler's per-route latency histograms
+
+    The route label is the route rule the profiler keys its stats by (see
+    profiler.route_key), never a raw path; routes beyond its MAX_ROUTES
+    are reported as "other" with an empty method.
+    """
+    name = PREFIX + "request_duration_seconds"
+    buckets = [b / 1000 for b in LATENCY_BUCKETS_MS]
+
+    def collect():
+        lines = [
+            "# HELP %s Request latency by route" % name,
+            "# TYPE %s histogram" % name,
+        ]
+        with profiler.lock:
+            routes = [
+                (route, list(stats.buckets), stats.total_time, stats.errors)
+                for route, stats in profiler.routes.items()
+            ]
+        errors = PREFIX + "request_errors_total"
+        error_lines = [
+            "# HELP %s Requests failed with an exception or a 5xx status" % errors,
+            "# TYPE %s counter" % errors,
+        ]
+        for route, counts, total, failed in sorted(routes):
+            method, _, path = route.rpartition(" ")
+            labels = ("method", "route")
+            lines.extend(render_histogram(name, labels, (method, path), buckets, counts, total))
+            error_lines.append(
+                "%s%s %s" % (errors, format_labels(labels, (method, path)), failed)
+            )
+        return lines + error_lines
+
+    return collect
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+class MeteredDAL(DAL):
+    """py4web DAL fixture timing pool checkout and commit (lock waits)
+
+    Functions in after_commit run once a transaction ended, committed or
+    rolled back, for cache invalidations that must not run before the
+    change is visible to other connections.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.after_commit = []
+
+    def _run_after_commit(self):
+        for callback in self.after_commit:
+            callback()
+
+    def commit(self):
+        super().commit()
+        self._run_after_commit()
+
+    def rollback(self):
+        super().rollback()
+        self._run_after_commit()
+
+    def on_request(self, context):
+        t0 = time.perf_counter()
+        super().on_request(context)
+        DB_CONNECT_SECONDS.observe(time.perf_counter() - t0)
+
+    def on_error(self, context):
+        if "locked" in str(context.get("exception") or ""):
+            DB_LOCKED.inc()
+        super().on_error(context)
+        self._run_after_commit()
+
+    def on_success(self, context):
+        t0 = time.perf_counter()
+        super().on_success(context)
+        DB_COMMIT_SECONDS.observe(time.perf_counter() - t0)
+        self._run_after_commit()
+
+    def pool_stats(self):
+        """Idle connections in the pool and the configured pool size"""
+        return {
+            "idle": len(ConnectionPool.POOLS.get(self._adapter.uri, [])),
+            "size": self._adapter.pool_size,
+        }
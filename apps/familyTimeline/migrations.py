@@ -0,0 +1,136 @@
+"""
+One-time schema and seed steps for the family tree database.
+
+Importing models.py only defines tables. Everything that changes the
+database beyond that (indexes, seed data) is a numbered step below and is
+recorded in the schema_version table, so it runs once per database.
+
+Run pending steps on deploy with:
+
+    py4web call apps familyTimeline.migrations.migrate
+
+With settings.AUTO_MIGRATE the app also applies them at import, which
+costs a single read of schema_version once the database is up to date.
+"""
+
+from .common import db, logger, settings
+from .models import populate_default_questions
+
+
+def create_family_members_index():
+    # Ensure unique user-family combinations
+    db.executesql(
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_family_members_unique "
+        "ON family_members (user_id, family_id)"
+    )
+
+
+def create_stories_timeline_index():
+    # Timeline range queries scan stories by family ordered by year
+    db.executesql(
+        "CREATE INDEX IF NOT EXISTS idx_stories_family_year "
+        "ON stories (family_id, year_occurred)"
+    )
+
+
+def create_person_reference_indexes():
+    # Person lookups and cascading deletes filter on these references
+    db.executesql(
+        "CREATE INDEX IF NOT EXISTS idx_relationships_person1 "
+        "ON relationships (person1_id)"
+    )
+    db.executesql(
+        "CREATE INDEX IF NOT EXISTS idx_relationships_person2 "
+        "ON relationships (person2_id)"
+    )
+    db.executesql(
+        "CREATE INDEX IF NOT EXISTS idx_stories_person "
+        "ON stories (person_id)"
+    )
+
+
+def create_soft_delete_indexes():
+    # Compaction looks for tombstones by deletion time
+    for table in ("people", "relationships", "stories"):
+        db.executesql(
+            "CREATE INDEX IF NOT EXISTS idx_%s_deleted_at ON %s (deleted_at)"
+            % (table, table)
+        )
+
+
+def create_jobs_index():
+    # Per-family concurrency checks count the running jobs of a family
+    db.executesql(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_family_status "
+        "ON jobs (family_id, status)"
+    )
+
+
+def create_invitation_indexes():
+    # Bulk invites look for pending invitations by family and email, the
+    # sweeper for old ones by expiry and use (tokens have a unique index)
+    db.executesql(
+        "CREATE INDEX IF NOT EXISTS idx_family_invitations_family_email "
+        "ON family_invitations (family_id, email)"
+    )
+    for column in ("expires_at", "used_at"):
+        db.executesql(
+            "CREATE INDEX IF NOT EXISTS idx_family_invitations_%s "
+            "ON family_invitations (%s)" % (column, column)
+        )
+
+
+def create_session_indexes():
+    # Superseded: the table only exists with SESSION_TYPE = "database", so
+    # DBSessionStore.create_indexes runs on startup instead. Kept so that
+    # the version numbers stay append only.
+    pass
+
+
+# (version, description, step) - append only, never renumber.
+# Steps must be idempotent: databases created before schema_version existed
+# start at version 0 and replay all of them.
+MIGRATIONS = [
+    (1, "unique index on family_members (user_id, family_id)", create_family_members_index),
+    (2, "index on stories (family_id, year_occurred)", create_stories_timeline_index),
+    (3, "seed default theme questions", populate_default_questions),
+    (4, "indexes on the person references of relationships and stories", create_person_reference_indexes),
+    (5, "indexes on deleted_at of people, relationships and stories", create_soft_delete_indexes),
+    (6, "index on jobs (family_id, status)", create_jobs_index),
+    (7, "indexes on family_invitations for bulk invites and the sweeper", create_invitation_indexes),
+    (8, "indexes on py4web_session (rkey) and (expires_on)", create_session_indexes),
+]
+
+
+def get_schema_version():
+    """Return the last applied migration version (0 for a new database)"""
+    row = db(db.schema_version).select(
+        db.schema_version.version,
+        orderby=~db.schema_version.version,
+        limitby=(0, 1),
+    ).first()
+    return row.version if row else 0
+
+
+def migrate():
+    """Apply all pending migrations in order and return their versions"""
+    current = get_schema_version()
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            step()
+            db.schema_version.insert(version=version, description=description)
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("migration %s (%s) failed", version, description)
+            raise
+        logger.info("applied migration %s: %s", version, description)
+        applied.append(version)
+    return applied
+
+
+if settings.AUTO_MIGRATE:
+    migrate()
@@ -3,14 +3,23 @@ Family Tree Database Models - Updated for Authentication System
 """
 import os
 import uuid
+import hashlib
 from py4web import action, request, abort, redirect, URL
 from py4web.utils.form import Form, FormStyleBulma
 from pydal import DAL, Field
 from datetime import datetime, timedelta
 import json
+import logging
+import threading
+import time
 
 # Import db from common
-from .common import db
+from .common import db, settings, compute_pool, kv, broadcast
+from .compute import ComputeBusy
+from .logs import get_logger, log_event
+from .metrics import cache_lookup
+
+log = get_logger("models")
 
 # Families table - now with owner tracking
 db.define_table(
@@ -36,9 +45,6 @@ db.define_table(
     format='%(user_id)s in %(family_id)s as %(role)s'
 )
 
-# Ensure unique user-family combinations
-db.executesql('CREATE UNIQUE INDEX IF NOT EXISTS idx_family_members_unique ON family_members (user_id, family_id)')
-
 # NEW: Family Invitations table - tracks pending invitations
 db.define_table(
     'family_invitations',
@@ -81,7 +87,11 @@ db.define_table(
     Field('updated_at', 'datetime', default=datetime.utcnow, update=datetime.utcnow),
     Field('grid_row', 'integer'),
     Field('grid_col', 'integer'),
-    format='%(first_name)s %(last_name)s'
+    # Soft delete, see delete_people() and compaction.py
+    Field('deleted_at', 'datetime'),
+    Field('deletion_id', 'string', length=32),
+    format='%(first_name)s %(last_name)s',
+    common_filter=lambda query: db.people.deleted_at == None
 )
 
 # Relationships table - enhanced with user tracking
@@ -97,7 +107,11 @@ db.define_table(
     # NEW: User tracking
     Field('created_by_user_id', 'reference auth_user'),
     Field('created_at', 'datetime', default=datetime.utcnow),
-    format='%(person1_id)s -> %(person2_id)s (%(relationship_type)s)'
+    # Soft delete, see delete_people() and compaction.py
+    Field('deleted_at', 'datetime'),
+    Field('deletion_id', 'string', length=32),
+    format='%(person1_id)s -> %(person2_id)s (%(relationship_type)s)',
+    common_filter=lambda query: db.relationships.deleted_at == None
 )
 
 # Stories table - enhanced with user tracking
@@ -121,7 +135,11 @@ db.define_table(
     Field('can_be_edited_by_others', 'boolean', default=True),
     Field('created_at', 'datetime', default=datetime.utcnow),
     Field('updated_at', 'datetime', default=datetime.utcnow, update=datetime.utcnow),
-    format='%(title)s (%(person_id)s)'
+    # Soft delete, see delete_people() and compaction.py
+    Field('deleted_at', 'datetime'),
+    Field('deletion_id', 'string', length=32),
+    format='%(title)s (%(person_id)s)',
+    common_filter=lambda query: db.stories.deleted_at == None
 )
 
 # Theme questions table (unchanged)
@@ -134,6 +152,105 @@ db.define_table(
     format='%(question_text)s'
 )
 
+# Theme catalogue cache, see get_theme_catalogue(). The hooks only reach
+# this process: without a broadcast (below) the others rebuild theirs
+# after settings.THEME_CATALOGUE_TTL seconds
+_theme_catalogue = {}
+
+def _invalidate_theme_catalogue(*args):
+    _theme_catalogue.pop('current', None)
+
+db.theme_questions._after_insert.append(_invalidate_theme_catalogue)
+db.theme_questions._after_update.append(_invalidate_theme_catalogue)
+db.theme_questions._after_delete.append(_invalidate_theme_catalogue)
+
+# With a KV store the processes share two more things, both invalidated
+# once the change is committed (before, another process could cache the
+# old rows again):
+# - the theme catalogue: the other processes are told to drop theirs
+# - the tree cache, see get_family_tree_data(): the api/tree data of a
+#   family is kept in the KV store under a per-family version, bumped when
+#   its people or relationships change
+_pending_invalidations = threading.local()
+
+def _tree_cache_keys(family_id):
+    prefix = '%s:tree:%s' % (settings.APP_NAME, family_id)
+    return prefix + ':version', prefix + ':data:'
+
+def _mark_trees_changed(family_ids):
+    pending = getattr(_pending_invalidations, 'trees', None)
+    if pending is None:
+        pending = _pending_invalidations.trees = set()
+    pending.update(family_id for family_id in family_ids if family_id)
+
+def _mark_theme_catalogue_changed(*args):
+    _pending_invalidations.theme_catalogue = True
+
+def _send_invalidations():
+    family_ids = getattr(_pending_invalidations, 'trees', None)
+    if getattr(_pending_invalidations, 'theme_catalogue', False):
+        _pending_invalidations.theme_catalogue = False
+        broadcast.send('theme_catalogue')
+    if not family_ids:
+        return
+    _pending_invalidations.trees = None
+    pipe = kv.pipeline()
+    for family_id in family_ids:
+        pipe.incr(_tree_cache_keys(family_id)[0])
+    try:
+        pipe.execute()
+    except OSError:
+        log.warning("could not invalidate the tree cache of families %s", family_ids)
+
+def _track_tree_changes(table):
+    def before_write(dbset, fields=None):
+        family_ids = [row.family_id for row in dbset.select(table.family_id, distinct=True)]
+        _mark_trees_changed(family_ids + [(fields or {}).get('family_id')])
+    table._after_insert.append(lambda fields, id: _mark_trees_changed([fields.get('family_id')]))
+    table._before_update.append(before_write)
+    table._before_delete.append(before_write)
+
+if kv:
+    db.theme_questions._after_insert.append(_mark_theme_catalogue_changed)
+    db.theme_questions._after_update.append(_mark_theme_catalogue_changed)
+    db.theme_questions._after_delete.append(_mark_theme_catalogue_changed)
+    broadcast.on('theme_catalogue', _invalidate_theme_catalogue)
+    _track_tree_changes(db.people)
+    _track_tree_changes(db.relationships)
+    db.after_commit.append(_send_invalidations)
+
+# Schema version - one row per applied step of migrations.py
+db.define_table(
+    'schema_version',
+    Field('version', 'integer', required=True),
+    Field('description', 'string', length=200),
+    Field('applied_at', 'datetime', default=datetime.utcnow),
+)
+
+# Background jobs - one row per submitted job, see jobs.py
+db.define_table(
+    'jobs',
+    Field('name', 'string', length=64, required=True),
+    Field('family_id', 'reference families'),
+    Field('user_id', 'reference auth_user'),
+    Field('inputs', 'json'),
+    Field('priority', 'integer', default=0),
+    Field('status', 'string', length=20, default='queued'),  # queued, running, retrying, completed, failed
+    Field('attempts', 'integer', default=0),
+    Field('max_attempts', 'integer', default=1),
+    Field('progress', 'double', default=0),
+    Field('message', 'string', length=255),
+    Field('result', 'json'),
+    Field('error', 'text'),
+    Field('task_run_id', 'integer'),
+    Field('owner', 'string', length=128),  # host:pid:boot of the running process
+    Field('heartbeat_at', 'datetime'),
+    Field('scheduled_for', 'datetime'),  # when a waiting or retrying job is due
+    Field('created_at', 'datetime', default=datetime.utcnow),
+    Field('started_at', 'datetime'),
+    Field('completed_at', 'datetime'),
+)
+
 # Tree settings - enhanced for dual roots
 db.define_table(
     'tree_settings',
@@ -190,6 +307,22 @@ def get_user_display_name(user_id):
     if not user:
         return "Unknown User"
     
+    return _format_user_display_name(user)
+
+def get_user_display_names(user_ids):
+    """Get display names for many users with a single query"""
+    user_ids = set(uid for uid in user_ids if uid)
+    if not user_ids:
+        return {}
+    users = db(db.auth_user.id.belongs(user_ids)).select(
+        db.auth_user.id,
+        db.auth_user.first_name,
+        db.auth_user.last_name,
+        db.auth_user.email
+    )
+    return {user.id: _format_user_display_name(user) for user in users}
+
+def _format_user_display_name(user):
     if user.first_name and user.last_name:
         return f"{user.first_name} {user.last_name}"
     elif user.first_name:
@@ -240,6 +373,14 @@ def get_user_family_trees(user_id):
     
     return family_trees
 
+# Permission hierarchy
+ROLE_PERMISSIONS = {
+    'owner': ['view', 'edit', 'manage', 'invite', 'admin'],
+    'member': ['view', 'edit', 'invite'],
+    'editor': ['view', 'edit'],
+    'viewer': ['view']
+}
+
 def check_user_permission(user_id, family_id, required_permission):
     """Check if user has required permission for family tree"""
     # Get user's role in this family
@@ -252,47 +393,68 @@ def check_user_permission(user_id, family_id, required_permission):
     if not member:
         return False
     
-    # Permission hierarchy
-    permissions = {
-        'owner': ['view', 'edit', 'manage', 'invite', 'admin'],
-        'member': ['view', 'edit', 'invite'],
-        'editor': ['view', 'edit'],
-        'viewer': ['view']
-    }
-    
-    user_permissions = permissions.get(member.role, [])
+    user_permissions = ROLE_PERMISSIONS.get(member.role, [])
     return required_permission in user_permissions
 
-def create_family_invitation(family_id, email, role, invited_by_user_id):
-    """Create a family invitation"""
-    # Generate unique token
-    invitation_token = str(uuid.uuid4())
-    
-    # Set expiration to 7 days from now
-    expires_at = datetime.utcnow() + timedelta(days=7)
+def get_permitted_family_ids(user_id, family_ids, required_permission):
+    """Get the subset of family_ids where user has the permission, in one query"""
+    members = db(
+        (db.family_members.user_id == user_id) &
+        (db.family_members.family_id.belongs(set(family_ids))) &
+        (db.family_members.is_active == True)
+    ).select(db.family_members.family_id, db.family_members.role)
     
-    invitation_id = db.family_invitations.insert(
-        family_id=family_id,
-        email=email,
-        role=role,
-        invited_by=invited_by_user_id,
-        invitation_token=invitation_token,
-        expires_at=expires_at
+    return set(
+        member.family_id for member in members
+        if required_permission in ROLE_PERMISSIONS.get(member.role, [])
     )
-    
+
+def create_family_invitation(family_id, email, role, invited_by_user_id):
+    """Create a family invitation"""
+    return create_family_invitations(family_id, [(email, role)], invited_by_user_id)[0]
+
+def create_family_invitations(family_id, invitations, invited_by_user_id):
+    """Create many invitations in one transaction
+
+    invitations is a list of (email, role); returns their tokens in the
+    same order. Callers validate emails and roles.
+    """
+    expires_at = datetime.utcnow() + timedelta(days=settings.INVITATION_EXPIRY_DAYS)
+    tokens = [str(uuid.uuid4()) for _ in invitations]
+    db.family_invitations.bulk_insert([
+        dict(
+            family_id=family_id,
+            email=email,
+            role=role,
+            invited_by=invited_by_user_id,
+            invitation_token=token,
+            expires_at=expires_at
+        )
+        for (email, role), token in zip(invitations, tokens)
+    ])
     db.commit()
-    return invitation_token
+    return tokens
+
+def get_pending_invitation_emails(family_id, emails):
+    """The emails among emails with an unused, unexpired invitation to family_id"""
+    rows = db(
+        (db.family_invitations.family_id == family_id) &
+        db.family_invitations.email.belongs(emails) &
+        (db.family_invitations.used_at == None) &
+        (db.family_invitations.expires_at > datetime.utcnow())
+    ).select(db.family_invitations.email, distinct=True)
+    return set(row.email for row in rows)
 
 def process_family_invitation(invitation_token, user_id):
     """Process a family invitation when user accepts"""
-    # Find valid invitation
+    # Find the invitation by its unique token only (an index lookup),
+    # whether it can still be used is checked on the row
     invitation = db(
-        (db.family_invitations.invitation_token == invitation_token) &
-        (db.family_invitations.used_at == None) &
-        (db.family_invitations.expires_at > datetime.utcnow())
-    ).select().first()
+        db.family_invitations.invitation_token == invitation_token
+    ).select(limitby=(0, 1)).first()
     
-    if not invitation:
+    now = datetime.utcnow()
+    if not invitation or invitation.used_at or invitation.expires_at <= now:
         return False, "Invalid or expired invitation"
     
     # Check if user is already a member
@@ -300,26 +462,30 @@ def process_family_invitation(invitation_token, user_id):
         (db.family_members.user_id == user_id) &
         (db.family_members.family_id == invitation.family_id) &
         (db.family_members.is_active == True)
-    ).select().first()
+    ).select(db.family_members.id, limitby=(0, 1)).first()
     
     if existing_member:
         return False, "You are already a member of this family tree"
     
+    # Mark invitation as used, only one request can claim it
+    claimed = db(
+        (db.family_invitations.id == invitation.id) &
+        (db.family_invitations.used_at == None)
+    ).update(used_at=now)
+    if not claimed:
+        db.rollback()
+        return False, "Invalid or expired invitation"
+    
     # Add user to family
     db.family_members.insert(
         user_id=user_id,
         family_id=invitation.family_id,
         role=invitation.role,
         invited_by=invitation.invited_by,
-        joined_at=datetime.utcnow(),
+        joined_at=now,
         invited_at=invitation.created_at
     )
     
-    # Mark invitation as used
-    db(db.family_invitations.id == invitation.id).update(
-        used_at=datetime.utcnow()
-    )
-    
     db.commit()
     
     # Get family info
@@ -329,7 +495,31 @@ def process_family_invitation(invitation_token, user_id):
 # Updated helper functions to work with new schema
 
 def get_family_tree_data(family_id):
-    """Get all people and relationships for a family tree"""
+    """Get all people and relationships for a family tree
+
+    With a KV store the result is cached for settings.TREE_CACHE_TTL
+    seconds, until the family changes.
+    """
+    if kv:
+        version_key, data_key = _tree_cache_keys(family_id)
+        try:
+            data_key += (kv.get(version_key) or b'0').decode()
+            cached = kv.get(data_key)
+        except OSError:
+            log.warning("tree cache unavailable", exc_info=True)
+            return _load_family_tree_data(family_id)
+        cache_lookup('tree', cached is not None)
+        if cached is not None:
+            return json.loads(cached)
+        tree_data = _load_family_tree_data(family_id)
+        try:
+            kv.set(data_key, json.dumps(tree_data), ex=settings.TREE_CACHE_TTL)
+        except OSError:
+            pass
+        return tree_data
+    return _load_family_tree_data(family_id)
+
+def _load_family_tree_data(family_id):
     people = db(db.people.family_id == family_id).select()
     relationships = db(db.relationships.family_id == family_id).select()
     
@@ -380,8 +570,6 @@ def get_family_tree_data(family_id):
 def add_person(family_id, first_name, last_name=None, created_by_user_id=None, **kwargs):
     """Add a new person to the family tree"""
     try:
-        print(f"DEBUG: add_person called with family_id={family_id}, first_name={first_name}")
-        
         person_data = {
             'family_id': family_id,
             'first_name': first_name,
@@ -393,16 +581,16 @@ def add_person(family_id, first_name, last_name=None, created_by_user_id=None, *
         # Add all additional kwargs
         person_data.update(kwargs)
         
-        print(f"DEBUG: Inserting person with data: {person_data}")
+        log_event(log, logging.DEBUG, "person.insert", data=person_data)
         
         person_id = db.people.insert(**person_data)
         db.commit()
         
-        print(f"DEBUG: Person created successfully with ID: {person_id}")
+        log_event(log, logging.DEBUG, "person.created", person_id=person_id, family_id=family_id)
         return person_id
         
     except Exception as e:
-        print(f"ERROR in add_person: {e}")
+        log.exception("add_person failed for family %s", family_id)
         db.rollback()
         raise e
 
@@ -469,23 +657,37 @@ def add_relationship(family_id, person1_id, person2_id, relationship_type, creat
 
 def get_person_stories(person_id):
     """Get all stories for a specific person"""
-    stories = db(db.stories.person_id == person_id).select(
+    return get_people_stories([person_id]).get(person_id, [])
+
+def get_people_stories(person_ids):
+    """Get all stories for many people, grouped by person id
+
+    Runs one query for the stories and one for the author names and
+    only measures photo blobs (LENGTH) instead of loading them.
+    """
+    photo_size = db.stories.photo_data.len()
+    rows = db(db.stories.person_id.belongs(set(person_ids))).select(
+        *[db.stories[name] for name in db.stories.fields if name != 'photo_data'],
+        photo_size,
         orderby=~db.stories.is_featured | db.stories.created_at
     )
     
-    stories_data = []
-    for story in stories:
+    author_names = get_user_display_names(row.stories.author_user_id for row in rows)
+    
+    stories_by_person = {}
+    for row in rows:
+        story = row.stories
         story_data = {
             'id': story.id,
             'title': story.title,
             'author_name': story.author_name,
-            'author_user_name': get_user_display_name(story.author_user_id) if story.author_user_id else story.author_name,
+            'author_user_name': author_names.get(story.author_user_id, "Unknown User") if story.author_user_id else story.author_name,
             'theme': story.theme,
             'time_period': story.time_period,
             'year_occurred': story.year_occurred,
             'questions_and_answers': story.questions_and_answers or [],
             'story_text': story.story_text,
-            'has_photo': bool(story.photo_data),
+            'has_photo': bool(row[photo_size]),
             'is_featured': story.is_featured,
             'created_at': story.created_at.isoformat(),
             'can_edit': story.can_be_edited_by_others,
@@ -494,13 +696,478 @@ def get_person_stories(person_id):
         }
         
         # Add photo URL if photo exists
-        if story.photo_data:
+        if row[photo_size]:
             story_data['photo_url'] = f"/familyTimeline/api/story-photo/{story.id}"
             story_data['photo_filename'] = story.photo_filename
         
-        stories_data.append(story_data)
+        stories_by_person.setdefault(story.person_id, []).append(story_data)
+    
+    return stories_by_person
+
+def get_people_story_counts(person_ids):
+    """Count stories for many people with a single grouped query"""
+    story_count = db.stories.id.count()
+    rows = db(db.stories.person_id.belongs(set(person_ids))).select(
+        db.stories.person_id,
+        story_count,
+        groupby=db.stories.person_id
+    )
+    return {row.stories.person_id: row[story_count] for row in rows}
+
+def get_people_relationships(person_ids):
+    """Get the relationships involving many people, grouped by person id"""
+    person_ids = set(person_ids)
+    relationships = db(
+        db.relationships.person1_id.belongs(person_ids) |
+        db.relationships.person2_id.belongs(person_ids)
+    ).select()
+    
+    relationships_by_person = {}
+    for rel in relationships:
+        rel_data = {
+            'id': rel.id,
+            'person1_id': rel.person1_id,
+            'person2_id': rel.person2_id,
+            'relationship_type': rel.relationship_type,
+            'marriage_date': rel.marriage_date.isoformat() if rel.marriage_date else None,
+            'divorce_date': rel.divorce_date.isoformat() if rel.divorce_date else None,
+            'is_active': rel.is_active
+        }
+        for person_id in set((rel.person1_id, rel.person2_id)) & person_ids:
+            relationships_by_person.setdefault(person_id, []).append(rel_data)
+    
+    return relationships_by_person
+
+def serialize_person(person, has_photo):
+    """Convert a people row to the dict returned by the person endpoints"""
+    return {
+        'id': person.id,
+        'family_id': person.family_id,
+        'first_name': person.first_name,
+        'last_name': person.last_name or '',
+        'maiden_name': person.maiden_name or '',
+        'nickname': person.nickname or '',
+        'birth_date': person.birth_date.isoformat() if person.birth_date else None,
+        'death_date': person.death_date.isoformat() if person.death_date else None,
+        'birth_place': person.birth_place or '',
+        'is_living': person.is_living,
+        'gender': person.gender or '',
+        'bio_summary': person.bio_summary or '',
+        'has_photo': has_photo,
+        'generation_level': person.generation_level,
+        'node_color': person.node_color or 'green',
+        'node_shape': person.node_shape or 'circle'
+    }
+
+def get_people_details(person_ids, include_photo=False):
+    """Get many people by id without loading their photo blobs
+
+    Returns a dict keyed by person id. With include_photo each person also
+    gets a 'photo' dict with filename, size and url (or None).
+    """
+    photo_size = db.people.profile_photo.len()
+    rows = db(db.people.id.belongs(set(person_ids))).select(
+        *[db.people[name] for name in db.people.fields if name != 'profile_photo'],
+        photo_size
+    )
+    
+    people = {}
+    for row in rows:
+        person = row.people
+        size = row[photo_size] or 0
+        person_data = serialize_person(person, bool(size))
+        if include_photo:
+            # Blobs are stored base64 encoded, report the approximate decoded size
+            person_data['photo'] = {
+                'filename': person.profile_photo_filename,
+                'size': size * 3 // 4,
+                'url': f"/familyTimeline/api/person-photo/{person.id}"
+            } if size else None
+        people[person.id] = person_data
     
-    return stories_data
+    return people
+
+def get_delete_preview(person_ids):
+    """Get the stories and relationships that deleting these people removes
+
+    Runs two queries whatever the number of people and relationships: one
+    for the stories (without photo blobs) and one joining each relationship
+    to the person on its other side.
+    """
+    person_ids = set(person_ids)
+    stories = db(db.stories.person_id.belongs(person_ids)).select(
+        db.stories.id, db.stories.person_id, db.stories.title, db.stories.theme,
+        orderby=db.stories.id
+    )
+    
+    rel = db.relationships
+    other = db.people.with_alias('other_person')
+    # the alias inherits the people common filter, which names db.people
+    # and so is not in this join: filter the deleted rows explicitly
+    rows = db(
+        ((rel.person1_id.belongs(person_ids) & (other.id == rel.person2_id)) |
+         (rel.person2_id.belongs(person_ids) & (other.id == rel.person1_id))) &
+        (other.deleted_at == None) & (rel.deleted_at == None),
+        ignore_common_filters=True
+    ).select(
+        rel.id, rel.relationship_type, rel.person1_id, rel.person2_id,
+        other.first_name, other.last_name,
+        orderby=rel.id
+    )
+    
+    relationships = {}
+    for row in rows:
+        # a relationship between two deleted people matches twice
+        if row.relationships.id in relationships:
+            continue
+        relationships[row.relationships.id] = {
+            'id': row.relationships.id,
+            'relationship_type': row.relationships.relationship_type,
+            'person1_id': row.relationships.person1_id,
+            'person2_id': row.relationships.person2_id,
+            'other_person': f"{row.other_person.first_name} {row.other_person.last_name or ''}".strip()
+        }
+    
+    return dict(
+        stories=[{'id': s.id, 'person_id': s.person_id, 'title': s.title, 'theme': s.theme} for s in stories],
+        relationships=list(relationships.values())
+    )
+
+def delete_people(person_ids):
+    """Soft delete people with their stories and relationships
+
+    Marks the rows as deleted (the tables' common filters hide them from
+    every query) with a shared deletion id that restore_deletion() takes.
+    A constant number of set-based updates, the photo blobs stay in place
+    until compaction.purge_deleted() removes the rows for good. Returns the
+    number of deleted people, stories and relationships and the deletion id.
+    """
+    person_ids = set(person_ids)
+    deletion_id = uuid.uuid4().hex
+    marks = dict(deleted_at=datetime.utcnow(), deletion_id=deletion_id)
+    try:
+        deleted_stories = db(db.stories.person_id.belongs(person_ids)).update(
+            updated_at=db.stories.updated_at, **marks
+        )
+        # one update per direction so each can use its own index, the
+        # second one skips the rows already marked by the first
+        deleted_relationships = (
+            db(db.relationships.person1_id.belongs(person_ids)).update(**marks) +
+            db(db.relationships.person2_id.belongs(person_ids)).update(**marks)
+        )
+        deleted_people = db(db.people.id.belongs(person_ids)).update(
+            updated_at=db.people.updated_at, **marks
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    
+    log_event(log, logging.INFO, "people.deleted", people=sorted(person_ids),
+              stories=deleted_stories, relationships=deleted_relationships,
+              deletion_id=deletion_id)
+    return dict(
+        deleted_people=deleted_people,
+        deleted_stories=deleted_stories,
+        deleted_relationships=deleted_relationships,
+        deletion_id=deletion_id
+    )
+
+def get_deletion_family_id(deletion_id):
+    """Get the family of a soft deletion, None if unknown or already purged"""
+    row = db(db.people.deletion_id == deletion_id, ignore_common_filters=True).select(
+        db.people.family_id, limitby=(0, 1)
+    ).first()
+    return row.family_id if row else None
+
+def restore_deletion(deletion_id):
+    """Undo a delete_people() call that compaction has not purged yet
+
+    Relationships come back only when the people on both sides are live,
+    a relative deleted separately stays deleted with their links.
+    """
+    unmark = dict(deleted_at=None, deletion_id=None)
+    try:
+        restored_people = db(
+            db.people.deletion_id == deletion_id, ignore_common_filters=True
+        ).update(updated_at=db.people.updated_at, **unmark)
+        restored_stories = db(
+            db.stories.deletion_id == deletion_id, ignore_common_filters=True
+        ).update(updated_at=db.stories.updated_at, **unmark)
+        
+        rel = db.relationships
+        rows = db(rel.deletion_id == deletion_id, ignore_common_filters=True).select(
+            rel.id, rel.person1_id, rel.person2_id
+        )
+        endpoints = set(r.person1_id for r in rows) | set(r.person2_id for r in rows)
+        live = set(p.id for p in db(db.people.id.belongs(endpoints)).select(db.people.id))
+        restore_ids = [r.id for r in rows if r.person1_id in live and r.person2_id in live]
+        restored_relationships = db(
+            rel.id.belongs(restore_ids), ignore_common_filters=True
+        ).update(**unmark) if restore_ids else 0
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    
+    log_event(log, logging.INFO, "people.restored", deletion_id=deletion_id,
+              people=restored_people, stories=restored_stories,
+              relationships=restored_relationships)
+    return dict(
+        restored_people=restored_people,
+        restored_stories=restored_stories,
+        restored_relationships=restored_relationships
+    )
+
+def get_branch_ids(family_id, root_person_id, include_spouses=False):
+    """Get a person and all their descendants, root first
+
+    With include_spouses the spouses of the descendants (not of the root)
+    are included too, without following their own children. Loads the
+    family's parent/spouse relationships with one query and walks them in
+    memory.
+    """
+    rows = db(
+        (db.relationships.family_id == family_id) &
+        db.relationships.relationship_type.belongs(('parent', 'spouse'))
+    ).select(
+        db.relationships.person1_id,
+        db.relationships.person2_id,
+        db.relationships.relationship_type
+    )
+    
+    children, spouses = {}, {}
+    for rel in rows:
+        links = children if rel.relationship_type == 'parent' else spouses
+        links.setdefault(rel.person1_id, set()).add(rel.person2_id)
+    
+    descendants = [root_person_id]
+    seen = {root_person_id}
+    for person_id in descendants:
+        for child_id in sorted(children.get(person_id, set()) - seen):
+            seen.add(child_id)
+            descendants.append(child_id)
+    
+    branch = list(descendants)
+    if include_spouses:
+        for person_id in descendants[1:]:
+            for spouse_id in sorted(spouses.get(person_id, set()) - seen):
+                seen.add(spouse_id)
+                branch.append(spouse_id)
+    return branch
+
+# Zoom levels supported by the family timeline, widest first
+TIMELINE_ZOOM_LEVELS = ('decade', 'year')
+
+def _timeline_bucket(buckets, year, zoom):
+    """Get (or create) the timeline bucket a year falls into"""
+    start = year - year % 10 if zoom == 'decade' else year
+    bucket = buckets.get(start)
+    if bucket is None:
+        end = start + 9 if zoom == 'decade' else start
+        bucket = buckets[start] = {
+            'key': start,
+            'label': f"{start}s" if zoom == 'decade' else str(start),
+            'start_year': start,
+            'end_year': end,
+            'story_count': 0,
+            'event_count': 0,
+            'count': 0,
+        }
+        if zoom == 'year':
+            bucket['items'] = []
+    return bucket
+
+def _in_year_range(year, start_year, end_year):
+    """Check a year against an optional inclusive range"""
+    if year is None:
+        return False
+    if start_year is not None and year < start_year:
+        return False
+    if end_year is not None and year > end_year:
+        return False
+    return True
+
+def get_family_timeline(family_id, zoom='decade', start_year=None, end_year=None):
+    """Get stories and life events for a family bucketed by decade or year
+
+    Decade zoom only returns counts (one grouped query over the
+    family/year index); year zoom also returns the items of every bucket
+    so the client can render a range without further requests.
+    """
+    story_query = (
+        (db.stories.family_id == family_id) &
+        (db.stories.year_occurred != None)
+    )
+    if start_year is not None:
+        story_query &= db.stories.year_occurred >= start_year
+    if end_year is not None:
+        story_query &= db.stories.year_occurred <= end_year
+
+    buckets = {}
+
+    if zoom == 'decade':
+        story_count = db.stories.id.count()
+        rows = db(story_query).select(
+            db.stories.year_occurred,
+            story_count,
+            groupby=db.stories.year_occurred
+        )
+        for row in rows:
+            bucket = _timeline_bucket(buckets, row.stories.year_occurred, zoom)
+            bucket['story_count'] += row[story_count]
+    else:
+        # Never load photo blobs here, photo_filename is set with the photo
+        stories = db(story_query).select(
+            db.stories.id,
+            db.stories.person_id,
+            db.stories.title,
+            db.stories.theme,
+            db.stories.author_name,
+            db.stories.year_occurred,
+            db.stories.questions_and_answers,
+            db.stories.story_text,
+            db.stories.photo_filename,
+            db.stories.created_at,
+            orderby=db.stories.year_occurred | db.stories.created_at
+        )
+        for story in stories:
+            bucket = _timeline_bucket(buckets, story.year_occurred, zoom)
+            bucket['story_count'] += 1
+            bucket['items'].append({
+                'kind': 'story',
+                'id': story.id,
+                'person_id': story.person_id,
+                'year': story.year_occurred,
+                'title': story.title,
+                'theme': story.theme,
+                'author': story.author_name,
+                'questions_and_answers': story.questions_and_answers or [],
+                'story_text': story.story_text,
+                'has_photo': bool(story.photo_filename),
+                'photo_url': f"/familyTimeline/api/story-photo/{story.id}" if story.photo_filename else None,
+                'created_at': story.created_at.isoformat() if story.created_at else None,
+            })
+
+    # Life events come from people and spouse relationships
+    people = db(db.people.family_id == family_id).select(
+        db.people.id,
+        db.people.first_name,
+        db.people.last_name,
+        db.people.birth_date,
+        db.people.death_date
+    )
+    names = {}
+    events = []
+    for person in people:
+        names[person.id] = f"{person.first_name} {person.last_name or ''}".strip()
+        for kind, date in (('birth', person.birth_date), ('death', person.death_date)):
+            if date:
+                events.append((kind, date, [person.id]))
+
+    # Reciprocal spouse rows are stored twice, keep one per couple
+    marriages = db(
+        (db.relationships.family_id == family_id) &
+        (db.relationships.relationship_type == 'spouse') &
+        (db.relationships.marriage_date != None) &
+        (db.relationships.person1_id < db.relationships.person2_id)
+    ).select(
+        db.relationships.person1_id,
+        db.relationships.person2_id,
+        db.relationships.marriage_date
+    )
+    for rel in marriages:
+        events.append(('marriage', rel.marriage_date, [rel.person1_id, rel.person2_id]))
+
+    for kind, date, person_ids in sorted(events, key=lambda event: event[1]):
+        if not _in_year_range(date.year, start_year, end_year):
+            continue
+        bucket = _timeline_bucket(buckets, date.year, zoom)
+        bucket['event_count'] += 1
+        if zoom == 'year':
+            bucket['items'].append({
+                'kind': kind,
+                'year': date.year,
+                'date': date.isoformat(),
+                'person_ids': person_ids,
+                'title': ' & '.join(names.get(pid, '') for pid in person_ids),
+            })
+
+    for bucket in buckets.values():
+        bucket['count'] = bucket['story_count'] + bucket['event_count']
+
+    undated_story_count = db(
+        (db.stories.family_id == family_id) &
+        (db.stories.year_occurred == None)
+    ).count()
+
+    return {
+        'zoom': zoom,
+        'start_year': start_year,
+        'end_year': end_year,
+        'buckets': [buckets[key] for key in sorted(buckets)],
+        'total_stories': sum(b['story_count'] for b in buckets.values()),
+        'total_events': sum(b['event_count'] for b in buckets.values()),
+        'undated_story_count': undated_story_count,
+    }
+
+# Display names for the theme keys stored in theme_questions
+THEME_NAMES = {
+    'childhood': 'Childhood',
+    'personality': 'Personality', 
+    'family_life': 'Family Life',
+    'career': 'Career & Work',
+    'adventures': 'Adventures & Travel',
+    'relationships': 'Relationships',
+    'wisdom': 'Wisdom & Lessons',
+    'memories': 'Personal Memories',
+    'general': 'General'
+}
+
+def get_theme_catalogue():
+    """Get all themes with their active questions as a content-hashed bundle
+
+    Returns a dict with 'version' (hash of the JSON), 'data' (the encoded
+    JSON) and 'catalogue'. It is built once and kept until theme_questions
+    changes, so serving it runs no queries.
+    """
+    catalogue = _theme_catalogue.get('current')
+    if (catalogue is not None and broadcast is None
+            and time.monotonic() - catalogue['built_at'] >= settings.THEME_CATALOGUE_TTL):
+        catalogue = None
+    cache_lookup('theme_catalogue', catalogue is not None)
+    if catalogue is None:
+        rows = db(db.theme_questions).select(
+            orderby=db.theme_questions.theme | db.theme_questions.order_index
+        )
+        themes = {}
+        for q in rows:
+            questions = themes.setdefault(q.theme, [])
+            if q.is_active:
+                questions.append({
+                    'id': q.id,
+                    'text': q.question_text,
+                    'order': q.order_index
+                })
+        
+        bundle = {
+            'themes': [
+                {
+                    'key': theme,
+                    'name': THEME_NAMES.get(theme, theme.title()),
+                    'questions': questions
+                }
+                for theme, questions in sorted(themes.items())
+            ]
+        }
+        data = json.dumps(bundle, sort_keys=True, separators=(',', ':')).encode('utf8')
+        catalogue = _theme_catalogue['current'] = {
+            'version': hashlib.sha256(data).hexdigest()[:16],
+            'data': data,
+            'catalogue': bundle,
+            'built_at': time.monotonic()
+        }
+    return catalogue
 
 # Populate default theme questions (keep existing function)
 def populate_default_questions():
@@ -592,19 +1259,108 @@ def populate_default_questions():
                 )
         db.commit()
 
-# Keep other existing helper functions
+def get_family_graph(family_id):
+    """Get a family as compact lists for the compute kernels (see kernels.py)
+
+    Returns (person_ids, parent_edges, spouse_edges) with two queries.
+    """
+    person_ids = [row.id for row in db(db.people.family_id == family_id).select(
+        db.people.id, orderby=db.people.id
+    )]
+    rows = db(
+        (db.relationships.family_id == family_id) &
+        db.relationships.relationship_type.belongs(('parent', 'spouse'))
+    ).select(
+        db.relationships.person1_id,
+        db.relationships.person2_id,
+        db.relationships.relationship_type
+    )
+    parent_edges = [(r.person1_id, r.person2_id) for r in rows if r.relationship_type == 'parent']
+    spouse_edges = [(r.person1_id, r.person2_id) for r in rows if r.relationship_type == 'spouse']
+    return person_ids, parent_edges, spouse_edges
+
+def run_family_kernel(name, family_size, *args, busy_inline=True):
+    """Run a compute kernel, in the process pool for large families only
+
+    Small families are computed in the request thread, where pickling
+    costs more than the computation. If the pool is busy the kernel runs
+    inline too rather than failing, unless busy_inline is False: then
+    ComputeBusy is raised for the caller to answer 503.
+    """
+    inline = family_size < settings.COMPUTE_INLINE_BELOW
+    try:
+        return compute_pool.run(name, *args, inline=inline)
+    except ComputeBusy:
+        if not busy_inline:
+            raise
+        log.warning("compute pool busy, running %s inline", name)
+        return compute_pool.run(name, *args, inline=True)
+
 def calculate_tree_positions(family_id, root_person_id=None):
-    """Calculate optimal positions for tree layout"""
-    # Implementation remains the same
-    pass
+    """Lay the family tree out and store tree_position_x/y of each person
+
+    Returns the number of people whose position changed.
+    """
+    person_ids, parent_edges, spouse_edges = get_family_graph(family_id)
+    positions = run_family_kernel(
+        'tree_layout', len(person_ids), person_ids, parent_edges, spouse_edges, root_person_id
+    )
+    current = {
+        row.id: (row.tree_position_x, row.tree_position_y)
+        for row in db(db.people.id.belongs(person_ids)).select(
+            db.people.id, db.people.tree_position_x, db.people.tree_position_y
+        )
+    }
+    changed = 0
+    for person_id, (x, y) in zip(person_ids, positions):
+        if current.get(person_id) != (x, y):
+            db(db.people.id == person_id).update(
+                tree_position_x=x, tree_position_y=y, updated_at=db.people.updated_at
+            )
+            changed += 1
+    db.commit()
+    return changed
 
 def update_generation_levels(family_id):
-    """Update generation levels based on relationships"""
-    # Implementation remains the same
-    pass
+    """Recompute generation_level from the parent and spouse relationships
+
+    Writes one update per generation that changed, returns the number of
+    people whose level changed.
+    """
+    person_ids, parent_edges, spouse_edges = get_family_graph(family_id)
+    levels = run_family_kernel(
+        'generation_levels', len(person_ids), person_ids, parent_edges, spouse_edges
+    )
+    current = {
+        row.id: row.generation_level
+        for row in db(db.people.id.belongs(person_ids)).select(
+            db.people.id, db.people.generation_level
+        )
+    }
+    by_level = {}
+    for person_id, level in zip(person_ids, levels):
+        if current.get(person_id) != level:
+            by_level.setdefault(level, []).append(person_id)
+    for level, ids in by_level.items():
+        db(db.people.id.belongs(ids)).update(
+            generation_level=level, updated_at=db.people.updated_at
+        )
+    db.commit()
+    return sum(len(ids) for ids in by_level.values())
+
+def get_kinship(family_id, person1_id, person2_id):
+    """How person2 is related to person1, see kernels.kinship
+
+    Raises ComputeBusy when the pool is full: the request is cheap to
+    retry, while running a large family inline would hold a web thread.
+    """
+    person_ids, parent_edges, spouse_edges = get_family_graph(family_id)
+    return run_family_kernel(
+        'kinship', len(person_ids), parent_edges, spouse_edges, person1_id, person2_id,
+        busy_inline=False
+    )
 
-# Initialize database with default questions
-populate_default_questions()
+# Indexes and default questions are created by migrations.py, not here
 
 # Commit and close db connection properly
 db.commit()
\ No newline at end of file
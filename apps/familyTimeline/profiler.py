@@ -0,0 +1,296 @@
+"""
+Per-request profiler for the familyTimeline actions
+
+RequestProfiler is a fixture; list it first in @action.uses(...) so it
+wraps every other fixture. For each request it records wall time, the
+number and duration of the SQL queries (through a pydal execution
+handler installed on the adapter), the template render time (see
+record_render), the response payload size and the photo blob bytes
+served (see record_blob). It then
+
+- adds a Server-Timing header (app, db, render and blob entries), and
+- aggregates per route in an in-process latency histogram with the
+  slowest queries, available through report().
+
+Routes are keyed by method and declared rule: the values of the route
+arguments are put back as <name>, so /api/person/12/stories and
+/api/person/13/stories share stats, as do the invitation tokens or the
+catalogue versions of one route. At most MAX_ROUTES are kept, the
+others are counted as "other".
+"""
+
+import bisect
+import hmac
+import re
+import threading
+import time
+
+from pydal.helpers.classes import ExecutionHandler
+
+from py4web import HTTP, request, response
+from py4web.core import Fixture, dumps
+
+# Upper bounds (in ms) of the latency histogram buckets, the last is +Inf
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+MAX_QUERIES_PER_REQUEST = 200  # SQL statements kept per request for the top-N
+MAX_QUERIES_PER_ROUTE = 50  # distinct normalized statements kept per route
+MAX_ROUTES = 200  # routes with stats, beyond they share OTHER_ROUTE
+OTHER_ROUTE = "other"
+
+LOOPBACK = ("127.0.0.1", "::1")
+# set by a reverse proxy, whose own address is often the loopback
+PROXY_HEADERS = ("HTTP_X_FORWARDED_FOR", "HTTP_FORWARDED", "HTTP_X_REAL_IP")
+
+REGEX_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+REGEX_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def normalize_sql(command):
+    """Replace literals so that the same statement aggregates together"""
+    return REGEX_SQL_LITERALS.sub("?", command)
+
+
+def route_key(method, path, url_args=None):
+    """Low cardinality route name: the route arguments (url_args, in the
+    order of the rule) become <name>, numeric segments <id> without them"""
+    if not url_args:
+        return "%s %s" % (method, REGEX_ID_SEGMENT.sub("/<id>", path))
+    # from the end: the fixed part of a rule mostly comes before its arguments
+    rule, end = [], len(path)
+    for name, value in reversed(list(url_args.items())):
+        value = str(value)
+        if not value:
+            continue
+        matches = list(re.finditer(r"(?<=/)%s(?=/|$)" % re.escape(value), path[:end]))
+        if matches:
+            rule.append("<%s>" % name + path[matches[-1].end():end])
+            end = matches[-1].start()
+    return "%s %s" % (method, path[:end] + "".join(reversed(rule)))
+
+
+class QueryTimer(ExecutionHandler):
+    """pydal execution handler feeding the active request profile"""
+
+    profiler = None
+
+    def before_execute(self, command):
+        self.t0 = time.perf_counter()
+
+    def after_execute(self, command):
+        self.profiler.record_query(command, time.perf_counter() - self.t0)
+
+
+class RouteStats:
+    """Aggregated timings of one route"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.payload_bytes = 0
+        self.blob_bytes = 0
+        self.sql = {}  # normalized sql -> [count, total_time, max_time]
+
+    def add(self, profile, elapsed, error):
+        self.count += 1
+        self.errors += 1 if error else 0
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed * 1000)] += 1
+        self.queries += profile.queries
+        self.db_time += profile.db_time
+        self.render_time += profile.render_time
+        self.payload_bytes += profile.payload_bytes
+        self.blob_bytes += profile.blob_bytes
+        for command, dt in profile.sql:
+            key = normalize_sql(command)
+            stats = self.sql.get(key)
+            if stats is None:
+                if len(self.sql) >= MAX_QUERIES_PER_ROUTE:
+                    continue
+                stats = self.sql[key] = [0, 0.0, 0.0]
+            stats[0] += 1
+            stats[1] += dt
+            stats[2] = max(stats[2], dt)
+
+    def percentile(self, fraction):
+        """Upper bound (ms) of the bucket holding the given fraction of requests"""
+        target, seen = fraction * self.count, 0
+        for bound, count in zip(LATENCY_BUCKETS_MS + (None,), self.buckets):
+            seen += count
+            if seen >= target:
+                return bound if bound is not None else round(self.max_time * 1000, 3)
+        return None
+
+    def as_dict(self, top_queries):
+        count = self.count or 1
+        top = sorted(self.sql.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg_ms": round(self.total_time / count * 1000, 3),
+            "max_ms": round(self.max_time * 1000, 3),
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "histogram": dict(
+                zip(
+                    [str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"],
+                    self.buckets,
+                )
+            ),
+            "avg_queries": round(self.queries / count, 2),
+            "avg_db_ms": round(self.db_time / count * 1000, 3),
+            "avg_render_ms": round(self.render_time / count * 1000, 3),
+            "avg_payload_bytes": self.payload_bytes // count,
+            "blob_bytes": self.blob_bytes,
+            "top_queries": [
+                {
+                    "sql": sql,
+                    "count": stats[0],
+                    "total_ms": round(stats[1] * 1000, 3),
+                    "max_ms": round(stats[2] * 1000, 3),
+                }
+                for sql, stats in top[:top_queries]
+            ],
+        }
+
+
+class RequestProfiler(Fixture):
+    """Fixture timing actions and their queries (see module docstring)"""
+
+    def __init__(self, db, enabled=True):
+        self.db = db
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.routes = {}
+        if enabled:
+            handler = type("QueryTimer", (QueryTimer,), {"profiler": self})
+            db._adapter.execution_handlers.append(handler)
+
+    def on_request(self, context):
+        if not self.enabled:
+            return
+        Fixture.local_initialize(self)
+        profile = self.local
+        profile.route = route_key(
+            request.method, request.path, request.environ.get("route.url_args")
+        )
+        profile.start = time.perf_counter()
+        profile.queries = 0
+        profile.db_time = 0.0
+        profile.sql = []
+        profile.render_time = 0.0
+        profile.payload_bytes = 0
+        profile.blob_bytes = 0
+
+    def on_success(self, context):
+        self._finish(context, error=False)
+
+    def on_error(self, context):
+        self._finish(context, error=True)
+
+    def record_query(self, command, elapsed):
+        if not self.is_valid():
+            return
+        profile = self.local
+        profile.queries += 1
+        profile.db_time += elapsed
+        if len(profile.sql) < MAX_QUERIES_PER_REQUEST:
+            profile.sql.append((command, elapsed))
+
+    def record_render(self, elapsed):
+        """Count the seconds spent rendering the template of the current action"""
+        if self.is_valid():
+            self.local.render_time += elapsed
+
+    def record_blob(self, nbytes):
+        """Count photo/blob bytes sent by the current action"""
+        if self.is_valid():
+            self.local.blob_bytes += nbytes
+
+    def _finish(self, context, error):
+        if not self.is_valid():
+            return
+        profile = self.local
+        output = context.get("output")
+        if isinstance(output, (dict, list)):
+            # serialize here (as py4web would) to measure the payload
+            response.headers.setdefault("Content-Type", "application/json")
+            output = context["output"] = dumps(output)
+        if isinstance(output, (str, bytes)):
+            profile.payload_bytes = len(output)
+        error = error or context.get("status", 200) >= 500
+        elapsed = time.perf_counter() - profile.start
+
+        timing = "app;dur=%.1f, db;dur=%.1f;desc=\"%d queries\"" % (
+            elapsed * 1000,
+            profile.db_time * 1000,
+            profile.queries,
+        )
+        if profile.render_time:
+            timing += ", render;dur=%.1f" % (profile.render_time * 1000)
+        if profile.blob_bytes:
+            timing += ", blob;desc=\"%d bytes\"" % profile.blob_bytes
+        response.headers["Server-Timing"] = timing
+
+        with self.lock:
+            route = profile.route
+            if route not in self.routes and len(self.routes) >= MAX_ROUTES:
+                route = OTHER_ROUTE
+            stats = self.routes.get(route)
+            if stats is None:
+                stats = self.routes[route] = RouteStats()
+            stats.add(profile, elapsed, error)
+
+    def report(self, limit=10, top_queries=5):
+        """The slowest routes (by average time) with their top queries"""
+        with self.lock:
+            routes = [
+                dict(route=route, **stats.as_dict(top_queries))
+                for route, stats in self.routes.items()
+            ]
+        routes.sort(key=lambda item: item["avg_ms"], reverse=True)
+        return routes[:limit]
+
+    def reset(self):
+        with self.lock:
+            self.routes = {}
+
+
+class MonitoringAccess(Fixture):
+    """Guard for monitoring endpoints
+
+    Requires the token as "Authorization: Bearer <token>" (or ?token=).
+    Without a configured token the endpoints are closed, unless
+    allow_local is set (development mode): then only requests made from
+    this machine, not through a proxy, get in.
+    """
+
+    def __init__(self, token, allow_local=False):
+        self.token = token
+        self.allow_local = allow_local
+
+    def on_request(self, context):
+        if not self.token:
+            if not (self.allow_local and is_local_request()):
+                raise HTTP(403)
+            return
+        supplied = request.headers.get("Authorization", "")
+        supplied = supplied[7:] if supplied.startswith("Bearer ") else ""
+        supplied = supplied or request.query.get("token", "")
+        if not hmac.compare_digest(supplied.encode(), self.token.encode()):
+            raise HTTP(403)
+
+
+def is_local_request():
+    """True for a request from a loopback address without proxy headers"""
+    environ = request.environ
+    if environ.get("REMOTE_ADDR") not in LOOPBACK:
+        return False
+    return not any(environ.get(header) for header in PROXY_HEADERS)
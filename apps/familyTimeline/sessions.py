@@ -0,0 +1,217 @@
+"""
+Server side session stores with an in-process LRU in front
+
+py4web's Session calls storage.get(token) on every request that carries
+a session cookie and storage.set(uuid, json, expiration) only when the
+session changed. CachedStore keeps the most recently used sessions of
+this process in memory, so a hot user costs no store round trip at all:
+
+    session = Session(secret=..., storage=CachedStore(DBSessionStore(db)))
+
+- A cached session is trusted for ttl seconds, then read again from the
+  store. That bounds how long another process can serve a session changed
+  (or logged out) elsewhere. common.py uses settings.SESSION_CACHE_TTL
+  only with a broadcast (below), and otherwise the shorter
+  SESSION_CACHE_TTL_UNSHARED (3s): a logout is then seen by the other
+  processes within that time. With 0 every get() reads the store and
+  only the writes are saved.
+- set() skips the store when only the keys rewritten at every request
+  (VOLATILE_KEYS: py4web's save timestamp, Auth's activity marks)
+  changed, but still writes once per write_interval seconds so that the
+  stored timestamps and the store expiration keep up.
+- At most settings.SESSION_CACHE_SIZE sessions are kept.
+- With a kvstore.Broadcast, a changed session is also dropped at once
+  from the caches of the other processes.
+
+DBSessionStore is py4web's DBStore without its two writes per request:
+it only extends a sliding expiration once half of it has passed, and
+deletes expired sessions in batches every SESSION_SWEEP_INTERVAL seconds
+instead of with a full table delete on every save. It indexes its table
+when it is created, whenever the app switches to database sessions. RedisSessionStore
+keeps the TTL of an existing key in the same round trip as the write.
+"""
+
+import collections
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from py4web.utils.dbstore import DBStore
+from pydal.utils import utcnow
+
+from .metrics import cache_lookup
+
+NEVER = datetime(2999, 12, 31)
+
+# set by Session.save and Auth on (nearly) every request
+VOLATILE_KEYS = ("timestamp", "recent_timestamp", "recent_activity")
+
+
+def _key(key):
+    # Session.load looks tokens up as bytes, Session.save stores them as str
+    return key.decode("utf8") if isinstance(key, bytes) else key
+
+
+def _stable(value):
+    """value without VOLATILE_KEYS, to compare sessions"""
+    try:
+        data = json.loads(value)
+    except (TypeError, ValueError):
+        return value
+    if not isinstance(data, dict):
+        return value
+    for name in VOLATILE_KEYS:
+        data.pop(name, None)
+    return data
+
+
+class CachedStore:
+    """LRU of session values in front of a get/set session storage"""
+
+    def __init__(self, storage, size=10000, ttl=15, broadcast=None, write_interval=60):
+        self.storage = storage
+        self.size = size
+        self.ttl = ttl
+        self.write_interval = write_interval
+        # key -> (value, stable value, cached_at, written_at)
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.__prerequisites__ = getattr(storage, "__prerequisites__", [])
+        self.broadcast = broadcast
+        if broadcast:
+            broadcast.on("session", self.discard)
+
+    def get(self, key):
+        key = _key(key)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now - entry[2] < self.ttl:
+                self.entries.move_to_end(key)
+                cache_lookup("sessions", True)
+                return entry[0]
+        cache_lookup("sessions", False)
+        value = self.storage.get(key)
+        if isinstance(value, bytes):
+            value = value.decode("utf8")
+        if value is None:
+            self.discard(key)
+        else:
+            # the store may hold older timestamps than the cache had
+            self._remember(key, value, _stable(value), now, entry[3] if entry else 0)
+        return value
+
+    def set(self, key, value, expiration=None):
+        key = _key(key)
+        stable = _stable(value)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+        changed = entry is None or entry[1] != stable
+        if changed or now - entry[3] >= self.write_interval:
+            self.storage.set(key, value, expiration)
+            written_at = now
+            if changed and self.broadcast:
+                self.broadcast.send("session", key)
+        else:
+            written_at = entry[3]
+        self._remember(key, value, stable, now, written_at)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(_key(key), None)
+
+    def _remember(self, key, value, stable, now, written_at):
+        with self.lock:
+            self.entries[key] = (value, stable, now, written_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class DBSessionStore(DBStore):
+    """py4web's DBStore (same table) with lazy touches and batched sweeps"""
+
+    def __init__(self, db, name="py4web_session", sweep_interval=300, sweep_batch=500):
+        super().__init__(db, name)
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.swept_at = 0
+        self.create_indexes()
+
+    def create_indexes(self):
+        """Index the lookups by key and the sweeps by expiry (idempotent)"""
+        name = self.table._tablename
+        self.db.executesql(
+            "CREATE INDEX IF NOT EXISTS idx_%s_rkey ON %s (rkey)" % (name, name)
+        )
+        self.db.executesql(
+            "CREATE INDEX IF NOT EXISTS idx_%s_expires_on ON %s (expires_on)" % (name, name)
+        )
+        self.db.commit()
+
+    def get(self, key):
+        db, table, now = self.db, self.table, utcnow()
+        row = db(table.rkey == _key(key)).select(
+            table.id, table.rvalue, table.expiration, table.expires_on, limitby=(0, 1)
+        ).first()
+        if not row or (row.expires_on and row.expires_on < now):
+            return None
+        # sliding expiration: only write when half of it has passed
+        if row.expiration and row.expires_on - now < timedelta(seconds=row.expiration / 2):
+            db(table.id == row.id).update(expires_on=now + timedelta(seconds=row.expiration))
+        return row.rvalue
+
+    def set(self, key, value, expiration=None):
+        db, table, now = self.db, self.table, utcnow()
+        expires_on = now + timedelta(seconds=expiration) if expiration else NEVER
+        updated = db(table.rkey == key).update(
+            rvalue=value, expires_on=expires_on, expiration=expiration
+        )
+        if not updated:
+            table.insert(
+                rkey=key,
+                rvalue=value,
+                expires_on=expires_on,
+                expiration=expiration,
+                created_on=now,
+            )
+        self.sweep()
+        db.commit()
+
+    def sweep(self, force=False):
+        """Delete up to sweep_batch expired sessions, at most once per interval"""
+        if not force and time.monotonic() - self.swept_at < self.sweep_interval:
+            return 0
+        self.swept_at = time.monotonic()
+        db, table = self.db, self.table
+        ids = [
+            row.id
+            for row in db(table.expires_on < utcnow()).select(
+                table.id, limitby=(0, self.sweep_batch)
+            )
+        ]
+        if ids:
+            db(table.id.belongs(ids)).delete()
+        return len(ids)
+
+
+class RedisSessionStore:
+    """Redis session storage keeping the TTL of existing sessions"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def get(self, key):
+        return self.conn.get(key)
+
+    def set(self, key, value, expiration=None):
+        if not expiration:
+            self.conn.set(key, value, keepttl=True)
+            return
+        # a new key expires after expiration, an existing one keeps its TTL
+        pipe = self.conn.pipeline(transaction=False)
+        pipe.set(key, value, ex=expiration, nx=True)
+        pipe.set(key, value, xx=True, keepttl=True)
+        pipe.execute()
@@ -25,9 +25,19 @@ DB_POOL_SIZE = 1
 DB_MIGRATE = True
 DB_FAKE_MIGRATE = False
 
+# apply pending migrations.py steps when the app is imported (one read of
+# schema_version once up to date). Set to False in production and run
+# "py4web call apps familyTimeline.migrations.migrate" on deploy instead.
+AUTO_MIGRATE = True
+
 # location where static files are stored:
 STATIC_FOLDER = required_folder(APP_FOLDER, "static")
 
+# templates, compiled once (see viewcache.py); compiled again when a file
+# changes only with TEMPLATES_CHECK_MTIME (one stat per file and render)
+TEMPLATES_FOLDER = os.path.join(APP_FOLDER, "templates")
+TEMPLATES_CHECK_MTIME = MODE == "development"
+
 # location where to store uploaded files:
 UPLOAD_FOLDER = required_folder(APP_FOLDER, "uploads")
 
@@ -59,17 +69,50 @@ SMTP_SENDER = "you@example.com"
 SMTP_LOGIN = "username:password"
 SMTP_TLS = False
 
+# key-value store shared by the processes (see kvstore.py), None to disable:
+# "unix://databases/kv.sock" (relative to this folder) starts a local redis
+# stand-in on first use, "redis://host:6379" uses a real redis
+KV_URL = None
+KV_AUTOSTART = True  # start the local server if none listens on the unix socket
+TREE_CACHE_TTL = 300  # seconds api/tree data stays in the KV store
+THEME_CATALOGUE_TTL = 60  # seconds a process keeps its theme catalogue without KV_URL
+
 # session settings
-SESSION_TYPE = "cookies"
+SESSION_TYPE = "cookies"  # cookies, database, redis, memcache or local (KV_URL)
 SESSION_SECRET_KEY = "your-secret-key-here-change-in-production"  # Set a default for development
 MEMCACHE_CLIENTS = ["127.0.0.1:11211"]
 REDIS_SERVER = "localhost:6379"
+# server side sessions are cached per process (see sessions.py)
+SESSION_CACHE_SIZE = 10000  # sessions kept in memory
+SESSION_CACHE_TTL = 15  # seconds before a cached session is read from the store again (with KV_URL)
+# the same without KV_URL: another process keeps serving a session changed
+# or logged out elsewhere for up to this long, 0 reads the store every time
+SESSION_CACHE_TTL_UNSHARED = 3
+SESSION_WRITE_INTERVAL = 60  # seconds between writes of a session whose timestamps only changed
+SESSION_SWEEP_INTERVAL = 300  # seconds between deletes of expired database sessions
+SESSION_SWEEP_BATCH = 500  # expired database sessions deleted per sweep
 
 # logger settings
 LOGGERS = [
     "warning:stdout"
 ]  # syntax "severity:filename:format" filename can be stderr or stdout
 
+# structured logging (see logs.py)
+# per module, capped by LOGGERS; set a module to "debug" (and LOGGERS to
+# "debug:...") to see its request payloads
+LOG_LEVELS = {"controllers": "info", "models": "info"}
+LOG_PAYLOAD_LIMIT = 200  # max characters logged per field value
+LOG_SAMPLE_RATE = 1.0  # fraction of requests whose debug/info records are kept
+LOG_ASYNC = True  # write log records from a background thread
+
+# request profiler (see profiler.py)
+PROFILER_ENABLED = True
+
+# token required by the monitoring endpoints (api/debug/profile, metrics),
+# without a token they are closed, but in development mode to requests
+# from this machine that did not go through a proxy
+MONITORING_TOKEN = os.environ.get("FAMILYTIMELINE_MONITORING_TOKEN")
+
 # Disable default login when using OAuth
 DEFAULT_LOGIN_ENABLED = True
 
@@ -113,6 +156,36 @@ T_FOLDER = required_folder(APP_FOLDER, "translations")
 USE_SCHEDULER = False
 SCHEDULER_MAX_CONCURRENT_RUNS = 1
 
+# Soft delete compaction, a scheduler task (see compaction.py)
+SOFT_DELETE_RETENTION_DAYS = 7  # deleted people can be restored this long
+GC_INTERVAL = 3600  # seconds between compaction runs
+GC_BATCH_SIZE = 200  # rows deleted per transaction
+GC_MAX_BATCHES = 50  # per table and run
+GC_OFF_PEAK_HOURS = (2, 5)  # local hours [start, end) when VACUUM may run
+GC_VACUUM_PAGES = 2000  # pages released per incremental vacuum
+
+# Background jobs (see jobs.py), run by the scheduler when USE_SCHEDULER
+# is on, else by a thread pool in the web process
+JOBS_THREADS = 2
+JOBS_MAX_PER_FAMILY = 1  # jobs running at the same time for one family
+JOBS_RETRY_DELAY = 30  # seconds before a retry, doubled after every attempt
+JOBS_BUSY_DELAY = 5  # seconds before a job waiting for its family tries again
+JOBS_HEARTBEAT = 30  # seconds between the heartbeats of the running jobs
+JOBS_HEARTBEAT_TIMEOUT = 120  # seconds without heartbeat before a running job is stale
+
+# Process pool for CPU-bound tree and image work (see compute.py)
+COMPUTE_WORKERS = os.cpu_count() or 1  # 0 computes in the request thread
+COMPUTE_MAX_PENDING = 4 * COMPUTE_WORKERS  # more concurrent calls get ComputeBusy
+COMPUTE_TIMEOUT = 30  # seconds a request waits for a result
+COMPUTE_START_METHOD = "spawn"
+COMPUTE_INLINE_BELOW = 500  # people; smaller families skip the pool overhead
+
+# Family invitations
+INVITATION_EXPIRY_DAYS = 7
+INVITATION_MAX_BULK = 500  # invitations per bulk request
+INVITATION_RETENTION_DAYS = 30  # expired or used invitations are then swept
+INVITATION_SWEEP_INTERVAL = 86400  # seconds between sweeper runs
+
 # Celery settings (alternative to the build-in scheduler)
 USE_CELERY = False
 CELERY_BROKER = "redis://localhost:6379/0"
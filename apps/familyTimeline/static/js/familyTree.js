@@ -514,16 +514,25 @@ class SimpleFamilyTree {
             console.log('👥 People loaded:', this.people.length, this.people);
             console.log('🔗 Relationships loaded:', this.relationships.length, this.relationships);
             
-            // Load story counts for each person
-            for (let person of this.people) {
+            // Load story counts for everyone in one batched request
+            if (this.people.length > 0) {
                 try {
-                    const storiesResponse = await fetch(`/familyTimeline/api/person/${person.id}/stories`);
-                    const storiesData = await storiesResponse.json();
-                    person.story_count = storiesData.stories ? storiesData.stories.length : 0;
-                    console.log(`📖 Person ${person.first_name} has ${person.story_count} stories`);
+                    const ids = this.people.map(person => person.id).join(',');
+                    const countsResponse = await fetch(`/familyTimeline/api/people/batch?ids=${ids}&include=story_counts`);
+                    const countsData = await countsResponse.json();
+                    const counts = {};
+                    for (const person of countsData.people || []) {
+                        counts[person.id] = person.story_count;
+                    }
+                    for (let person of this.people) {
+                        person.story_count = counts[person.id] || 0;
+                    }
+                    console.log('📖 Story counts loaded:', counts);
                 } catch (error) {
-                    console.warn(`⚠️ Could not load stories for person ${person.id}:`, error);
-                    person.story_count = 0;
+                    console.warn('⚠️ Could not load story counts:', error);
+                    for (let person of this.people) {
+                        person.story_count = 0;
+                    }
                 }
             }
             
@@ -1244,12 +1253,26 @@ class SimpleFamilyTree {
         }
     }
     
+    getThemeCatalogue() {
+        // The catalogue URL is content-hashed, so the browser caches it for good
+        if (!this.themeCatalogue) {
+            const url = window.themeCatalogueUrl || '/familyTimeline/api/theme-catalogue';
+            this.themeCatalogue = fetch(url).then(r => r.json());
+        }
+        return this.themeCatalogue;
+    }
+    
+    async getThemeQuestions(themeKey) {
+        const catalogue = await this.getThemeCatalogue();
+        const theme = catalogue.themes.find(t => t.key === themeKey);
+        return { questions: theme ? theme.questions : [] };
+    }
+    
     async loadThemeQuestions(themeKey, form) {
         if (!themeKey) return;
         
         try {
-            const response = await fetch(`/familyTimeline/api/themes/${themeKey}/questions`);
-            const data = await response.json();
+            const data = await this.getThemeQuestions(themeKey);
             
             const questionsContainer = form.querySelector('.theme-questions');
             if (!questionsContainer) return;
@@ -1903,12 +1926,10 @@ class SimpleFamilyTree {
     
     openPersonDetailModal(personId) {
         // Load person details and stories
-        Promise.all([
-            fetch(`/familyTimeline/api/person/${personId}`).then(r => r.json()),
-            fetch(`/familyTimeline/api/person/${personId}/stories`).then(r => r.json())
-        ]).then(([personData, storiesData]) => {
-            if (personData.person) {
-                this.populatePersonModal(personData.person, storiesData.stories || []);
+        fetch(`/familyTimeline/api/people/batch?ids=${personId}&include=stories`).then(r => r.json()).then(data => {
+            const person = data.people && data.people[0];
+            if (person) {
+                this.populatePersonModal(person, person.stories || []);
                 const modal = document.getElementById('personModal');
                 if (modal) {
                     modal.style.display = 'block';
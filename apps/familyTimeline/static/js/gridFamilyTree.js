@@ -2549,12 +2549,26 @@ class GridFamilyTree {
         }
     }
     
+    getThemeCatalogue() {
+        // The catalogue URL is content-hashed, so the browser caches it for good
+        if (!this.themeCatalogue) {
+            const url = window.themeCatalogueUrl || '/familyTimeline/api/theme-catalogue';
+            this.themeCatalogue = fetch(url).then(r => r.json());
+        }
+        return this.themeCatalogue;
+    }
+    
+    async getThemeQuestions(themeKey) {
+        const catalogue = await this.getThemeCatalogue();
+        const theme = catalogue.themes.find(t => t.key === themeKey);
+        return { questions: theme ? theme.questions : [] };
+    }
+    
     async loadThemeQuestions(themeKey, form) {
         if (!themeKey) return;
         
         try {
-            const response = await fetch(`/familyTimeline/api/themes/${themeKey}/questions`);
-            const data = await response.json();
+            const data = await this.getThemeQuestions(themeKey);
             
             const questionsContainer = form.querySelector('.theme-questions');
             if (!questionsContainer) return;
@@ -2807,12 +2821,10 @@ class GridFamilyTree {
     
     openPersonDetailModal(personId) {
         // Load person details and stories
-        Promise.all([
-            fetch(`/familyTimeline/api/person/${personId}`).then(r => r.json()),
-            fetch(`/familyTimeline/api/person/${personId}/stories`).then(r => r.json())
-        ]).then(([personData, storiesData]) => {
-            if (personData.person) {
-                this.populatePersonModal(personData.person, storiesData.stories || []);
+        fetch(`/familyTimeline/api/people/batch?ids=${personId}&include=stories`).then(r => r.json()).then(data => {
+            const person = data.people && data.people[0];
+            if (person) {
+                this.populatePersonModal(person, person.stories || []);
                 const modal = document.getElementById('personModal');
                 if (modal) {
                     modal.style.display = 'block';
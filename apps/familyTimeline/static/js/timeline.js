@@ -21,14 +21,15 @@ class FamilyTimeline {
     
     async loadThemes() {
         try {
-            const response = await fetch('/api/themes');
+            // One cached bundle holds every theme and its questions
+            const response = await fetch(window.themeCatalogueUrl || '/familyTimeline/api/theme-catalogue');
             const data = await response.json();
             this.themes = {};
             
             for (const theme of data.themes) {
                 this.themes[theme.key] = {
                     name: theme.name,
-                    questions: await this.loadThemeQuestions(theme.key)
+                    questions: theme.questions
                 };
             }
         } catch (error) {
@@ -51,16 +52,16 @@ class FamilyTimeline {
         if (!this.familyCode) return;
         
         try {
-            const response = await fetch(`/api/memories/${this.familyCode}`);
+            const response = await fetch(`/familyTimeline/api/family/${this.familyCode}/timeline?zoom=year`);
             const data = await response.json();
             
-            // Organize memories by year
+            // Organize memories by year (the server already bucketed them)
             this.memories = {};
-            for (const memory of data.memories) {
-                if (!this.memories[memory.year]) {
-                    this.memories[memory.year] = [];
+            for (const bucket of data.buckets) {
+                const stories = bucket.items.filter(item => item.kind === 'story');
+                if (stories.length > 0) {
+                    this.memories[bucket.key] = stories;
                 }
-                this.memories[memory.year].push(memory);
             }
             
             this.updateTimelineDisplay();
@@ -304,7 +305,7 @@ class FamilyTimeline {
                     '<div class="story-date">Added on ' + new Date(memory.created_at).toLocaleDateString() + '</div>' +
                     questionsHtml +
                     '<div class="story-text">' + memory.story_text + '</div>' +
-                    (memory.has_photo ? '<img src="/api/photos/' + memory.id + '" class="story-photo" alt="Memory photo">' : '');
+                    (memory.has_photo ? '<img src="' + memory.photo_url + '" class="story-photo" alt="Memory photo">' : '');
                 storiesContainer.appendChild(storyDiv);
             }
         } else {
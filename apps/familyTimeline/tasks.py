@@ -1,5 +1,7 @@
 from .common import scheduler, settings
-from .models import db
+from .compaction import compact, sweep
+from .jobs import job_queue
+from .models import db, delete_people, update_generation_levels, calculate_tree_positions
 
 # #######################################################
 # Use the built-in scheduler (nothing to install)
@@ -18,13 +20,46 @@ def my_task(**inputs):
     return {}
 
 
+# background jobs, run by the scheduler or the jobs thread pool (see jobs.py)
+@job_queue.task("delete_people", inputs=dict(person_ids=list), retries=2, timeout=600)
+def delete_people_job(job, person_ids):
+    job.progress(0, "Deleting %d people" % len(person_ids))
+    return delete_people(person_ids)
+
+
+@job_queue.task("tree_layout", inputs=dict(root_person_id=int), timeout=300)
+def tree_layout_job(job, root_person_id=None):
+    job.progress(0, "Computing generations")
+    levels = update_generation_levels(job.family_id)
+    job.progress(0.5, "Computing positions")
+    positions = calculate_tree_positions(job.family_id, root_person_id)
+    return dict(generation_levels_changed=levels, positions_changed=positions)
+
+
+# jobs whose process is gone, and the pending ones (see jobs.py)
+job_queue.recover()
+
+
 if settings.USE_SCHEDULER:
     # register your tasks with the scheduler
     scheduler.register_task("my_task", my_task)
+    scheduler.register_task("compact", compact)
+    scheduler.register_task("sweep_invitations", sweep)
 
     # enqueue runs (here or in actions) for example
     if db(db.task_run).count() < 1:
         scheduler.enqueue_run("my_task", inputs={}, timeout=2, period=10)
+    if db(db.task_run.name == "compact").isempty():
+        scheduler.enqueue_run(
+            "compact", inputs={}, timeout=settings.GC_INTERVAL, period=settings.GC_INTERVAL
+        )
+    if db(db.task_run.name == "sweep_invitations").isempty():
+        scheduler.enqueue_run(
+            "sweep_invitations",
+            inputs={},
+            timeout=settings.INVITATION_SWEEP_INTERVAL,
+            period=settings.INVITATION_SWEEP_INTERVAL,
+        )
 
 # manage your tasks via dashboard or Grid(path, db.task_run)
 
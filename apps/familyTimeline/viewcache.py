@@ -0,0 +1,113 @@
+"""
+Compiled templates for the familyTimeline pages
+
+py4web renders a template with its Renoir engine that compiles it on the
+first request of every process and then, at every render, stats the file
+and what it extends or includes and hashes their source to find out if
+it changed. ViewCache owns an engine for the templates folder:
+
+    views = ViewCache(settings.TEMPLATES_FOLDER, check_mtime=True)
+    views.precompile()  # all of them, before the first request
+
+    @action.uses(profiler, views.fixture("tree.html"), db, session)
+
+With check_mtime (development) it behaves as py4web does; without it
+(production) a compiled template is used as it is and rendering does not
+touch the disk.
+"""
+
+import os
+import re
+import time
+
+from py4web import URL, request
+from py4web.core import HELPERS, Renoir, Template
+
+from .logs import get_logger
+
+DELIMITERS = ("[[", "]]")
+
+# a layout, only compiled as part of the templates extending it
+REGEX_LAYOUT = re.compile(r"\[\[\s*include\s*\]\]")
+
+log = get_logger("viewcache")
+
+
+class ViewCache:
+    """Compiled templates of a folder, see the module docstring"""
+
+    def __init__(self, path, check_mtime=True, on_render=None):
+        self.path = path
+        # py4web's engine, it understands the helpers in [[=...]]
+        self.engine = Renoir(path=path, delimiters=DELIMITERS, reload=check_mtime)
+        self.compiled = set()
+        # called with the seconds spent after every render
+        self.on_render = on_render
+
+    def compile(self, filename):
+        file_path = os.path.join(self.path, filename)
+        source = self.engine.prerender(self.engine.load(file_path), file_path)
+        self.engine.parse(file_path, source, {})
+        self.compiled.add(filename)
+
+    def precompile(self):
+        """Compiles every template of the folder but the layouts,
+        {filename: milliseconds} (or the error, if it does not compile)"""
+        report = {}
+        for root, _, files in os.walk(self.path):
+            for name in sorted(files):
+                if not name.endswith(".html"):
+                    continue
+                filename = os.path.relpath(os.path.join(root, name), self.path)
+                start = time.perf_counter()
+                try:
+                    if REGEX_LAYOUT.search(self.engine.load(os.path.join(root, name))):
+                        continue
+                    self.compile(filename)
+                except Exception as err:  # pylint: disable=broad-exception-caught
+                    # raised again when the template is rendered
+                    log.error("template %s does not compile: %r", filename, err)
+                    report[filename] = repr(err)
+                    continue
+                report[filename] = round((time.perf_counter() - start) * 1000, 2)
+        return report
+
+    def render(self, filename, context):
+        start = time.perf_counter()
+        text = self.engine.render(filename, context)
+        self.compiled.add(filename)
+        if self.on_render:
+            self.on_render(time.perf_counter() - start)
+        return text
+
+    def fixture(self, filename):
+        """A Template fixture rendering filename from this cache"""
+        return CompiledTemplate(self, filename)
+
+
+class CompiledTemplate(Template):
+    """py4web's Template fixture, rendering through a ViewCache"""
+
+    def __init__(self, views, filename):
+        super().__init__(filename, path=views.path, delimiters=" ".join(DELIMITERS))
+        self.views = views
+
+    def on_success(self, context):
+        output = context["output"]
+        if not isinstance(output, dict):
+            return
+        # the same names py4web gives to its templates
+        ctx = dict(request=request)
+        ctx.update(HELPERS)
+        ctx.update(URL=URL)
+        ctx.update(context["template_inject"])
+        ctx.update(output)
+        ctx["__vars__"] = output
+        filename = self.filename
+        if (
+            filename not in self.views.compiled
+            and not os.path.exists(os.path.join(self.path, filename))
+            and os.path.exists(os.path.join(self.path, "generic.html"))
+        ):
+            filename = "generic.html"
+        context["output"] = self.views.render(filename, ctx)
@@ -0,0 +1,153 @@
+"""
+Throughput of the compute pool kernels against the number of workers.
+
+    python benchmarks/compute.py [--people 2000] [--families 64]
+                                 [--kernels tree_layout,generation_levels]
+                                 [--workers 1,2,4] [--output FILE]
+
+The pool (apps/familyTimeline/compute.py) and its kernels are loaded by
+path, without importing py4web or the app, and run on family graphs
+generated in memory. For every worker count the same families are
+submitted at once, so the pool stays saturated, and the wall time gives
+families per second; "inline" is the same work in this process.
+
+Speedup is throughput over the one worker throughput and efficiency is
+speedup per worker: near 1.0 means the kernels scale with the cores, a
+drop shows the pickling or the machine (see "cpu_count") as the limit.
+The results are printed as JSON, with the git commit.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPUTE_PATH = os.path.join(ROOT, "apps", "familyTimeline", "compute.py")
+
+
+def load_compute():
+    spec = importlib.util.spec_from_file_location("familytimeline_compute", COMPUTE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_graph(people, rng, marriage_rate=0.7, children=(1, 4)):
+    """(person_ids, parent_edges, spouse_edges) of a family of people"""
+    person_ids, parent_edges, spouse_edges = [], [], []
+
+    def new_person():
+        person_ids.append(len(person_ids) + 1)
+        return person_ids[-1]
+
+    generation = [new_person()]
+    while len(person_ids) < people:
+        next_generation = []
+        for person_id in generation:
+            if len(person_ids) >= people or rng.random() > marriage_rate:
+                continue
+            spouse_id = new_person()
+            spouse_edges.append((person_id, spouse_id))
+            for _ in range(rng.randint(*children)):
+                if len(person_ids) >= people:
+                    break
+                child_id = new_person()
+                parent_edges.append((person_id, child_id))
+                parent_edges.append((spouse_id, child_id))
+                next_generation.append(child_id)
+        # a generation without children starts another lineage
+        generation = next_generation or [new_person()]
+    return person_ids, parent_edges, spouse_edges
+
+
+def measure(pool, kernel, graphs, inline=False):
+    started = time.perf_counter()
+    if inline:
+        for graph in graphs:
+            pool.run(kernel, *graph, inline=True)
+    else:
+        futures = [pool.submit(kernel, *graph) for graph in graphs]
+        for future in futures:
+            future.result()
+    seconds = time.perf_counter() - started
+    return dict(seconds=round(seconds, 3), per_second=round(len(graphs) / seconds, 2))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--people", type=int, default=2000, help="per family")
+    parser.add_argument("--families", type=int, default=64)
+    parser.add_argument("--kernels", default="tree_layout,generation_levels")
+    parser.add_argument(
+        "--workers",
+        default=",".join(str(n) for n in sorted({1, 2, 4, cpu_count}) if n <= cpu_count),
+    )
+    parser.add_argument("--start-method", default="spawn")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    compute = load_compute()
+    rng = random.Random(args.seed)
+    graphs = [generate_graph(args.people, rng) for _ in range(args.families)]
+    workers = [int(n) for n in args.workers.split(",")]
+
+    results = {}
+    for kernel in args.kernels.split(","):
+        pool = compute.ComputePool(workers=0)
+        results[kernel] = {"inline": measure(pool, kernel, graphs, inline=True)}
+        for count in workers:
+            pool = compute.ComputePool(
+                workers=count, max_pending=len(graphs), start_method=args.start_method
+            )
+            measure(pool, kernel, graphs[:count])  # start the workers outside the timing
+            results[kernel][count] = measure(pool, kernel, graphs)
+            pool.shutdown()
+        base = results[kernel][workers[0]]["per_second"] / workers[0]
+        for count in workers:
+            speedup = results[kernel][count]["per_second"] / base
+            results[kernel][count]["speedup"] = round(speedup, 2)
+            results[kernel][count]["efficiency"] = round(speedup / count, 2)
+        print("%s done" % kernel, file=sys.stderr)
+
+    output = {
+        "commit": git_commit(),
+        "cpu_count": cpu_count,
+        "start_method": args.start_method,
+        "dataset": {
+            "families": args.families,
+            "people": args.people,
+            "parent_edges": sum(len(graph[1]) for graph in graphs),
+            "spouse_edges": sum(len(graph[2]) for graph in graphs),
+            "seed": args.seed,
+        },
+        "kernels": results,
+    }
+    print(json.dumps(output, indent=2))
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(output, fp, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,324 @@
+"""
+Load test for the familyTimeline API with a synthetic family.
+
+    python benchmarks/load.py [--people 200] [--generations 5] [--stories 3]
+                              [--photo-rate 0.3] [--photo-size 20000:200000]
+                              [--concurrency 1,4,16] [--requests 200]
+                              [--scenarios tree,stories,...] [--bulk]
+                              [--output FILE] [--compare OLD.json]
+
+Like startup.py, the apps folder is copied to a scratch directory so the
+real database is never touched. The app is imported in this process, a
+user and a family are generated (see synthetic.py) and the actions are
+called through an in-process WSGI client, from a thread pool per
+concurrency level, so no server or network is involved.
+
+The results (latency percentiles, throughput, bytes, errors per scenario
+and concurrency, plus the dataset and the git commit) are printed as
+JSON. With --compare, the p50/p95 of a previous result file are compared
+and the exit status is 1 when one got slower than --threshold times.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from synthetic import generate_family
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS_FOLDER = os.path.join(ROOT, "apps")
+IGNORED = shutil.ignore_patterns("databases", "uploads", "__pycache__", "*.pyc")
+
+EMAIL = "benchmark@example.com"
+PASSWORD = "benchmark-password-1"
+
+# name -> function(dataset, rng) returning the path to request
+SCENARIOS = {
+    "tree": lambda data, rng: "api/tree/%d" % data["family_id"],
+    "stories": lambda data, rng: "api/person/%d/stories" % rng.choice(data["people"]),
+    "story_photo": lambda data, rng: "api/story-photo/%d" % rng.choice(data["photos"]),
+    "person_photo": lambda data, rng: (
+        "api/person-photo/%d" % rng.choice(data["profile_photos"])
+    ),
+    "dashboard": lambda data, rng: "dashboard",
+}
+
+
+class WSGIClient:
+    """Minimal in-process client keeping the cookies of the last login"""
+
+    def __init__(self, app, prefix):
+        self.app = app
+        self.prefix = prefix
+        self.cookies = {}
+
+    def request(self, path, method="GET", body=None, extra_environ=None):
+        path, _, query = ("/%s/%s" % (self.prefix, path)).partition("?")
+        data = json.dumps(body).encode() if body is not None else b""
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": query,
+            "SERVER_NAME": "localhost",
+            "SERVER_PORT": "8000",
+            "HTTP_HOST": "localhost:8000",
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(data),
+            "wsgi.errors": io.StringIO(),
+            "CONTENT_LENGTH": str(len(data)),
+            "CONTENT_TYPE": "application/json",
+        }
+        environ.update(extra_environ or {})
+        if self.cookies:
+            environ["HTTP_COOKIE"] = "; ".join(
+                "%s=%s" % item for item in self.cookies.items()
+            )
+        result = {}
+
+        def start_response(status, headers, exc_info=None):
+            result["status"] = int(status.split()[0])
+            result["headers"] = headers
+
+        chunks = self.app(environ, start_response)
+        try:
+            result["body"] = b"".join(
+                chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in chunks
+            )
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+        return result
+
+    def login(self, email, password, path="auth/api/login"):
+        body = dict(email=email, password=password) if email else dict(password=password)
+        result = self.request(path, "POST", body)
+        if result["status"] != 200:
+            raise RuntimeError("login failed: %s" % result["body"][:200])
+        for name, value in result["headers"]:
+            if name.lower() == "set-cookie":
+                key, _, value = value.split(";")[0].partition("=")
+                self.cookies[key] = value
+
+
+def load_app(apps_folder, app_name):
+    """Import the app from the scratch folder, return its module"""
+    os.environ["PY4WEB_APPS_FOLDER"] = apps_folder
+    sys.path.insert(0, os.path.dirname(apps_folder))
+    from py4web.core import Reloader
+
+    with contextlib.redirect_stdout(sys.stderr):  # keep stdout for the JSON
+        Reloader.import_app(app_name)
+    if Reloader.ERRORS.get(app_name):
+        raise RuntimeError(Reloader.ERRORS[app_name])
+    return Reloader.MODULES[app_name]
+
+
+def create_dataset(module, args):
+    """The benchmark user, its family and the synthetic people"""
+    from pydal.validators import CRYPT
+
+    models = sys.modules[module.__name__ + ".models"]
+    db = models.db
+    owner_id = db.auth_user.insert(
+        email=EMAIL,
+        first_name="Bench",
+        last_name="Mark",
+        password=str(CRYPT()(PASSWORD)[0]),
+    )
+    family_id = models.create_family_tree_with_owner("Benchmark family", owner_id)
+    t0 = time.perf_counter()
+    created = generate_family(
+        models,
+        owner_id,
+        family_id,
+        people=args.people,
+        generations=args.generations,
+        marriage_rate=args.marriage_rate,
+        stories_per_person=args.stories,
+        photo_rate=args.photo_rate,
+        photo_size=args.photo_size,
+        seed=args.seed,
+        bulk=args.bulk,
+    )
+    db.commit()
+    created.update(family_id=family_id, generate_seconds=time.perf_counter() - t0)
+    return created
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+def run_scenario(client, dataset, scenario, concurrency, requests, seed):
+    """Send requests from concurrency threads, return the latency stats"""
+    rng = random.Random(seed)
+    paths = [SCENARIOS[scenario](dataset, rng) for _ in range(requests)]
+    latencies, errors, nbytes = [], [], [0]
+    lock = threading.Lock()
+
+    def one(path):
+        t0 = time.perf_counter()
+        result = client.request(path)
+        elapsed = time.perf_counter() - t0
+        with lock:
+            latencies.append(elapsed)
+            nbytes[0] += len(result["body"])
+            if result["status"] >= 400:
+                errors.append(result["status"])
+
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(one, paths))
+    wall = time.perf_counter() - t0
+    ms = [t * 1000 for t in latencies]
+    return {
+        "requests": len(ms),
+        "errors": len(errors),
+        "error_statuses": sorted(set(errors)),
+        "rps": round(len(ms) / wall, 2),
+        "mean_ms": round(statistics.mean(ms), 3),
+        "p50_ms": round(percentile(ms, 0.50), 3),
+        "p95_ms": round(percentile(ms, 0.95), 3),
+        "p99_ms": round(percentile(ms, 0.99), 3),
+        "max_ms": round(max(ms), 3),
+        "avg_bytes": sum(nbytes) // len(ms),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold):
+    """Ratios new/old of p50 and p95, returns (report, regressions)"""
+    report, regressions = {}, []
+    for scenario, levels in new["scenarios"].items():
+        for level, stats in levels.items():
+            before = old.get("scenarios", {}).get(scenario, {}).get(level)
+            if not before:
+                continue
+            ratios = {
+                key: round(stats[key] / before[key], 3) if before[key] else None
+                for key in ("p50_ms", "p95_ms")
+            }
+            report.setdefault(scenario, {})[level] = ratios
+            if any(ratio and ratio > threshold for ratio in ratios.values()):
+                regressions.append("%s@%s" % (scenario, level))
+    return report, regressions
+
+
+def size_range(text):
+    low, _, high = text.partition(":")
+    return (int(low), int(high or low))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--app", default="familyTimeline")
+    parser.add_argument("--people", type=int, default=200)
+    parser.add_argument("--generations", type=int, default=5)
+    parser.add_argument("--marriage-rate", type=float, default=0.7)
+    parser.add_argument("--stories", type=int, default=3, help="average per person")
+    parser.add_argument("--photo-rate", type=float, default=0.3)
+    parser.add_argument("--photo-size", type=size_range, default=(20000, 200000),
+                        help="bytes, MIN:MAX")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--bulk", action="store_true", help="insert rows directly")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=200, help="per scenario and level")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON file")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    scenarios = [name for name in args.scenarios.split(",") if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error("unknown scenarios: %s" % ", ".join(sorted(unknown)))
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    scratch = tempfile.mkdtemp(prefix="py4web-load-")
+    try:
+        apps_folder = os.path.join(scratch, "apps")
+        shutil.copytree(APPS_FOLDER, apps_folder, ignore=IGNORED)
+        module = load_app(apps_folder, args.app)
+        dataset = create_dataset(module, args)
+
+        from py4web.core import bottle
+
+        client = WSGIClient(bottle.default_app(), args.app)
+        client.login(EMAIL, PASSWORD)
+        results = {}
+        for scenario in scenarios:
+            if scenario == "story_photo" and not dataset["photos"]:
+                continue
+            if scenario == "person_photo" and not dataset["profile_photos"]:
+                continue
+            run_scenario(client, dataset, scenario, 1, args.warmup, args.seed)
+            results[scenario] = {
+                str(level): run_scenario(
+                    client, dataset, scenario, level, args.requests, args.seed
+                )
+                for level in levels
+            }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    output = {
+        "app": args.app,
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "dataset": {
+            "people": len(dataset["people"]),
+            "relationships": dataset["relationships"],
+            "stories": len(dataset["stories"]),
+            "story_photos": len(dataset["photos"]),
+            "profile_photos": len(dataset["profile_photos"]),
+            "photo_size": list(args.photo_size),
+            "seed": args.seed,
+            "bulk": args.bulk,
+            "generate_seconds": round(dataset["generate_seconds"], 3),
+        },
+        "scenarios": results,
+    }
+    regressions = []
+    if args.compare:
+        with open(args.compare) as fp:
+            old = json.load(fp)
+        output["compare"], regressions = compare(old, output, args.threshold)
+        output["compare_to"] = old.get("commit")
+        output["regressions"] = regressions
+    print(json.dumps(output, indent=2))
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(output, fp, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Startup benchmark for a py4web app: cold import and hot reload times.
+
+    python benchmarks/startup.py [--app familyTimeline] [--runs 5]
+                                 [--reloads 5] [--profile] [--output FILE]
+
+The apps folder is copied to a scratch directory (without databases/ and
+uploads/) so the real database is never touched. The first cold run
+creates a new database; the following cold runs measure a normal worker
+boot against an existing one. Hot reloads call Reloader.import_app again
+in the same process, like the _dashboard reload button does.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS_FOLDER = os.path.join(ROOT, "apps")
+IGNORED = shutil.ignore_patterns("databases", "uploads", "__pycache__", "*.pyc")
+
+
+def child(apps_folder, app_name, reloads, profile):
+    """Runs inside a fresh interpreter, prints one JSON line of timings"""
+    timings = {}
+    t0 = time.perf_counter()
+    from py4web.core import Reloader
+
+    timings["import_py4web"] = time.perf_counter() - t0
+
+    sys.path.insert(0, os.path.dirname(apps_folder))
+    if profile:
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    t0 = time.perf_counter()
+    Reloader.import_app(app_name)
+    timings["import_app"] = time.perf_counter() - t0
+    if profile:
+        profiler.disable()
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
+    if Reloader.ERRORS.get(app_name):
+        raise RuntimeError(Reloader.ERRORS[app_name])
+
+    timings["reloads"] = []
+    for _ in range(reloads):
+        t0 = time.perf_counter()
+        Reloader.import_app(app_name)
+        timings["reloads"].append(time.perf_counter() - t0)
+    print(json.dumps(timings))
+
+
+def run_child(apps_folder, app_name, reloads, profile=False):
+    env = dict(os.environ, PY4WEB_APPS_FOLDER=apps_folder)
+    cmd = [sys.executable, __file__, "--child", apps_folder, "--app", app_name]
+    cmd += ["--reloads", str(reloads)] + (["--profile"] if profile else [])
+    output = subprocess.run(
+        cmd, env=env, check=True, stdout=subprocess.PIPE, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(values):
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "max": max(values),
+        "runs": len(values),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--app", default="familyTimeline")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--reloads", type=int, default=5)
+    parser.add_argument("--profile", action="store_true", help="cProfile one cold import")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.child, args.app, args.reloads, args.profile)
+
+    scratch = tempfile.mkdtemp(prefix="py4web-startup-")
+    try:
+        apps_folder = os.path.join(scratch, "apps")
+        shutil.copytree(APPS_FOLDER, apps_folder, ignore=IGNORED)
+        first = run_child(apps_folder, args.app, 0)
+        runs = [
+            run_child(apps_folder, args.app, args.reloads, args.profile and i == 0)
+            for i in range(args.runs)
+        ]
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    results = {
+        "app": args.app,
+        "python": sys.version.split()[0],
+        "first_boot": first["import_app"],
+        "import_py4web": summarize([r["import_py4web"] for r in runs]),
+        "cold_import": summarize([r["import_app"] for r in runs]),
+        "hot_reload": summarize([t for r in runs for t in r["reloads"]] or [0.0]),
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Synthetic family generator for benchmarks and load tests.
+
+    from synthetic import generate_family
+    stats = generate_family(models, owner_id, family_id, people=200, seed=1)
+
+Families grow from a founding couple: every married couple gets children,
+each child marries (an in-law is added) with probability marriage_rate,
+for up to generations. New founding couples are added until the family
+has the requested number of people. Every person gets about
+stories_per_person stories; a photo_rate share of the people and stories
+get a random JPEG-like blob of photo_size bytes (an (min, max) range).
+
+By default the rows are written through models.add_person,
+add_relationship and save_person_story, exactly like the controllers do
+(one commit per call). With bulk=True they are inserted directly with a
+single commit at the end, which is much faster for large families.
+The same seed always produces the same family.
+"""
+
+import datetime
+import random
+
+FIRST_NAMES = (
+    "Anna", "Bjorn", "Clara", "David", "Elsa", "Frans", "Greta", "Hugo",
+    "Ingrid", "Johan", "Karin", "Lars", "Maja", "Nils", "Olga", "Per",
+    "Rut", "Sven", "Tove", "Ulf", "Vera", "Erik", "Linnea", "Oskar",
+)
+LAST_NAMES = (
+    "Andersson", "Berg", "Dahl", "Ek", "Falk", "Holm", "Lind", "Lund",
+    "Nyberg", "Sandberg", "Strom", "Wall",
+)
+PLACES = ("Stockholm", "Goteborg", "Malmo", "Uppsala", "Lulea", "Visby")
+WORDS = (
+    "summer", "house", "lake", "winter", "school", "father", "mother",
+    "boat", "garden", "dinner", "letter", "journey", "music", "war",
+    "wedding", "farm", "city", "train", "holiday", "workshop",
+)
+JPEG_HEADER = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+
+GENERATION_YEARS = 28  # years between a parent's and a child's birth
+
+
+def random_photo(rng, size):
+    """A JPEG-looking blob of a size drawn from the (min, max) range"""
+    nbytes = rng.randint(*size) if isinstance(size, (tuple, list)) else size
+    return JPEG_HEADER + rng.randbytes(max(0, nbytes - len(JPEG_HEADER)))
+
+
+def random_text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+class ModelWriter:
+    """Writes through the models helpers used by the controllers"""
+
+    def __init__(self, models, owner_id, family_id):
+        self.models = models
+        self.db = models.db
+        self.owner_id = owner_id
+        self.family_id = family_id
+
+    def person(self, **fields):
+        return self.models.add_person(
+            self.family_id, created_by_user_id=self.owner_id, **fields
+        )
+
+    def relationship(self, person1_id, person2_id, relationship_type, **fields):
+        return self.models.add_relationship(
+            self.family_id,
+            person1_id,
+            person2_id,
+            relationship_type,
+            created_by_user_id=self.owner_id,
+            **fields
+        )
+
+    def story(self, person_id, **fields):
+        return self.models.save_person_story(
+            self.family_id, person_id, self.owner_id, **fields
+        )
+
+    def done(self):
+        self.db.commit()
+
+
+class BulkWriter(ModelWriter):
+    """Inserts the same rows directly, committing once in done()"""
+
+    RECIPROCAL = {"parent": "child", "spouse": "spouse"}
+
+    def person(self, **fields):
+        return self.db.people.insert(
+            family_id=self.family_id,
+            created_by_user_id=self.owner_id,
+            last_edited_by_user_id=self.owner_id,
+            **fields
+        )
+
+    def relationship(self, person1_id, person2_id, relationship_type, **fields):
+        table = self.db.relationships
+        common = dict(family_id=self.family_id, created_by_user_id=self.owner_id)
+        rel_id = table.insert(
+            person1_id=person1_id,
+            person2_id=person2_id,
+            relationship_type=relationship_type,
+            **common,
+            **fields
+        )
+        # like add_relationship, the reciprocal row carries no dates
+        table.insert(
+            person1_id=person2_id,
+            person2_id=person1_id,
+            relationship_type=self.RECIPROCAL[relationship_type],
+            **common
+        )
+        return rel_id
+
+    def story(self, person_id, **fields):
+        return self.db.stories.insert(
+            family_id=self.family_id,
+            person_id=person_id,
+            author_user_id=self.owner_id,
+            last_edited_by_user_id=self.owner_id,
+            **fields
+        )
+
+
+def generate_family(
+    models,
+    owner_id,
+    family_id,
+    people=100,
+    generations=5,
+    marriage_rate=0.7,
+    children=(1, 4),
+    stories_per_person=3,
+    photo_rate=0.3,
+    photo_size=(20000, 200000),
+    start_year=1880,
+    seed=0,
+    bulk=False,
+):
+    """Fill family_id with a synthetic family, returns what was created
+
+    The result is a dict with the 'people', 'stories', 'photos'
+    (ids of stories with a photo) and 'profile_photos' (ids of people
+    with one) lists and the number of 'relationships'.
+    """
+    rng = random.Random(seed)
+    # the catalogue keys, so that stories take the paths real ones do
+    themes = tuple(models.THEME_NAMES)
+    writer = (BulkWriter if bulk else ModelWriter)(models, owner_id, family_id)
+    today = datetime.date.today()
+    created = dict(people=[], stories=[], photos=[], profile_photos=[], relationships=0)
+
+    def new_person(year, last_name, gender):
+        birth = datetime.date(year, rng.randint(1, 12), rng.randint(1, 28))
+        age = rng.gauss(78, 12)
+        death = birth + datetime.timedelta(days=int(age * 365.25))
+        fields = dict(
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=last_name,
+            gender=gender,
+            birth_date=birth,
+            birth_place=rng.choice(PLACES),
+            bio_summary=random_text(rng, 30),
+            generation_level=(year - start_year) // GENERATION_YEARS,
+        )
+        if death < today:
+            fields.update(death_date=death, is_living=False)
+        if rng.random() < photo_rate:
+            fields.update(
+                profile_photo=random_photo(rng, photo_size),
+                profile_photo_filename="portrait.jpg",
+            )
+        person_id = writer.person(**fields)
+        created["people"].append(person_id)
+        if "profile_photo" in fields:
+            created["profile_photos"].append(person_id)
+
+        count = rng.randint(0, 2 * stories_per_person) if stories_per_person else 0
+        for _ in range(count):
+            year_occurred = min(today.year, year + rng.randint(5, 70))
+            story = dict(
+                author_name="Synthetic",
+                title=random_text(rng, 4)[:-1],
+                theme=rng.choice(themes),
+                year_occurred=year_occurred,
+                story_text=random_text(rng, rng.randint(50, 400)),
+            )
+            if rng.random() < photo_rate:
+                story.update(
+                    photo_data=random_photo(rng, photo_size), photo_filename="photo.jpg"
+                )
+            story_id = writer.story(person_id, **story)
+            created["stories"].append(story_id)
+            if "photo_data" in story:
+                created["photos"].append(story_id)
+        return person_id
+
+    def marry(person_id, year, last_name, gender):
+        spouse_gender = "female" if gender == "male" else "male"
+        spouse_id = new_person(year + rng.randint(-4, 4), rng.choice(LAST_NAMES), spouse_gender)
+        married = datetime.date(year + rng.randint(20, 32), rng.randint(1, 12), 1)
+        writer.relationship(person_id, spouse_id, "spouse", marriage_date=married)
+        created["relationships"] += 2
+        return spouse_id
+
+    def room():
+        return people - len(created["people"])
+
+    def lineage():
+        """A founding couple and up to generations of descendants"""
+        family_name = rng.choice(LAST_NAMES)
+        year = start_year + rng.randint(0, 20)
+        founder = new_person(year, family_name, "male")
+        couples = [(founder, marry(founder, year, family_name, "male"), year, family_name)]
+        for _ in range(1, generations):
+            next_couples = []
+            for parent1, parent2, year, last_name in couples:
+                for _ in range(rng.randint(*children)):
+                    if room() <= 0:
+                        return
+                    child_year = year + GENERATION_YEARS + rng.randint(-6, 6)
+                    gender = rng.choice(("male", "female"))
+                    child = new_person(child_year, last_name, gender)
+                    for parent in (parent1, parent2):
+                        writer.relationship(parent, child, "parent")
+                        created["relationships"] += 2
+                    if room() > 0 and rng.random() < marriage_rate:
+                        spouse = marry(child, child_year, last_name, gender)
+                        next_couples.append((child, spouse, child_year, last_name))
+            if not next_couples:
+                return
+            couples = next_couples
+
+    # small or unlucky lineages die out, start new ones until people is reached
+    while room() > 0:
+        lineage()
+
+    writer.done()
+    return created
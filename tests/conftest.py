@@ -0,0 +1,86 @@
+"""
+Fixtures for the familyTimeline tests
+
+As the benchmarks do, the apps folder is copied to a scratch directory,
+the app is imported in this process and its actions are called through
+the in-process WSGI client of benchmarks/load.py.
+"""
+
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from load import APPS_FOLDER, IGNORED, WSGIClient, load_app  # noqa: E402
+
+APP_NAME = "familyTimeline"
+EMAIL = "test@example.com"
+PASSWORD = "test-password-1"
+DASHBOARD_PASSWORD = "dashboard-password-1"
+
+
+@pytest.fixture(scope="session")
+def app():
+    scratch = tempfile.mkdtemp(prefix="py4web-tests-")
+    try:
+        apps_folder = os.path.join(scratch, "apps")
+        shutil.copytree(APPS_FOLDER, apps_folder, ignore=IGNORED)
+        yield load_app(apps_folder, APP_NAME)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def models(app):
+    return sys.modules[app.__name__ + ".models"]
+
+
+@pytest.fixture(scope="session")
+def owner_id(models):
+    from pydal.validators import CRYPT
+
+    db = models.db
+    user_id = db.auth_user.insert(
+        email=EMAIL, first_name="Test", last_name="Owner", password=str(CRYPT()(PASSWORD)[0])
+    )
+    db.commit()
+    return user_id
+
+
+@pytest.fixture
+def client(app, owner_id):
+    from py4web.core import bottle
+
+    client = WSGIClient(bottle.default_app(), APP_NAME)
+    client.login(EMAIL, PASSWORD)
+    return client
+
+
+@pytest.fixture(scope="session")
+def dashboard(app, tmp_path_factory):
+    """_dashboard (full mode) from the scratch apps folder of app"""
+    from py4web.core import Session
+    from pydal.validators import CRYPT
+
+    # set by "py4web run" from its password folder
+    Session.SECRET = Session.SECRET or secrets.token_hex(32)
+    password_file = tmp_path_factory.mktemp("dashboard") / "password.txt"
+    password_file.write_text(str(CRYPT()(DASHBOARD_PASSWORD)[0]))
+    os.environ["PY4WEB_PASSWORD_FILE"] = str(password_file)
+    os.environ["PY4WEB_DASHBOARD_MODE"] = "full"
+    return load_app(os.environ["PY4WEB_APPS_FOLDER"], "_dashboard")
+
+
+@pytest.fixture
+def dashboard_client(dashboard):
+    from py4web.core import bottle
+
+    client = WSGIClient(bottle.default_app(), "_dashboard")
+    client.login(None, DASHBOARD_PASSWORD, path="login")
+    return client
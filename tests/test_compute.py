@@ -0,0 +1,98 @@
+import concurrent.futures
+import json
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def compute(app):
+    return sys.modules[app.__name__ + ".compute"]
+
+
+class StalledExecutor:
+    """Executor whose calls only finish when the test says so"""
+
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        self.futures.append(future)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+@pytest.fixture
+def stalled(compute, monkeypatch):
+    pool = compute.ComputePool(workers=1, max_pending=2, timeout=0.05)
+    executor = StalledExecutor()
+    monkeypatch.setattr(pool, "_get_executor", lambda: executor)
+    return pool, executor
+
+
+def test_busy(compute, stalled):
+    pool, executor = stalled
+    pool.submit("kinship", [], [], 1, 2)
+    pool.submit("kinship", [], [], 1, 2)
+    assert pool.pending == 2
+    # full: refused at once, not queued
+    with pytest.raises(compute.ComputeBusy):
+        pool.submit("kinship", [], [], 1, 2)
+    with pytest.raises(ValueError):
+        pool.submit("no_such_kernel")
+    # a finished call frees its slot
+    executor.futures[0].set_result(None)
+    assert pool.pending == 1
+    pool.submit("kinship", [], [], 1, 2)
+
+
+def test_timeout(compute, stalled):
+    pool, executor = stalled
+    with pytest.raises(compute.ComputeTimeout):
+        pool.run("kinship", [], [], 1, 2)
+    # the call had not started, it was cancelled and released its slot
+    assert executor.futures[0].cancelled()
+    assert pool.pending == 0
+    # inline calls skip the pool
+    assert pool.run("generation_levels", [1, 2], [(1, 2)], [], inline=True) == [0, 1]
+
+
+def test_worker(compute):
+    pool = compute.ComputePool(workers=1, timeout=60)
+    try:
+        assert pool.run("generation_levels", [1, 2], [(1, 2)], []) == [0, 1]
+        assert pool.stats()["started"] and pool.pending == 0
+    finally:
+        pool.shutdown()
+
+
+def test_kinship_busy(client, models, owner_id, compute, monkeypatch):
+    family_id = models.create_family_tree_with_owner("Busy family", owner_id)
+    ann, bob = (
+        models.add_person(family_id, name, "Z", created_by_user_id=owner_id)
+        for name in ("Ann", "Bob")
+    )
+    models.db.commit()
+
+    def busy(name, *args):
+        raise compute.ComputeBusy("full")
+
+    # every family goes to the pool, which is full
+    monkeypatch.setattr(models.settings, "COMPUTE_INLINE_BELOW", 0)
+    monkeypatch.setattr(models.compute_pool, "workers", 1)
+    monkeypatch.setattr(models.compute_pool, "submit", busy)
+    result = client.request(
+        "api/family/%d/kinship?person1=%d&person2=%d" % (family_id, ann, bob)
+    )
+    assert result["status"] == 503
+    assert ("Retry-After", "5") in result["headers"]
+    # generation levels run inline instead
+    result = client.request("api/relationship", method="POST", body=dict(
+        family_id=family_id, person1_id=ann, person2_id=bob, relationship_type="parent",
+    ))
+    assert result["status"] == 200, result["body"][:500]
+    assert models.db.people[bob].generation_level == 1
+    assert json.loads(result["body"])["layout_job_id"] is None
@@ -0,0 +1,58 @@
+import json
+
+
+def get(client, path):
+    result = client.request("rest/familyTimeline/db/" + path)
+    body = json.loads(result["body"]) if result["status"] == 200 else None
+    return result["status"], body
+
+
+def test_rest_leaves_blobs_out(dashboard_client, models, owner_id):
+    db = models.db
+    family_id = models.create_family_tree_with_owner("Rest family", owner_id)
+    person_id = db.people.insert(
+        family_id=family_id, first_name="Blob", last_name="X", profile_photo=b"\xff\xd8photo"
+    )
+    db.commit()
+
+    status, page = get(dashboard_client, "people?@model=true&id.eq=%d" % person_id)
+    assert status == 200
+    assert page["items"][0]["first_name"] == "Blob"
+    assert "profile_photo" not in page["items"][0]
+    assert "profile_photo" not in [field["name"] for field in page["model"]]
+    # one blob on demand
+    result = dashboard_client.request("rest/familyTimeline/db/people/%d/profile_photo" % person_id)
+    assert result["status"] == 200 and result["body"] == b"\xff\xd8photo"
+    result = dashboard_client.request("rest/familyTimeline/db/people/%d/first_name" % person_id)
+    assert result["status"] == 404
+
+
+def test_rest_keyset_pages(dashboard_client, models, owner_id):
+    db = models.db
+    family_id = models.create_family_tree_with_owner("Paged family", owner_id)
+    ids = [
+        db.people.insert(family_id=family_id, first_name="P%d" % i, last_name="Paged")
+        for i in range(7)
+    ]
+    db.commit()
+
+    seen, after = [], ids[0] - 1
+    while True:
+        status, page = get(
+            dashboard_client, "people?last_name.eq=Paged&@limit=3&@after=%d" % after
+        )
+        assert status == 200
+        if not page["items"]:
+            break
+        assert len(page["items"]) <= 3
+        seen.extend(item["id"] for item in page["items"])
+        after = page["items"][-1]["id"]
+    # every row once, none across a page boundary twice
+    assert seen == ids
+
+    # id order pages by @after only, other orders take a bounded @offset
+    assert get(dashboard_client, "people?@offset=3")[0] == 400
+    assert get(dashboard_client, "people?@after=x")[0] == 400
+    assert get(dashboard_client, "people?@order=~id&@after=3")[0] == 400
+    assert get(dashboard_client, "people?@order=first_name&@offset=3")[0] == 200
+    assert get(dashboard_client, "people?@order=first_name&@offset=100000")[0] == 400
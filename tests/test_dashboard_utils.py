@@ -0,0 +1,72 @@
+import gzip
+import io
+import os
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def utils(dashboard):
+    return sys.modules[dashboard.__name__ + ".utils"]
+
+
+@pytest.fixture
+def folder(tmp_path):
+    for name in (
+        "a.py", "b.txt", "static/css/app.css", "static/js/app.js",
+        "databases/storage.db", ".git/HEAD", "uploads/photo.jpg",
+    ):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+    os.symlink(tmp_path / "static", tmp_path / "linked")
+    return tmp_path
+
+
+def test_list_dir(utils, folder):
+    path = str(folder)
+    assert utils.list_dir(path) == [
+        "a.py", "b.txt", "databases/storage.db", "static/css/app.css", "static/js/app.js",
+        "uploads/photo.jpg",
+    ]
+    assert utils.list_dir(path, r"^.+\.py$") == ["a.py"]
+    # files directly in an excluded folder / paths matching the expression
+    assert "databases/storage.db" not in utils.list_dir(
+        path, exclude=[os.path.join(path, "databases")]
+    )
+    assert utils.list_dir(path, exclude_expression=r"^(static|uploads)") == [
+        "a.py", "b.txt", "databases/storage.db",
+    ]
+    # with the folders, the symlinked one is listed but not entered
+    with_dirs = utils.list_dir(path, add_dirs=True)
+    assert "linked" not in with_dirs and "linked/css/app.css" not in with_dirs
+    assert "static" in with_dirs and "static/css" in with_dirs
+    assert len(utils.list_dir(path, maxnum=2)) == 2
+    assert utils.list_dir(path, drop_prefix=False)[0] == os.path.join(path, "a.py")
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_pack_unpack(utils, folder, tmp_path_factory, threads):
+    target = tmp_path_factory.mktemp("unpacked")
+    archive = str(tmp_path_factory.mktemp("packed") / "app.w3p")
+    databases = os.path.join(str(folder), "databases")
+    utils.pack(archive, str(folder), exclude=[databases], threads=threads)
+    utils.unpack(archive, str(target))
+    assert os.path.exists(archive)  # a .w3p is kept
+    assert (target / "static/css/app.css").read_text() == "static/css/app.css"
+    assert (target / "a.py").read_text() == "a.py"
+    assert not (target / "databases/storage.db").exists()
+    assert not (target / ".git").exists()
+
+
+def test_parallel_gzip(utils):
+    data = b"".join(b"line %d\n" % i for i in range(50000))
+    output = io.BytesIO()
+    gz = utils.ParallelGzipFile(output, threads=3, chunk_size=1 << 14)
+    for start in range(0, len(data), 5000):
+        gz.write(data[start:start + 5000])
+    gz.close()
+    gz.close()  # closing twice is harmless
+    assert gzip.decompress(output.getvalue()) == data
+    assert len(output.getvalue()) < len(data) / 3
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def family(models, owner_id):
+    """Ann and Bob married, their child Cid, and Dan, an ex deleted"""
+    db = models.db
+    family_id = models.create_family_tree_with_owner("Preview family", owner_id)
+    ann, bob, cid, dan = (
+        models.add_person(family_id, name, "X", created_by_user_id=owner_id)
+        for name in ("Ann", "Bob", "Cid", "Dan")
+    )
+    models.add_relationship(family_id, ann, bob, "spouse", created_by_user_id=owner_id)
+    models.add_relationship(family_id, ann, cid, "parent", created_by_user_id=owner_id)
+    models.add_relationship(family_id, ann, dan, "spouse", created_by_user_id=owner_id)
+    models.save_person_story(
+        family_id, ann, owner_id, author_name="Test", title="Wedding",
+        theme="general", story_text="...", year_occurred=1970,
+    )
+    db.commit()
+    models.delete_people([dan])
+    return dict(ann=ann, bob=bob, cid=cid, dan=dan)
+
+
+def others(preview):
+    return {rel["other_person"] for rel in preview["relationships"]}
+
+
+def test_delete_preview(client, family):
+    result = client.request("api/person/%d/delete-preview" % family["ann"])
+    assert result["status"] == 200, result["body"][:500]
+    preview = json.loads(result["body"])
+    assert preview["story_count"] == 1
+    # the relationships with the deleted Dan are not listed
+    assert others(preview) == {"Bob X", "Cid X"}
+
+
+def test_branch_delete_preview(client, family):
+    result = client.request("api/person/%d/branch/delete-preview" % family["ann"])
+    assert result["status"] == 200, result["body"][:500]
+    preview = json.loads(result["body"])
+    assert [person["name"] for person in preview["people"]] == ["Ann X", "Cid X"]
+    # Ann and Cid are both in the branch, either can be the other side
+    assert "Bob X" in others(preview)
+    assert "Dan X" not in others(preview)
+    ids = [rel["id"] for rel in preview["relationships"]]
+    assert len(ids) == len(set(ids))
@@ -0,0 +1,81 @@
+import json
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def family(models, owner_id):
+    """Ann and Bob married, their child Cid with a story, and Cid's friend Dan"""
+    family_id = models.create_family_tree_with_owner("Deletion family", owner_id)
+    ann, bob, cid, dan = (
+        models.add_person(family_id, name, "Y", created_by_user_id=owner_id)
+        for name in ("Ann", "Bob", "Cid", "Dan")
+    )
+    models.add_relationship(family_id, ann, bob, "spouse", created_by_user_id=owner_id)
+    models.add_relationship(family_id, ann, cid, "parent", created_by_user_id=owner_id)
+    models.add_relationship(family_id, cid, dan, "sibling", created_by_user_id=owner_id)
+    models.save_person_story(
+        family_id, cid, owner_id, author_name="Test", title="First day",
+        theme="childhood", story_text="...", year_occurred=1980,
+    )
+    models.db.commit()
+    return dict(ann=ann, bob=bob, cid=cid, dan=dan)
+
+
+def call(client, path, method="GET"):
+    result = client.request(path, method=method)
+    assert result["status"] == 200, result["body"][:500]
+    return json.loads(result["body"])
+
+
+def test_branch_delete_and_restore(client, models, family):
+    db = models.db
+    deleted = call(client, "api/person/%d/branch" % family["ann"], "DELETE")
+    # Ann and her child Cid, Cid's story, every link of either (both directions)
+    assert deleted["deleted_people"] == 2
+    assert deleted["deleted_stories"] == 1
+    assert deleted["deleted_relationships"] == 6
+    assert db.people[family["ann"]] is None
+    assert db(db.stories.person_id == family["cid"]).count() == 0
+    assert db(db.relationships.person1_id == family["ann"]).count() == 0
+    assert db.people[family["bob"]] is not None
+
+    restored = call(client, "api/deletions/%s/restore" % deleted["deletion_id"], "POST")
+    assert restored["restored_people"] == 2
+    assert restored["restored_stories"] == 1
+    assert restored["restored_relationships"] == 6
+    assert db.people[family["ann"]] is not None
+    assert db(db.stories.person_id == family["cid"]).count() == 1
+
+
+def test_restore_skips_deleted_relatives(client, models, family):
+    db = models.db
+    cid = call(client, "api/person/%d" % family["cid"], "DELETE")
+    dan = call(client, "api/person/%d" % family["dan"], "DELETE")
+    # the Cid-Dan link went with Cid's delete
+    assert dan["deleted_relationships"] == 0
+
+    restored = call(client, "api/deletions/%s/restore" % cid["deletion_id"], "POST")
+    assert restored["restored_relationships"] == 2  # the links to Ann, not to Dan
+    assert db.people[family["dan"]] is None
+    assert db(db.relationships.person2_id == family["dan"]).count() == 0
+    # restored later, Dan does not get the link back either
+    call(client, "api/deletions/%s/restore" % dan["deletion_id"], "POST")
+    assert db.people[family["dan"]] is not None
+    assert db(db.relationships.person2_id == family["dan"]).count() == 0
+
+
+def test_restore_after_purge(client, app, models, family):
+    compaction = sys.modules[app.__name__ + ".compaction"]
+    db = models.db
+    deleted = call(client, "api/person/%d" % family["cid"], "DELETE")
+    # deleted_at is stored to the second, a cutoff in the future takes it
+    purged = compaction.purge_deleted(retention_days=-1)
+    assert purged["people"] >= 1 and purged["stories"] >= 1
+    assert db(db.people.id == family["cid"], ignore_common_filters=True).count() == 0
+
+    result = client.request(
+        "api/deletions/%s/restore" % deleted["deletion_id"], method="POST"
+    )
+    assert result["status"] == 404
@@ -0,0 +1,89 @@
+import re
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def kryten(dashboard):
+    return sys.modules[dashboard.__name__ + ".diff2kryten"]
+
+
+def diff(*files):
+    """git show output of a commit adding files {name: number of lines}"""
+    lines = ["commit 0123", "Author: Test <test@example.com>", "", "    Add <files>", ""]
+    for name, count in files:
+        lines += [
+            "diff --git a/%s b/%s" % (name, name),
+            "--- /dev/null",
+            "+++ b/%s" % name,
+            "@@ -0,0 +1,%d @@" % count,
+        ]
+        lines += ["+%s line %d" % (name, i) for i in range(count)]
+    return [line + "\n" for line in lines]
+
+
+def contents(html):
+    return re.findall(r'data-content="([^"]*)"', html)
+
+
+def more_urls(html):
+    return re.findall(r'<span class="more" data-src="([^"]*)"( data-auto="1")?>', html)
+
+
+def more_url(index, start):
+    return "more?file=%d&start=%d" % (index, start)
+
+
+def test_render_whole(kryten):
+    html = "".join(kryten.render(diff(("a.py", 3), ("b.js", 2))))
+    assert contents(html) == [
+        "a.py line 0", "a.py line 1", "a.py line 2", "b.js line 0", "b.js line 1",
+    ]
+    assert "Add &lt;files&gt;" in html
+    assert '<div class="filename">a.py (create)</div>' in html
+    assert 'class="language-javascript"' in html
+    assert "block=5;" in html
+    assert not more_urls(html)
+    assert html.endswith("</html>")
+
+
+def test_render_capped(kryten):
+    lines = diff(("a.py", 10), ("b.py", 3), ("c.py", 3))
+    html = "".join(kryten.render(lines, more_url, inline_lines=6, page_lines=4))
+    # a page of a.py, then b.py up to the inline budget, c.py on expansion
+    assert contents(html) == ["a.py line %d" % i for i in range(4)] + ["b.py line 0", "b.py line 1"]
+    assert more_urls(html) == [
+        ("more?file=0&amp;start=4", ""),
+        ("more?file=1&amp;start=2", ""),
+        ("more?file=2&amp;start=0", ' data-auto="1"'),
+    ]
+
+
+def test_render_lines(kryten):
+    lines = diff(("a.py", 3), ("b.py", 10))
+    seen, start = [], 0
+    while True:
+        html = "".join(kryten.render_lines(lines, 1, start, more_url, page_lines=4))
+        seen += contents(html)
+        urls = more_urls(html)
+        if not urls:
+            break
+        assert urls == [("more?file=1&amp;start=%d" % (start + 4), "")]
+        start += 4
+    # the pages cover the file exactly once
+    assert seen == ["b.py line %d" % i for i in range(10)]
+    assert contents("".join(kryten.render_lines(lines, 5, 0, more_url))) == []
+
+
+def test_stops_reading(kryten):
+    # a capped page does not need the lines past the files it shows
+    read = []
+
+    def lines():
+        for line in diff(("a.py", 3), ("b.py", 100)):
+            read.append(line)
+            yield line
+
+    "".join(kryten.render_lines(lines(), 0, 0, more_url, page_lines=2))
+    assert len(read) < 20
@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+
+@pytest.fixture
+def dirindex(dashboard):
+    return sys.modules[dashboard.__name__ + ".dirindex"]
+
+
+def age(*paths):
+    # listings changed within RACY_SECONDS are not kept
+    past = time.time() - 60
+    for path in paths:
+        os.utime(path, (past, past))
+
+
+@pytest.fixture
+def folder(tmp_path):
+    for name in ("static/css/app.css", "templates/index.html", "models.py"):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("")
+    for name in (".git", "__pycache__"):
+        (tmp_path / name).mkdir()
+    (tmp_path / "models.py~").write_text("")
+    age(tmp_path, tmp_path / "static", tmp_path / "static/css", tmp_path / "templates")
+    return tmp_path
+
+
+def test_tree(dirindex, folder):
+    index = dirindex.DirectoryIndex()
+    tree = index.tree(str(folder))
+    assert tree["files"] == ["models.py"]
+    assert [d["name"] for d in tree["dirs"]] == ["static", "templates"]
+    assert tree["dirs"][0]["content"]["dirs"][0]["content"]["files"] == ["app.css"]
+    # one level, the sub folders are fetched when opened
+    tree = index.tree(str(folder), depth=1)
+    assert [d["content"] for d in tree["dirs"]] == [None, None]
+
+
+def test_invalidation(dirindex, folder, monkeypatch):
+    index = dirindex.DirectoryIndex()
+    scans = []
+    scandir = os.scandir
+    monkeypatch.setattr(dirindex.os, "scandir", lambda path: scans.append(path) or scandir(path))
+    index.tree(str(folder))
+    assert len(scans) == 4
+    # unchanged folders are not scanned again
+    scans.clear()
+    index.tree(str(folder))
+    assert scans == []
+
+    (folder / "controllers.py").write_text("")
+    index.tree(str(folder))
+    assert scans == [str(folder)]
+    # changed just now: scanned every time until the mtime is old enough
+    index.tree(str(folder))
+    assert scans == [str(folder)] * 2
+    assert "controllers.py" in index.tree(str(folder))["files"]
+
+    # a removed folder is forgotten with its sub folders
+    for path in (folder / "static/css/app.css", folder / "static/css", folder / "static"):
+        path.unlink() if path.is_file() else path.rmdir()
+    age(folder)
+    assert [d["name"] for d in index.tree(str(folder))["dirs"]] == ["templates"]
+    assert not [path for path in index.entries if "static" in path]
+
+
+def test_bounded_and_loops(dirindex, folder):
+    index = dirindex.DirectoryIndex(max_directories=2)
+    os.symlink(folder, folder / "templates" / "loop")
+    age(folder / "templates")
+    tree = index.tree(str(folder))
+    templates = tree["dirs"][1]["content"]
+    assert [d["name"] for d in templates["dirs"]] == []
+    assert len(index.entries) <= 2
+
+
+def test_walk(dashboard_client):
+    result = dashboard_client.request("walk/familyTimeline?depth=1")
+    tree = json.loads(result["body"])["payload"]
+    assert "models.py" in tree["files"]
+    assert all(d["content"] is None for d in tree["dirs"])
+    assert dashboard_client.request("walk/familyTimeline?depth=0")["status"] == 400
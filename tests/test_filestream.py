@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def filestream(dashboard):
+    return sys.modules[dashboard.__name__ + ".filestream"]
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 100)),
+    ("bytes=10-", (10, 1000)),
+    ("bytes=-100", (900, 1000)),
+    ("bytes=-5000", (0, 1000)),
+    ("bytes=990-5000", (990, 1000)),
+    ("bytes=0-0, 5-9", (0, 1)),  # only the first range
+    ("bytes=1000-", None),
+    ("bytes=-0", None),
+    ("bytes=9-5", None),
+    ("bytes=a-b", None),
+    ("lines=0-9", None),
+])
+def test_parse_range(filestream, header, expected):
+    assert filestream.parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("mmap_min_size", [1 << 30, 1])
+def test_iter_file(filestream, tmp_path, monkeypatch, mmap_min_size):
+    monkeypatch.setattr(filestream, "MMAP_MIN_SIZE", mmap_min_size)
+    data = os.urandom(10000)
+    path = tmp_path / "data.bin"
+    path.write_bytes(data)
+    chunks = list(filestream.iter_file(str(path), 100, 9000, chunk_size=4096))
+    assert [len(chunk) for chunk in chunks] == [4096, 4096, 708]
+    assert b"".join(chunks) == data[100:9000]
+    assert b"".join(filestream.iter_file(str(path), 9000, 20000)) == data[9000:]
+
+
+def test_read_window(filestream, tmp_path):
+    lines = ["line %d é\n" % i for i in range(100)]
+    path = tmp_path / "text.txt"
+    path.write_text("".join(lines), encoding="utf8")
+    path = str(path)
+
+    window = filestream.read_window(path, lines=10)
+    assert window["payload"] == "".join(lines[:10]) and not window["eof"]
+    window = filestream.read_window(path, offset=window["next"], lines=10)
+    assert window["payload"] == "".join(lines[10:20])
+    # by size the window ends on a line boundary
+    window = filestream.read_window(path, max_bytes=25)
+    assert window["payload"] == lines[0] + lines[1]
+    # paging by windows covers the file exactly once
+    text, offset = "", 0
+    while True:
+        window = filestream.read_window(path, offset=offset, max_bytes=64)
+        text += window["payload"]
+        offset = window["next"]
+        if window["eof"]:
+            break
+    assert text == "".join(lines)
+    # a line longer than a window is cut and goes on in the next one
+    long_line = tmp_path / "long.txt"
+    long_line.write_text("x" * 100 + "\n")
+    window = filestream.read_window(str(long_line), max_bytes=30)
+    assert window["payload"] == "x" * 30 and window["next"] == 30
+
+
+def test_endpoints(dashboard_client, app):
+    path = os.path.join(os.path.dirname(app.__file__), "models.py")
+    with open(path, "rb") as fp:
+        data = fp.read()
+
+    result = dashboard_client.request("load_bytes/familyTimeline/models.py",
+                                      extra_environ={"HTTP_RANGE": "bytes=10-19"})
+    headers = dict(result["headers"])
+    assert result["status"] == 206 and result["body"] == data[10:20]
+    assert headers["Content-Range"] == "bytes 10-19/%d" % len(data)
+    result = dashboard_client.request("load_bytes/familyTimeline/models.py",
+                                      extra_environ={"HTTP_RANGE": "bytes=%d-" % len(data)})
+    assert result["status"] == 416
+
+    result = dashboard_client.request("load/familyTimeline/models.py?lines=3")
+    window = json.loads(result["body"])
+    assert window["payload"] == "".join(data.decode("utf8").splitlines(True)[:3])
+    assert window["next"] == len(window["payload"].encode("utf8"))
+    assert dashboard_client.request("load/familyTimeline/models.py?offset=-1")["status"] == 400
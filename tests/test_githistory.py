@@ -0,0 +1,87 @@
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def githistory(dashboard):
+    return sys.modules[dashboard.__name__ + ".githistory"]
+
+
+def git(folder, *args):
+    return subprocess.check_output(
+        ["git", "-c", "user.name=Test", "-c", "user.email=test@example.com"] + list(args),
+        cwd=folder,
+    ).decode().strip()
+
+
+def commit(folder, message):
+    (folder / "file.txt").write_text(message)
+    git(folder, "add", "file.txt")
+    git(folder, "commit", "-q", "-m", message)
+    return git(folder, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def repo(tmp_path):
+    git(tmp_path, "init", "-q", "-b", "main")
+    shas = [commit(tmp_path, "commit %d\n\nbody %d" % (i, i)) for i in range(5)]
+    return tmp_path, shas
+
+
+@pytest.fixture
+def calls(githistory, monkeypatch):
+    calls = []
+    git_output = githistory.git_output
+    monkeypatch.setattr(
+        githistory, "git_output", lambda args, folder: calls.append(args) or git_output(args, folder)
+    )
+    return calls
+
+
+def test_pages(githistory, repo, calls):
+    folder, shas = repo
+    history = githistory.GitHistory(page_size=2)
+    commits, more = history.page(str(folder), 0)
+    assert [c["code"] for c in commits] == [shas[4], shas[3]]
+    assert more and commits[0]["message"] == "commit 4\n\nbody 4\n"
+    assert commits[0]["author"] == "Test <test@example.com>"
+    commits, more = history.page(str(folder), 2)
+    assert [c["code"] for c in commits] == [shas[0]] and not more
+    # cached: no git run to show a page again
+    calls.clear()
+    assert history.page(str(folder), 0)[0][0]["code"] == shas[4]
+    assert calls == []
+
+
+def test_head_moves(githistory, repo, calls):
+    folder, shas = repo
+    history = githistory.GitHistory(page_size=2, cache_size=2)
+    history.page(str(folder), 0)
+    new = commit(folder, "commit 5")
+    assert history.page(str(folder), 0)[0][0]["code"] == new
+    # read from packed-refs too, without asking git
+    git(folder, "pack-refs", "--all")
+    assert not (folder / ".git/refs/heads/main").exists()
+    calls.clear()
+    assert githistory.read_head(str(folder)) == new
+    assert history.page(str(folder), 0)[0][0]["code"] == new
+    assert calls == []
+    # detached
+    git(folder, "checkout", "-q", shas[1])
+    assert history.page(str(folder), 0)[0][0]["code"] == shas[1]
+    assert len(history.pages) == 2
+    history.invalidate(str(folder))
+    assert not history.pages
+
+
+def test_not_a_repo(githistory, tmp_path):
+    assert githistory.GitHistory().page(str(tmp_path), 0) == ([], False)
+
+
+def test_git_lines_stops_early(githistory, repo):
+    folder, shas = repo
+    lines = githistory.git_lines(["log", "--format=%H"], str(folder))
+    assert next(lines).strip() == shas[-1]
+    lines.close()  # the process is killed and reaped
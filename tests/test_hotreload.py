@@ -0,0 +1,108 @@
+import os
+import shutil
+import sys
+
+import pytest
+from load import WSGIClient
+
+APP = "hotapp"
+FILES = {
+    "__init__.py": "from . import controllers, tools\n",
+    "common.py": "GREETING = 'hello'\n",
+    "tools.py": "def shout(text):\n    return text.upper()\n",
+    "controllers.py": (
+        "from py4web import action\n"
+        "from .common import GREETING\n\n"
+        "@action('index')\n"
+        "def index():\n"
+        "    from .tools import shout  # only run when called\n"
+        "    return GREETING + ' v1'\n"
+    ),
+    "templates/index.html": "<p>[[=GREETING]]</p>\n",
+}
+
+
+@pytest.fixture
+def hotreload(dashboard):
+    return sys.modules[dashboard.__name__ + ".hotreload"]
+
+
+@pytest.fixture
+def app_folder():
+    """A small app next to familyTimeline in the scratch apps folder"""
+    folder = os.path.join(os.environ["PY4WEB_APPS_FOLDER"], APP)
+    write(folder, FILES)
+    yield folder
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def write(folder, files):
+    for name, text in files.items():
+        path = os.path.join(folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fp:
+            fp.write(text)
+
+
+def get(path):
+    from py4web.core import bottle
+
+    return WSGIClient(bottle.default_app(), APP).request(path)["body"].decode()
+
+
+def test_importers(hotreload, app_folder):
+    relatives = {name: None for name in FILES if name.endswith(".py")}
+    graph = hotreload.importers(app_folder, "apps." + APP, relatives)
+    assert graph == {
+        "apps.hotapp": {"apps.hotapp.controllers", "apps.hotapp.tools"},
+        "apps.hotapp.common": set(),
+        "apps.hotapp.tools": set(),
+        # py4web is not part of the app, the import in index() is not run on import
+        "apps.hotapp.controllers": {"apps.hotapp.common", "apps.hotapp.common.GREETING"},
+    }
+    assert hotreload.HotReloader.dependents(graph, {"apps.hotapp.common"}) == {
+        "apps.hotapp.common", "apps.hotapp.controllers", "apps.hotapp",
+    }
+
+
+def test_partial_reload(hotreload, app_folder):
+    reloader = hotreload.HotReloader(os.path.dirname(app_folder))
+    assert reloader.reload(APP)["mode"] == "full"
+    assert get("index") == "hello v1"
+    assert reloader.reload(APP)["mode"] == "none"
+    # templates are read at render time
+    write(app_folder, {"templates/index.html": "<p>changed</p>\n"})
+    report = reloader.reload(APP)
+    assert report["mode"] == "none" and report["changed"] == ["templates/index.html"]
+
+    common = sys.modules["apps.hotapp.common"]
+    write(app_folder, {"controllers.py": FILES["controllers.py"].replace("v1", "v2")})
+    report = reloader.reload(APP)
+    assert report["mode"] == "partial" and report["error"] is None
+    assert report["reloaded"] == ["apps.hotapp", "apps.hotapp.controllers"]
+    assert sys.modules["apps.hotapp.common"] is common
+    assert get("index") == "hello v2"
+
+    tools = sys.modules["apps.hotapp.tools"]
+    write(app_folder, {"common.py": "GREETING = 'hi'\n"})
+    report = reloader.reload(APP)
+    assert report["reloaded"] == ["apps.hotapp", "apps.hotapp.common", "apps.hotapp.controllers"]
+    assert sys.modules["apps.hotapp.tools"] is tools
+    assert get("index") == "hi v2"
+
+    # new files need a full import
+    write(app_folder, {"models.py": "\n"})
+    assert reloader.reload(APP)["mode"] == "full"
+
+
+def test_failed_reload(hotreload, app_folder):
+    reloader = hotreload.HotReloader(os.path.dirname(app_folder))
+    reloader.reload(APP)
+    write(app_folder, {"controllers.py": "def broken(:\n"})
+    report = reloader.reload(APP)
+    # the partial import failed, so did the full one it fell back on
+    assert report["mode"] == "full" and "SyntaxError" in report["error"]
+    write(app_folder, {"controllers.py": FILES["controllers.py"]})
+    report = reloader.reload(APP)
+    assert report["error"] is None
+    assert get("index") == "hello v1"
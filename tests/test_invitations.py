@@ -0,0 +1,90 @@
+import json
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def family_id(models, owner_id):
+    family_id = models.create_family_tree_with_owner("Invitation family", owner_id)
+    models.db.commit()
+    return family_id
+
+
+def invite(client, family_id, *entries):
+    result = client.request(
+        "api/family/%d/invitations" % family_id, method="POST",
+        body=dict(invitations=list(entries)),
+    )
+    return result["status"], json.loads(result["body"])
+
+
+def test_bulk_invite(client, models, family_id):
+    db = models.db
+    status, result = invite(
+        client, family_id,
+        dict(email="Ann@Example.com", role="editor"),
+        dict(email="ann@example.com"),
+        dict(email="bob@example.com"),
+    )
+    assert status == 200
+    # normalised and deduplicated, the role defaults to viewer
+    invited = {(row["email"], row["role"]) for row in result["invited"]}
+    assert invited == {("ann@example.com", "editor"), ("bob@example.com", "viewer")}
+    assert db(db.family_invitations.family_id == family_id).count() == 2
+
+    # pending invitations are not sent again
+    status, result = invite(
+        client, family_id, dict(email="bob@example.com"), dict(email="cid@example.com")
+    )
+    assert [row["email"] for row in result["invited"]] == ["cid@example.com"]
+    assert result["already_invited"] == ["bob@example.com"]
+
+
+def test_invalid_entries(client, models, family_id, monkeypatch):
+    db = models.db
+    status, result = invite(
+        client, family_id,
+        dict(email="ok@example.com"),
+        dict(email="not-an-email"),
+        dict(email="own@example.com", role="owner"),
+    )
+    # all or nothing
+    assert status == 400
+    assert [(error["index"], error["error"]) for error in result["errors"]] == [
+        (1, "Invalid email"), (2, "Invalid role"),
+    ]
+    assert db(db.family_invitations.family_id == family_id).count() == 0
+
+    monkeypatch.setattr(models.settings, "INVITATION_MAX_BULK", 2)
+    entries = [dict(email="user%d@example.com" % i) for i in range(3)]
+    assert client.request(
+        "api/family/%d/invitations" % family_id, method="POST", body=dict(invitations=entries)
+    )["status"] == 400
+
+
+def test_sweep(app, models, owner_id, family_id):
+    compaction = sys.modules[app.__name__ + ".compaction"]
+    db = models.db
+    now = datetime.utcnow()
+    old = now - timedelta(days=models.settings.INVITATION_RETENTION_DAYS + 1)
+    rows = dict(
+        expired_long_ago=dict(expires_at=old),
+        used_long_ago=dict(expires_at=now + timedelta(days=1), used_at=old),
+        expired_recently=dict(expires_at=now - timedelta(days=1)),
+        pending=dict(expires_at=now + timedelta(days=1)),
+    )
+    ids = {
+        name: db.family_invitations.insert(
+            family_id=family_id, email="%s@example.com" % name, role="viewer",
+            invited_by=owner_id, invitation_token=name + str(family_id), **fields
+        )
+        for name, fields in rows.items()
+    }
+    db.commit()
+
+    swept = compaction.sweep_invitations(batch_size=1)
+    assert swept["expired"] >= 1 and swept["used"] >= 1
+    left = {row.id for row in db(db.family_invitations.family_id == family_id).select()}
+    assert left == {ids["expired_recently"], ids["pending"]}
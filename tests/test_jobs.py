@@ -0,0 +1,158 @@
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from pydal import DAL, Field
+
+DEAD_PID = 2 ** 30  # above any pid_max
+
+
+@pytest.fixture
+def jobs(app, models, monkeypatch):
+    """jobs.py on an in-memory database, with dispatch recorded, not run"""
+    jobs = sys.modules[app.__name__ + ".jobs"]
+    db = DAL("sqlite:memory")
+    db.define_table("auth_user", Field("email"))
+    db.define_table("families", Field("family_name"))
+    db.define_table("jobs", *[field.clone() for field in models.db.jobs if field.name != "id"])
+    monkeypatch.setattr(jobs, "db", db)
+    monkeypatch.setattr(jobs.settings, "JOBS_MAX_PER_FAMILY", 1)
+    yield jobs
+    db.close()
+
+
+@pytest.fixture
+def queue(jobs):
+    queue = jobs.JobQueue()
+    queue.dispatched = []
+    queue.dispatch = lambda job_id, task, delay=0: queue.dispatched.append((job_id, delay))
+    return queue
+
+
+def add_job(jobs, name, family_id=None, **fields):
+    job_id = jobs.db.jobs.insert(name=name, family_id=family_id, inputs={}, **fields)
+    jobs.db.commit()
+    return job_id
+
+
+def test_check_inputs(queue):
+    @queue.task("count", inputs=dict(person_ids=list, limit=int))
+    def count(job, person_ids, limit=10):
+        return len(person_ids[:limit])
+
+    task = queue.tasks["count"]
+    task.check_inputs(dict(person_ids=[1]))
+    for inputs, error in [
+        (dict(person_ids=[1], other=1), "Unknown inputs"),
+        (dict(limit=1), "Missing inputs"),
+        (dict(person_ids="1"), "must be list"),
+        (dict(person_ids=[1], limit=True), "must be int"),
+    ]:
+        with pytest.raises(ValueError, match=error):
+            task.check_inputs(inputs)
+
+
+def test_one_job_per_family(jobs, queue):
+    family_id = jobs.db.families.insert(family_name="F")
+    seen = {}
+
+    @queue.task("layout")
+    def layout(job):
+        # the second job of the family is refused while this one runs
+        if job.id == first:
+            seen["second"] = queue.run(second)
+        return {}
+
+    first = add_job(jobs, "layout", family_id)
+    second = add_job(jobs, "layout", family_id)
+    other = add_job(jobs, "layout", jobs.db.families.insert(family_name="G"))
+
+    assert queue.run(first) == "completed"
+    assert seen["second"] == "queued"
+    assert jobs.db.jobs[second].attempts == 0
+    [(job_id, delay)] = queue.dispatched
+    busy = jobs.settings.JOBS_BUSY_DELAY
+    assert job_id == second and busy <= delay <= 2 * busy
+    # once the first is done it runs, other families never waited
+    assert queue.run(second) == "completed"
+    assert queue.run(other) == "completed"
+
+
+def test_retry(jobs, queue):
+    calls = []
+
+    @queue.task("flaky", retries=1)
+    def flaky(job):
+        calls.append(job.id)
+        if len(calls) == 1:
+            raise RuntimeError("first attempt fails")
+        return dict(calls=len(calls))
+
+    job_id = add_job(jobs, "flaky", max_attempts=2)
+    assert queue.run(job_id) == "retrying"
+    job = jobs.db.jobs[job_id]
+    assert job.attempts == 1 and "first attempt fails" in job.error
+    assert queue.dispatched == [(job_id, jobs.settings.JOBS_RETRY_DELAY)]
+
+    assert queue.run(job_id) == "completed"
+    job = jobs.db.jobs[job_id]
+    assert job.attempts == 2 and job.result == dict(calls=2) and job.progress == 1.0
+    # out of attempts it fails for good
+    job_id = add_job(jobs, "flaky", max_attempts=1)
+    calls.clear()
+    assert queue.run(job_id) == "failed"
+
+
+def test_recover_after_restart(jobs, queue):
+    @queue.task("layout")
+    def layout(job):
+        return {}
+
+    now = datetime.utcnow()
+    running = dict(status="running", attempts=1, started_at=now, heartbeat_at=now)
+    # still running here (an app reload does not change the owner)
+    live = add_job(jobs, "layout", owner=jobs.get_owner(), max_attempts=2, **running)
+    # a process of this host that exited, with a retry left
+    gone = add_job(
+        jobs, "layout", owner="%s:%d:x" % (jobs.HOST, DEAD_PID), max_attempts=2, **running
+    )
+    # a previous process that had our pid, no retry left
+    reused = add_job(
+        jobs, "layout", owner="%s:%d:old" % (jobs.HOST, os.getpid()), max_attempts=1, **running
+    )
+    # another host, no heartbeat for too long
+    running["heartbeat_at"] = now - timedelta(seconds=jobs.settings.JOBS_HEARTBEAT_TIMEOUT + 1)
+    silent = add_job(jobs, "layout", owner="other:1:x", max_attempts=2, **running)
+    queued = add_job(jobs, "layout")
+    waiting = add_job(jobs, "layout", status="retrying", scheduled_for=now + timedelta(seconds=60))
+
+    requeued = queue.recover()
+
+    status = {job.id: job.status for job in jobs.db(jobs.db.jobs).select()}
+    assert status[live] == "running"
+    assert status[gone] == status[silent] == "retrying"
+    assert status[reused] == "failed"
+    assert sorted(requeued) == sorted([gone, silent, queued, waiting])
+    delays = dict(queue.dispatched)
+    assert delays[queued] == 0
+    # the backoff is kept
+    assert 55 < delays[waiting] <= 60
+    assert delays[gone] > jobs.settings.JOBS_RETRY_DELAY - 5
+
+
+def test_stale_job_unblocks_family(jobs, queue):
+    @queue.task("layout")
+    def layout(job):
+        return {}
+
+    family_id = jobs.db.families.insert(family_name="F")
+    now = datetime.utcnow()
+    stale = add_job(
+        jobs, "layout", family_id, status="running", attempts=1, max_attempts=1,
+        owner="%s:%d:x" % (jobs.HOST, DEAD_PID), started_at=now, heartbeat_at=now,
+    )
+    waiting = add_job(jobs, "layout", family_id)
+    assert queue.run(waiting) == "queued"
+    assert jobs.db.jobs[stale].status == "failed"
+    assert queue.run(waiting) == "completed"
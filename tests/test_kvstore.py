@@ -0,0 +1,86 @@
+import sys
+import threading
+import time
+
+import pytest
+
+
+@pytest.fixture
+def kvstore(app):
+    return sys.modules[app.__name__ + ".kvstore"]
+
+
+@pytest.fixture
+def kv(kvstore, tmp_path):
+    """A client of a server on a unix socket of tmp_path"""
+    server = kvstore.KVServer("unix://kv.sock", str(tmp_path))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    client = kvstore.connect("unix://kv.sock", str(tmp_path), autostart=False)
+    yield client
+    client.close()
+    server.server.shutdown()
+    server.server.server_close()
+    thread.join(5)
+
+
+def test_commands(kvstore, kv):
+    assert kv.ping() == "PONG"
+    assert kv.set("a", "1") is True
+    assert kv.get("a") == b"1"
+    # only if missing / only if present
+    assert kv.set("a", "2", nx=True) is False
+    assert kv.set("b", "2", xx=True) is False
+    assert kv.get("a") == b"1" and kv.exists("a", "b") == 1
+    assert kv.incr("a") == 2 and kv.incr("counter") == 1
+    assert kv.ttl("a") == -1 and kv.ttl("b") == -2
+    assert kv.delete("a", "b") == 1
+    assert kv.get("a") is None
+    with pytest.raises(kvstore.KVError):
+        kv.execute_command("NOSUCHCOMMAND")
+    with pytest.raises(kvstore.KVError):
+        kv.execute_command("GET")
+
+
+def test_expiry(kv):
+    kv.set("short", "x", px=50)
+    kv.set("long", "x", ex=60)
+    assert kv.ttl("long") == 60
+    kv.set("long", "y", keepttl=True)
+    assert kv.ttl("long") == 60
+    time.sleep(0.1)
+    assert kv.get("short") is None
+    assert kv.dbsize() == 1
+
+
+def test_pipeline(kvstore, kv):
+    pipeline = kv.pipeline()
+    pipeline.set("p", "1").incr("p").get("p").execute_command("NOSUCHCOMMAND")
+    ok, value, data, error = pipeline.execute()
+    # one round trip, errors are returned in place
+    assert (ok, value, data) == (True, 2, b"2")
+    assert isinstance(error, kvstore.KVError)
+
+
+def test_broadcast(kvstore, kv):
+    received = []
+    done = threading.Event()
+
+    def discard(key):
+        received.append(key)
+        done.set()
+
+    listener = kvstore.Broadcast(kv, "test:invalidate")
+    listener.on("session", discard)
+    sender = kvstore.Broadcast(kv, "test:invalidate")
+    sender.origin = "other-process"
+    # the subscription is made by the listener thread
+    deadline = time.monotonic() + 5
+    while kv.publish("test:invalidate", "other-process noop ") == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    listener.send("session", "mine")  # not delivered back
+    sender.send("session", "key with spaces")
+    assert done.wait(5)
+    time.sleep(0.05)
+    assert received == ["key with spaces"]
@@ -0,0 +1,17 @@
+import logging
+import sys
+
+
+def test_quiet_by_default(app, monkeypatch):
+    logs = sys.modules[app.__name__ + ".logs"]
+    for module in ("controllers", "models"):
+        log = logs.get_logger(module)
+        assert not log.isEnabledFor(logging.DEBUG)
+
+    # debug is opt-in, and still capped by the app handlers
+    level = logs.get_logger("controllers").level
+    monkeypatch.setitem(logs.settings.LOG_LEVELS, "controllers", "debug")
+    log = logs.get_logger("controllers")
+    app_level = logging.getLogger(logs.APP_LOGGER_NAME).level
+    assert log.level == max(logging.DEBUG, app_level)
+    log.setLevel(level)
@@ -0,0 +1,66 @@
+import sys
+
+import pytest
+
+
+@pytest.fixture
+def migrations(app):
+    return sys.modules[app.__name__ + ".migrations"]
+
+
+def indexes(db):
+    rows = db.executesql("SELECT name FROM sqlite_master WHERE type = 'index'")
+    return {name for (name,) in rows}
+
+
+def test_applied_once(migrations, models):
+    db = models.db
+    # AUTO_MIGRATE applied all of them when the app was imported
+    assert migrations.get_schema_version() == migrations.MIGRATIONS[-1][0]
+    assert migrations.migrate() == []
+    assert {
+        "idx_family_members_unique",
+        "idx_stories_family_year",
+        "idx_relationships_person1",
+        "idx_people_deleted_at",
+        "idx_jobs_family_status",
+        "idx_family_invitations_family_email",
+    } <= indexes(db)
+    versions = [row.version for row in db(db.schema_version).select()]
+    assert len(versions) == len(set(versions))
+
+
+def test_replay_from_zero(migrations, models):
+    # a database from before schema_version replays every step
+    db = models.db
+    questions = db(db.theme_questions).count()
+    saved = db(db.schema_version).select().as_list()
+    db(db.schema_version).delete()
+    db.commit()
+    try:
+        applied = migrations.migrate()
+        assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+        # the seed is not duplicated
+        assert db(db.theme_questions).count() == questions
+    finally:
+        db(db.schema_version).delete()
+        for row in saved:
+            db.schema_version.insert(**{k: v for k, v in row.items() if k != "id"})
+        db.commit()
+
+
+def test_failed_step(migrations, models, monkeypatch):
+    db = models.db
+    current = migrations.get_schema_version()
+
+    def broken():
+        db.executesql("CREATE INDEX idx_broken ON no_such_table (x)")
+
+    added = [(current + 1, "added", lambda: None), (current + 2, "broken", broken)]
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS + added)
+    with pytest.raises(Exception):
+        migrations.migrate()
+    # the steps before it stay applied, the broken one runs again next time
+    assert migrations.get_schema_version() == current + 1
+    db(db.schema_version.version > current).delete()
+    db.commit()
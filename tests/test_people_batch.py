@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def family(models, owner_id):
+    """Ann with two stories (one with a photo), her son Cid without"""
+    db = models.db
+    family_id = models.create_family_tree_with_owner("Batch family", owner_id)
+    ann = models.add_person(family_id, "Ann", "X", created_by_user_id=owner_id, profile_photo=b"jpg")
+    cid = models.add_person(family_id, "Cid", "X", created_by_user_id=owner_id)
+    models.add_relationship(family_id, ann, cid, "parent", created_by_user_id=owner_id)
+    for title, photo in (("First", None), ("Second", b"photo")):
+        models.save_person_story(
+            family_id, ann, owner_id, author_name="Test", title=title, theme="general",
+            story_text="...", year_occurred=1970, photo_data=photo,
+        )
+    db.commit()
+    return dict(id=family_id, ann=ann, cid=cid)
+
+
+def batch(client, query):
+    result = client.request("api/people/batch?" + query)
+    return result["status"], json.loads(result["body"]) if result["status"] == 200 else None
+
+
+def test_batch(client, family):
+    ids = "%d,%d,999999" % (family["cid"], family["ann"])
+    status, data = batch(client, "ids=%s&include=stories,relationships" % ids)
+    assert status == 200
+    # in the order asked for, unknown ids reported
+    cid, ann = data["people"]
+    assert (cid["first_name"], ann["first_name"]) == ("Cid", "Ann")
+    assert data["missing"] == [999999]
+    assert ann["has_photo"] and not cid["has_photo"]
+    assert ann["story_count"] == 2 and cid["stories"] == []
+    assert [story["has_photo"] for story in ann["stories"]] == [False, True]
+    assert "photo_data" not in ann["stories"][0]
+    # the same rows listed for both sides
+    assert ann["relationships"] and ann["relationships"] == cid["relationships"]
+    assert all({rel["person1_id"], rel["person2_id"]} == {family["ann"], family["cid"]}
+               for rel in ann["relationships"])
+
+
+def test_batch_story_counts(client, family):
+    status, data = batch(client, "ids=%d,%d&include=story_counts" % (family["ann"], family["cid"]))
+    assert status == 200
+    assert [person["story_count"] for person in data["people"]] == [2, 0]
+    assert all("stories" not in person for person in data["people"])
+
+
+def test_batch_errors(client, models, family):
+    db = models.db
+    stranger = db.auth_user.insert(email="stranger@example.com", first_name="S", last_name="S")
+    other = models.create_family_tree_with_owner("Not yours", stranger)
+    hidden = models.add_person(other, "Hidden", "Y", created_by_user_id=stranger)
+    db.commit()
+    assert batch(client, "ids=%d,%d" % (family["ann"], hidden))[0] == 403
+    assert batch(client, "ids=")[0] == 400
+    assert batch(client, "ids=1,x")[0] == 400
+    assert batch(client, "ids=%d&include=secrets" % family["ann"])[0] == 400
@@ -0,0 +1,68 @@
+import sys
+
+
+def test_route_key(app):
+    profiler = sys.modules[app.__name__ + ".profiler"]
+    key = profiler.route_key
+    assert key("GET", "/app/api/person/12/stories", {"person_id": "12"}) == (
+        "GET /app/api/person/<person_id>/stories"
+    )
+    # tokens, and values that also appear in the fixed part of the rule
+    assert key("GET", "/app/api/invite/api", {"token": "api"}) == "GET /app/api/invite/<token>"
+    assert key("GET", "/app/a/1/b/1", {"x": "1", "y": "1"}) == "GET /app/a/<x>/b/<y>"
+    assert key("GET", "/app/static/js/app.js", {"path": "js/app.js"}) == "GET /app/static/<path>"
+    assert key("POST", "/app/api/person/12") == "POST /app/api/person/<id>"
+
+
+def test_routes_are_bounded(app, client, monkeypatch):
+    profiler = sys.modules[app.__name__ + ".profiler"]
+    stats = sys.modules[app.__name__ + ".common"].profiler
+    stats.reset()
+    for version in ("abc", "def", "123"):
+        client.request("api/theme-catalogue/%s" % version)
+    assert list(stats.routes) == ["GET /familyTimeline/api/theme-catalogue/<version>"]
+
+    monkeypatch.setattr(profiler, "MAX_ROUTES", 1)
+    client.request("api/status")
+    assert sorted(stats.routes) == sorted(
+        ["GET /familyTimeline/api/theme-catalogue/<version>", profiler.OTHER_ROUTE]
+    )
+    stats.reset()
+
+
+def test_route_latency_labels(app, client, monkeypatch):
+    profiler = sys.modules[app.__name__ + ".profiler"]
+    metrics = sys.modules[app.__name__ + ".metrics"]
+    stats = sys.modules[app.__name__ + ".common"].profiler
+    stats.reset()
+    monkeypatch.setattr(profiler, "MAX_ROUTES", 1)
+    for version in ("abc", "def"):
+        client.request("api/theme-catalogue/%s" % version)
+    client.request("api/status")
+    text = "\n".join(metrics.route_latency_collector(stats)())
+    assert 'route="/familyTimeline/api/theme-catalogue/<version>"' in text
+    assert 'method="",route="other"' in text
+    assert "abc" not in text and "api/status" not in text
+    stats.reset()
+
+
+def test_monitoring_closed_by_default(app, client, monkeypatch):
+    monitoring = sys.modules[app.__name__ + ".common"].monitoring
+    monkeypatch.setattr(monitoring, "token", None)
+    monkeypatch.setattr(monitoring, "allow_local", True)
+    local = {"REMOTE_ADDR": "127.0.0.1"}
+    for path in ("metrics", "api/debug/profile"):
+        assert client.request(path, extra_environ={"REMOTE_ADDR": "10.1.2.3"})["status"] == 403
+        assert client.request(path, extra_environ=local)["status"] == 200
+        # a reverse proxy on this machine
+        proxied = dict(local, HTTP_X_FORWARDED_FOR="10.1.2.3")
+        assert client.request(path, extra_environ=proxied)["status"] == 403
+
+    monkeypatch.setattr(monitoring, "allow_local", False)
+    assert client.request("metrics", extra_environ=local)["status"] == 403
+
+    monkeypatch.setattr(monitoring, "token", "s3cret")
+    remote = {"REMOTE_ADDR": "10.1.2.3"}
+    assert client.request("metrics", extra_environ=remote)["status"] == 403
+    remote["HTTP_AUTHORIZATION"] = "Bearer s3cret"
+    assert client.request("metrics", extra_environ=remote)["status"] == 200
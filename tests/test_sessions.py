@@ -0,0 +1,79 @@
+import json
+import sys
+
+import pytest
+
+
+class CountingStore:
+    """get/set session storage counting its round trips"""
+
+    def __init__(self):
+        self.data = {}
+        self.gets = self.sets = 0
+
+    def get(self, key):
+        self.gets += 1
+        return self.data.get(key)
+
+    def set(self, key, value, expiration=None):
+        self.sets += 1
+        self.data[key] = value
+
+
+@pytest.fixture
+def sessions(app):
+    return sys.modules[app.__name__ + ".sessions"]
+
+
+def session(user_id, timestamp):
+    return json.dumps(dict(user=dict(id=user_id), timestamp=timestamp, recent_timestamp=timestamp))
+
+
+def test_default_cache_skips_store_reads(app):
+    common = sys.modules[app.__name__ + ".common"]
+    store = CountingStore()
+    cached = common.cached_sessions(store)
+    assert common.broadcast is None and cached.ttl > 0
+
+    cached.set("token", session(1, "t0"), 3600)
+    store.gets = 0
+    for _ in range(5):
+        assert json.loads(cached.get(b"token"))["user"]["id"] == 1
+    assert store.gets == 0
+
+
+def test_ttl_and_writes(sessions, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions.time, "monotonic", lambda: now[0])
+    store = CountingStore()
+    cached = sessions.CachedStore(store, size=10, ttl=3, write_interval=60)
+
+    cached.set("token", session(1, "t0"), 3600)
+    assert store.sets == 1
+    # only the per-request timestamps changed: no write
+    now[0] += 1
+    cached.set("token", session(1, "t1"), 3600)
+    assert store.sets == 1 and cached.get("token") == session(1, "t1")
+    assert store.gets == 0
+    # a real change is written at once
+    cached.set("token", session(2, "t2"), 3600)
+    assert store.sets == 2
+    # after the write interval the timestamps are written too
+    now[0] += 61
+    cached.set("token", session(2, "t3"), 3600)
+    assert store.sets == 3
+    # after the TTL the store is read again, e.g. logged out elsewhere
+    store.data["token"] = None
+    now[0] += 3
+    assert cached.get("token") is None
+    assert store.gets == 1
+
+
+def test_cache_size(sessions):
+    store = CountingStore()
+    cached = sessions.CachedStore(store, size=2, ttl=60)
+    for key in ("a", "b", "c"):
+        cached.set(key, session(1, key))
+    assert list(cached.entries) == ["b", "c"]
+    cached.get("a")
+    assert store.gets == 1
@@ -0,0 +1,15 @@
+from synthetic import generate_family
+
+
+def test_synthetic_stories_use_catalogue_themes(models, owner_id):
+    db = models.db
+    family_id = models.create_family_tree_with_owner("Synthetic family", owner_id)
+    created = generate_family(
+        models, owner_id, family_id, people=12, stories_per_person=3,
+        photo_rate=0, seed=4, bulk=True,
+    )
+    assert created["stories"]
+    themes = {
+        row.theme for row in db(db.stories.id.belongs(created["stories"])).select(db.stories.theme)
+    }
+    assert themes <= set(models.THEME_NAMES)
@@ -0,0 +1,50 @@
+import json
+
+
+def headers(result):
+    return {name.lower(): value for name, value in result["headers"]}
+
+
+def test_versioned_bundle(client, models):
+    catalogue = models.get_theme_catalogue()
+    version = catalogue["version"]
+
+    result = client.request("api/theme-catalogue")
+    assert result["status"] == 200
+    assert headers(result)["etag"] == '"%s"' % version
+    assert headers(result)["cache-control"] == "no-cache"
+    assert json.loads(result["body"]) == catalogue["catalogue"]
+    keys = [theme["key"] for theme in catalogue["catalogue"]["themes"]]
+    assert set(keys) <= set(models.THEME_NAMES)
+
+    result = client.request("api/theme-catalogue/%s" % version)
+    assert result["status"] == 200
+    assert "immutable" in headers(result)["cache-control"]
+    # revalidation
+    etag = {"HTTP_IF_NONE_MATCH": '"%s"' % version}
+    result = client.request("api/theme-catalogue", extra_environ=etag)
+    assert result["status"] == 304 and not result["body"]
+    # a link from an old page
+    result = client.request("api/theme-catalogue/0ld")
+    assert result["status"] in (302, 303)
+    assert headers(result)["location"].endswith("/api/theme-catalogue/%s" % version)
+
+
+def test_catalogue_invalidation(models, monkeypatch):
+    db = models.db
+    before = models.get_theme_catalogue()
+    assert models.get_theme_catalogue() is before  # cached
+
+    question_id = db.theme_questions.insert(
+        theme="childhood", question_text="A new question?", order_index=99
+    )
+    db.commit()
+    after = models.get_theme_catalogue()
+    assert after["version"] != before["version"]
+
+    # a change made by another process, without broadcast: after the TTL
+    db.executesql("DELETE FROM theme_questions WHERE id = %d" % question_id)
+    db.commit()
+    assert models.get_theme_catalogue() is after
+    monkeypatch.setattr(models.settings, "THEME_CATALOGUE_TTL", 0)
+    assert models.get_theme_catalogue()["version"] == before["version"]
@@ -0,0 +1,104 @@
+import datetime
+import sys
+from types import SimpleNamespace
+
+import pytest
+from pydal import DAL
+
+
+@pytest.fixture
+def ticketstore(dashboard, monkeypatch):
+    """ticketstore.py, logging as if in a request of the test's choosing"""
+    ticketstore = sys.modules[dashboard.__name__ + ".ticketstore"]
+    monkeypatch.setattr(ticketstore, "request", SimpleNamespace(
+        path="/app/index", method="GET", environ={"REMOTE_ADDR": "127.0.0.1"}
+    ))
+    return ticketstore
+
+
+@pytest.fixture
+def db():
+    db = DAL("sqlite:memory")
+    yield db
+    db.close()
+
+
+def snapshot(error):
+    return {"exception_value": error, "traceback": "..."}
+
+
+def test_groups(ticketstore, db):
+    store = ticketstore.TicketStore(db, max_per_group=2)
+    uuids = [store.log("app", snapshot("ZeroDivisionError")) for _ in range(3)]
+    # past max_per_group occurrences only count
+    assert uuids[2] == uuids[1] != uuids[0]
+    assert db(db.py4web_error).count() == 2
+    ticketstore.request.path = "/app/other"
+    store.log("app", snapshot("KeyError"))
+    store.log("other_app", snapshot("KeyError"))
+
+    groups = store.get()
+    assert [(g["app_name"], g["path"], g["count"]) for g in groups] == [
+        ("other_app", "/app/other", 1), ("app", "/app/other", 1), ("app", "/app/index", 3),
+    ]
+    assert [g["count"] for g in store.get(app_name="app", search="Zero")] == [3]
+    assert len(store.get(page=1, page_size=2)) == 1
+    ticket = store.get(groups[2]["uuid"])
+    assert ticket["snapshot"]["exception_value"] == "ZeroDivisionError"
+    assert store.get("no-such-uuid") is None
+
+    store.clear()
+    assert store.get() == [] and db(db.py4web_error).isempty()
+
+
+def test_storm_window(ticketstore, db):
+    store = ticketstore.TicketStore(db, max_per_group=1, storm_window=3600)
+    store.log("app", snapshot("Error"))
+    store.log("app", snapshot("Error"))
+    assert db(db.py4web_error).count() == 1
+    # a new window stores snapshots again
+    past = datetime.datetime.utcnow() - datetime.timedelta(hours=2)
+    db(db.py4web_error_group).update(stored_since=past)
+    store.log("app", snapshot("Error"))
+    assert db(db.py4web_error).count() == 2
+    assert db(db.py4web_error_group).select().first().count == 3
+
+
+def test_sweep(ticketstore, db):
+    store = ticketstore.TicketStore(db, max_tickets=3, sweep_batch=2, sweep_interval=3600)
+    for i in range(5):
+        ticketstore.request.path = "/app/%d" % i
+        store.log("app", snapshot("Error"))
+    # the first log swept (nothing to do), the others wait for the interval
+    assert db(db.py4web_error).count() == 5
+    # the oldest beyond max_tickets, sweep_batch at a time
+    assert store.sweep(force=True) == 2
+    assert db(db.py4web_error).count() == 3
+    assert [r.path for r in db(db.py4web_error).select(orderby=db.py4web_error.id)] == [
+        "/app/2", "/app/3", "/app/4",
+    ]
+    # past the retention, tickets and groups both go
+    old = datetime.datetime.utcnow() - datetime.timedelta(days=store.retention_days + 1)
+    db(db.py4web_error.path == "/app/2").update(timestamp=old)
+    db(db.py4web_error_group.path == "/app/2").update(last_seen=old)
+    assert store.sweep() == 0  # not yet
+    assert store.sweep(force=True) == 2
+    assert "/app/2" not in [g["path"] for g in store.get()]
+
+
+def test_regroup(ticketstore, db):
+    store = ticketstore.TicketStore(db)
+    for _ in range(3):
+        store.log("app", snapshot("Error"))
+    # tickets from before the groups existed
+    db(db.py4web_error_group).delete()
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    tickets = db(db.py4web_error).select(orderby=db.py4web_error.id)
+    for age, ticket in enumerate(reversed(tickets)):
+        ticket.update_record(timestamp=now - datetime.timedelta(minutes=age))
+    db.commit()
+    store = ticketstore.TicketStore(db)
+    [group] = store.get()
+    assert group["count"] == 3
+    assert group["uuid"] == tickets.last().uuid
+    assert group["first_seen"] == now - datetime.timedelta(minutes=2)
@@ -0,0 +1,66 @@
+import datetime
+import json
+
+import pytest
+
+
+@pytest.fixture
+def family(models, owner_id):
+    """Ann (1948) married Bob (1950) in 1972, three stories, one undated"""
+    db = models.db
+    family_id = models.create_family_tree_with_owner("Timeline family", owner_id)
+    ann = models.add_person(
+        family_id, "Ann", "X", created_by_user_id=owner_id, birth_date=datetime.date(1948, 3, 1)
+    )
+    bob = models.add_person(
+        family_id, "Bob", "X", created_by_user_id=owner_id,
+        birth_date=datetime.date(1950, 5, 2), death_date=datetime.date(2011, 1, 9),
+    )
+    models.add_relationship(
+        family_id, ann, bob, "spouse", created_by_user_id=owner_id,
+        marriage_date=datetime.date(1972, 6, 1),
+    )
+    for year in (1955, 1972, None):
+        models.save_person_story(
+            family_id, ann, owner_id, author_name="Test", title="Story %s" % year,
+            theme="general", story_text="...", year_occurred=year,
+            photo_data=b"photo" if year == 1972 else None,
+            photo_filename="a.jpg" if year == 1972 else None,
+        )
+    db.commit()
+    return dict(id=family_id, ann=ann, bob=bob)
+
+
+def timeline(client, family_id, query=""):
+    result = client.request("api/family/%d/timeline%s" % (family_id, query))
+    assert result["status"] == 200, result["body"][:500]
+    return json.loads(result["body"])
+
+
+def test_decade_buckets(client, family):
+    data = timeline(client, family["id"])
+    counts = {b["label"]: (b["story_count"], b["event_count"]) for b in data["buckets"]}
+    # births in the 40s and 50s, one marriage (not two reciprocal rows) in the 70s
+    assert counts == {"1940s": (0, 1), "1950s": (1, 1), "1970s": (1, 1), "2010s": (0, 1)}
+    assert [b["key"] for b in data["buckets"]] == [1940, 1950, 1970, 2010]
+    assert data["total_stories"] == 2 and data["total_events"] == 4
+    assert data["undated_story_count"] == 1
+    assert all("items" not in b for b in data["buckets"])
+
+
+def test_year_buckets_and_range(client, family):
+    data = timeline(client, family["id"], "?zoom=year&start=1960&end=1980")
+    [bucket] = data["buckets"]
+    assert bucket["label"] == "1972" and bucket["count"] == 2
+    story, marriage = sorted(bucket["items"], key=lambda item: item["kind"] != "story")
+    assert story["title"] == "Story 1972" and story["has_photo"]
+    assert story["photo_url"].endswith("/api/story-photo/%d" % story["id"])
+    assert marriage["kind"] == "marriage" and marriage["title"] == "Ann X & Bob X"
+    assert sorted(marriage["person_ids"]) == sorted([family["ann"], family["bob"]])
+
+
+def test_timeline_errors(client, family):
+    path = "api/family/%d/timeline" % family["id"]
+    assert client.request(path + "?zoom=century")["status"] == 400
+    assert client.request(path + "?start=then")["status"] == 400
+    assert client.request("api/family/x/timeline")["status"] == 400
@@ -0,0 +1,19 @@
+import sys
+
+
+def test_precompile(app):
+    views = sys.modules[app.__name__ + ".common"].views
+    report = views.precompile()
+    assert report and all(isinstance(ms, float) for ms in report.values()), report
+    # layouts are compiled as part of the pages extending them
+    assert "layout.html" not in report
+    assert set(report) <= views.compiled
+
+
+def test_render_compiled_page(app, client, models, owner_id):
+    views = sys.modules[app.__name__ + ".common"].views
+    family_id = models.create_family_tree_with_owner("Render family", owner_id)
+    result = client.request("tree/%d" % family_id)
+    assert result["status"] == 200, result["body"][:500]
+    assert b"Render family" in result["body"]
+    assert "tree.html" in views.compiled
@@ -0,0 +1,83 @@
+import io
+import os
+import sys
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def zipstream(dashboard):
+    return sys.modules[dashboard.__name__ + ".zipstream"]
+
+
+@pytest.fixture
+def folder(tmp_path):
+    files = {
+        "controllers.py": b"print('hello')\n" * 100,
+        "static/logo.png": os.urandom(3000),
+        "static/big.txt": b"".join(b"line %d\n" % i for i in range(20000)),
+        "static/empty.css": b"",
+        "databases/storage.db": b"data",
+        "__pycache__/controllers.cpython-312.pyc": b"bytecode",
+        ".git/HEAD": b"ref",
+        "controllers.py~": b"backup",
+    }
+    for name, data in files.items():
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+    return tmp_path, files
+
+
+def unzip(data):
+    archive = zipfile.ZipFile(io.BytesIO(data))
+    assert archive.testzip() is None
+    return archive
+
+
+def test_zip_app(zipstream, folder):
+    path, files = folder
+    # pieces smaller than the big file, so it is deflated in parallel
+    chunks = list(zipstream.zip_app(
+        str(path), exclude=["databases"], threads=2, chunk_size=1 << 14, parallel_min_size=1 << 15
+    ))
+    archive = unzip(b"".join(chunks))
+    assert archive.namelist() == [
+        "controllers.py", "static/big.txt", "static/empty.css", "static/logo.png",
+    ]
+    for name in archive.namelist():
+        assert archive.read(name) == files[name]
+    info = {entry.filename: entry for entry in archive.infolist()}
+    # images are stored at level 0, text is deflated
+    assert info["static/logo.png"].compress_size >= len(files["static/logo.png"])
+    assert info["static/big.txt"].compress_size < len(files["static/big.txt"]) / 3
+
+
+def test_zip64(zipstream, folder, monkeypatch):
+    path, files = folder
+    # zip64 local headers and descriptors for every file, and a central
+    # directory starting past 4 GiB as if large files came before
+    monkeypatch.setattr(zipstream, "ZIP64_LIMIT", 0)
+    stream = zipstream.ZipStream()
+    stream.offset = zipstream.MAX_32 + 1
+    data = []
+    for name in ("controllers.py", "static/big.txt"):
+        with open(path / name, "rb") as fp:
+            data.extend(stream.add_file(fp, name))
+    data.extend(stream.close())
+    data = b"".join(data)
+    assert b"PK\x06\x06" in data and b"PK\x06\x07" in data
+    archive = unzip(data)
+    assert archive.read("static/big.txt") == files["static/big.txt"]
+    assert archive.infolist()[1].header_offset > 0
+
+
+def test_packed(dashboard_client):
+    result = dashboard_client.request("packed/familyTimeline.w3p?exclude=databases,uploads")
+    assert result["status"] == 200
+    archive = unzip(result["body"])
+    names = archive.namelist()
+    assert "__init__.py" in names and "models.py" in names
+    assert not [name for name in names if name.startswith(("databases/", "uploads/"))]
+    assert dashboard_client.request("packed/..%2Fetc.w3p")["status"] == 400